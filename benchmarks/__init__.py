@@ -0,0 +1,2 @@
+# a regular package, so it isn't shadowed by a top-level `benchmarks`
+# of installed distributions (i.e. pyarrow wheels ship one)
@@ -0,0 +1,80 @@
+"""
+Compare two results of run_benchmarks.py, i.e. measured before and after a change.
+Exits with 1 if throughput of any stage dropped by more than --threshold,
+so it can fail a CI job.
+
+    python benchmarks/compare.py before.json after.json
+"""
+
+import argparse
+import json
+import sys
+
+
+def load(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def change(before: float | None, after: float | None) -> float | None:
+    if not before or after is None:
+        return None
+    return after / before - 1
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="max allowed drop of throughput, 0.1 is 10%%",
+    )
+    args = parser.parse_args()
+
+    before, after = load(args.before), load(args.after)
+    if before["meta"]["params"] != after["meta"]["params"]:
+        print("Warning: benchmarks were run with different parameters.", file=sys.stderr)
+
+    print(f"before: {before['meta']['commit']}\nafter:  {after['meta']['commit']}\n")
+    print(
+        f"{'stage':<26} {'items/s before':>15} {'items/s after':>15} {'change':>8}"
+        f" {'p99 ms before':>14} {'p99 ms after':>13}"
+    )
+
+    regressions = []
+    for stage, result in after["stages"].items():
+        previous = before["stages"].get(stage, {})
+        if (
+            "skipped" in result
+            or "skipped" in previous
+            or not previous
+            # nothing was measured, i.e. no forwarded messages among a few
+            or not result["items"]
+            or not previous["items"]
+            or result["items_per_sec"] is None
+            or previous["items_per_sec"] is None
+        ):
+            print(f"{stage:<26} {'not compared':>15}")
+            continue
+
+        throughput = change(previous["items_per_sec"], result["items_per_sec"])
+        print(
+            f"{stage:<26} {previous['items_per_sec']:>15,.1f}"
+            f" {result['items_per_sec']:>15,.1f}"
+            f" {'' if throughput is None else f'{throughput:+.1%}':>8}"
+            f" {previous['latency_ms'].get('p99', 0):>14.3f}"
+            f" {result['latency_ms'].get('p99', 0):>13.3f}"
+        )
+        if throughput is not None and throughput < -args.threshold:
+            regressions.append(stage)
+
+    if regressions:
+        print(f"\nThroughput regressed: {', '.join(regressions)}.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Deterministic stand-in for TelegramClient.
+
+Messages are real Telethon objects generated from a seed (the same seed always
+gives the same messages), and requests to Telegram (entity info, custom emojis)
+just wait for a simulated RPC latency, so benchmarks don't need an account,
+a network or a database.
+"""
+
+import asyncio
+import random
+from collections import Counter
+from collections.abc import AsyncIterator
+from datetime import datetime, timedelta, timezone
+
+from telethon import functions
+from telethon.hints import EntitiesLike
+from telethon.tl.custom.message import Message
+from telethon.tl.types import (
+    Channel,
+    ChatPhotoEmpty,
+    Document,
+    DocumentAttributeCustomEmoji,
+    InputStickerSetEmpty,
+    MessageFwdHeader,
+    MessageReactions,
+    MessageReplies,
+    MessageReplyHeader,
+    PeerChannel,
+    ReactionCount,
+    ReactionCustomEmoji,
+    ReactionEmoji,
+)
+from telethon.utils import get_peer_id
+
+START_DATE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+EMOTICONS = ["👍", "❤", "🔥", "😁", "😢", "🤔", "👎", "🎉", "🙏", "😡"]
+WORDS = (
+    "новини війна мир україна київ фронт обстріл ракета енергетика світло "
+    "news war peace ukraine kyiv front attack missile energy power "
+    "заява уряд президент зустріч переговори допомога економіка ціни"
+).split()
+
+# ids of synthetic peers, far from each other so they never collide
+CHANNEL_ID_BASE = 1_000_000_000
+SOURCE_ID_BASE = 2_000_000_000
+CUSTOM_EMOJI_ID_BASE = 5_000_000_000_000_000_000
+
+
+class FakeTelegramClient:
+    def __init__(
+        self,
+        seed: int = 0,
+        latency_ms: float = 50,
+        jitter_ms: float = 10,
+        channels: int = 20,
+        forward_sources: int = 200,
+        custom_emojis: int = 50,
+        forward_share: float = 0.2,
+        reply_share: float = 0.3,
+        custom_reaction_share: float = 0.1,
+    ) -> None:
+        """
+        latency_ms, jitter_ms: mean and standard deviation of a simulated request
+        channels: number of chats messages are spread over
+        forward_sources, custom_emojis: sizes of pools forwards and custom
+        reactions are taken from, so caches get realistic hit rates
+        *_share: fraction of messages that are forwarded / replies,
+        and of reactions that are custom emojis
+        """
+        self.seed = seed
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.channels = channels
+        self.forward_sources = forward_sources
+        self.custom_emojis = custom_emojis
+        self.forward_share = forward_share
+        self.reply_share = reply_share
+        self.custom_reaction_share = custom_reaction_share
+
+        # separate generators, so latencies don't change generated messages
+        self._latency_random = random.Random(f"{seed}-latency")
+        # number of simulated requests by type
+        self.requests: Counter[str] = Counter()
+
+    @property
+    def chat_ids(self) -> list[int]:
+        return [CHANNEL_ID_BASE + i for i in range(self.channels)]
+
+    def is_connected(self) -> bool:
+        return True
+
+    async def connect(self) -> None:
+        pass
+
+    async def start(self) -> "FakeTelegramClient":
+        return self
+
+    async def _wait_for_response(self, request: str) -> None:
+        self.requests[request] += 1
+        latency = self._latency_random.gauss(self.latency_ms, self.jitter_ms)
+        await asyncio.sleep(max(latency, 0) / 1000)
+
+    async def __call__(self, request) -> list[Document]:
+        await self._wait_for_response(type(request).__name__)
+        if isinstance(request, functions.messages.GetCustomEmojiDocumentsRequest):
+            return [self._custom_emoji(document_id) for document_id in request.document_id]
+        raise NotImplementedError(f"{type(request).__name__} isn't simulated.")
+
+    async def get_entity(self, entity: EntitiesLike) -> Channel:
+        await self._wait_for_response("GetEntity")
+        channel_id = get_peer_id(entity, add_mark=False)
+        return Channel(
+            id=channel_id,
+            title=f"Channel {channel_id}",
+            photo=ChatPhotoEmpty(),
+            date=START_DATE,
+            broadcast=True,
+            username=f"channel{channel_id}",
+            participants_count=channel_id % 100_000,
+        )
+
+    def _custom_emoji(self, document_id: int) -> Document:
+        return Document(
+            id=document_id,
+            access_hash=0,
+            file_reference=b"",
+            date=START_DATE,
+            mime_type="application/x-tgsticker",
+            size=0,
+            dc_id=2,
+            attributes=[
+                DocumentAttributeCustomEmoji(
+                    alt=EMOTICONS[document_id % len(EMOTICONS)],
+                    stickerset=InputStickerSetEmpty(),
+                )
+            ],
+        )
+
+    def _reactions(self, rng: random.Random) -> MessageReactions | None:
+        if rng.random() < 0.2:
+            return None
+
+        results = []
+        for emoticon in rng.sample(EMOTICONS, rng.randint(1, 5)):
+            if rng.random() < self.custom_reaction_share:
+                document_id = CUSTOM_EMOJI_ID_BASE + rng.randrange(self.custom_emojis)
+                reaction = ReactionCustomEmoji(document_id=document_id)
+            else:
+                reaction = ReactionEmoji(emoticon=emoticon)
+            results.append(ReactionCount(reaction=reaction, count=rng.randint(1, 500)))
+        return MessageReactions(results=results)
+
+    def message(self, chat_id: int, msg_id: int) -> Message:
+        """The same message for the same seed, chat and id."""
+        rng = random.Random(f"{self.seed}-{chat_id}-{msg_id}")
+        date = START_DATE + timedelta(minutes=msg_id)
+
+        fwd_from = None
+        if rng.random() < self.forward_share:
+            source_id = SOURCE_ID_BASE + rng.randrange(self.forward_sources)
+            fwd_from = MessageFwdHeader(date=date, from_id=PeerChannel(source_id))
+        reply_to = None
+        if msg_id > 1 and rng.random() < self.reply_share:
+            reply_to = MessageReplyHeader(reply_to_msg_id=rng.randint(1, msg_id - 1))
+
+        return Message(
+            id=msg_id,
+            peer_id=PeerChannel(chat_id),
+            date=date,
+            post=True,
+            message=" ".join(rng.choices(WORDS, k=rng.randint(5, 80))),
+            fwd_from=fwd_from,
+            reply_to=reply_to,
+            views=rng.randint(100, 100_000),
+            forwards=rng.randint(0, 1000),
+            replies=MessageReplies(replies=rng.randint(0, 200), replies_pts=0),
+            reactions=self._reactions(rng),
+        )
+
+    def messages(self, count: int) -> list[Message]:
+        """`count` messages spread evenly over all chats, as they'd come live."""
+        chat_ids = self.chat_ids
+        return [
+            self.message(chat_ids[i % len(chat_ids)], i // len(chat_ids) + 1)
+            for i in range(count)
+        ]
+
+    async def iter_messages(
+        self,
+        entity: EntitiesLike,
+        limit: int | None = 100,
+        min_id: int = 0,
+        reverse: bool = False,
+        **kwargs,
+    ) -> AsyncIterator[Message]:
+        """History of a chat, fetched in pages of 100 messages like Telethon does."""
+        chat_id = get_peer_id(entity, add_mark=False)
+        limit = 100 if limit is None else limit
+        msg_ids = range(min_id + 1, min_id + limit + 1)
+        if not reverse:
+            msg_ids = msg_ids[::-1]
+
+        for i, msg_id in enumerate(msg_ids):
+            if i % 100 == 0:
+                await self._wait_for_response("GetHistoryRequest")
+            yield self.message(chat_id, msg_id)
@@ -0,0 +1,271 @@
+"""
+Replay recorded live traffic through the live parser's handler and ingest queue.
+
+Messages recorded with LIVE_RECORD_PATH are fed to the same handler as
+src/live_parser.py at the times they were received, or `--speed` times faster.
+Reports end-to-end latency (from receiving a message to its batch being written
+and indexed) and the point after which the backlog never drains again,
+so capacity can be planned against real traffic shapes.
+
+Documents are written to the configured MESSAGE_REPO and indexes, so point them
+at a scratch database. Telegram requests are answered by FakeTelegramClient.
+
+    python benchmarks/replay_live.py recording.jsonl --speed 10 --output replay.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+from collections.abc import Callable
+from datetime import datetime, timezone
+from typing import Any
+
+import numpy as np
+from telethon.events import NewMessage
+from telethon.tl.custom.message import Message
+
+sys.path.insert(0, os.getcwd())
+sys.path.insert(0, os.path.join(os.getcwd(), "src"))
+from benchmarks.fake_telegram import FakeTelegramClient
+from benchmarks.run_benchmarks import get_commit, summarize
+from live_parser import get_ingest_queue, get_live_pipeline, make_handler
+from parser_helpers import (
+    close_message_indexes,
+    get_async_message_repo,
+    get_chats_to_parse,
+    get_message_indexes,
+)
+from utils.message_helpers import get_dialog_id
+from utils.recording import read_recording
+
+logger = logging.getLogger(__name__)
+
+# arrival rate is reported over this many seconds of replay before the backlog
+RATE_WINDOW = 10.0
+
+
+class IngestTracker:
+    """Messages between arrival and write, and how many of them there are over time."""
+
+    def __init__(self) -> None:
+        self.start = 0.0
+        self.in_pipeline = 0  # arrived, but not queued yet
+        self.queued: dict[tuple[int, int], float] = {}  # key -> arrival time
+        self.latencies: list[float] = []
+        self.skipped = 0
+        self.failed = 0
+        # (seconds since start, pending messages, queue depth)
+        self.samples: list[tuple[float, int, int]] = []
+
+    @property
+    def pending(self) -> int:
+        return self.in_pipeline + len(self.queued)
+
+    async def on_flush(self, documents: list[dict]) -> None:
+        now = asyncio.get_running_loop().time()
+        for doc in documents:
+            arrived_at = self.queued.pop((doc["chat_id"], doc["msg_id"]), None)
+            if arrived_at is not None:
+                self.latencies.append(now - arrived_at)
+
+    async def sample(self, depth: Callable[[], int], interval: float) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            self.samples.append((loop.time() - self.start, self.pending, depth()))
+            await asyncio.sleep(interval)
+
+
+def find_backlog(
+    samples: list[tuple[float, int, int]],
+    arrivals: np.ndarray,
+    last_arrival: float,
+    threshold: int,
+    speed: float,
+) -> dict[str, Any] | None:
+    """
+    Time after which pending messages stay above `threshold` until the end
+    of the recording (in replay and in recorded seconds), and the arrival rate
+    right before it.
+    None if the parser kept up.
+    """
+    during_replay = [sample for sample in samples if sample[0] <= last_arrival]
+    if not during_replay or during_replay[-1][1] <= threshold:
+        return None
+
+    started_at = during_replay[0][0]
+    for t, pending, _ in reversed(during_replay):
+        if pending <= threshold:
+            break
+        started_at = t
+
+    window_start = max(started_at - RATE_WINDOW, 0)
+    window = started_at - window_start
+    arrived = np.count_nonzero((arrivals >= window_start) & (arrivals <= started_at))
+    return {
+        "started_at_sec": round(started_at, 3),
+        "recorded_at_sec": round(started_at * speed, 3),
+        "arrival_rate_per_sec": round(arrived / window, 1) if window else None,
+        "pending_at_end": during_replay[-1][1],
+    }
+
+
+async def replay(
+    recording: list[tuple[float, Message]], args: argparse.Namespace
+) -> dict[str, Any]:
+    client = FakeTelegramClient(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms)
+    chats = get_chats_to_parse()
+    message_repository = await get_async_message_repo()
+    indexes = await get_message_indexes()
+
+    tracker = IngestTracker()
+    pipeline = get_live_pipeline(client, chats)
+    ingest_queue = get_ingest_queue(
+        message_repository, indexes, on_flush=tracker.on_flush
+    )
+    handler = make_handler(pipeline, ingest_queue)
+
+    async def dispatch(message: Message, arrived_at: float) -> None:
+        tracker.in_pipeline += 1
+        try:
+            document = await handler(NewMessage.Event(message))
+        except Exception:
+            logger.exception(f"Failed to handle message {message.id}.")
+            tracker.failed += 1
+            return
+        finally:
+            tracker.in_pipeline -= 1
+
+        if document is None:
+            tracker.skipped += 1
+        else:
+            tracker.queued[(get_dialog_id(message), message.id)] = arrived_at
+
+    first = recording[0][0]
+    # replay time of every message, relative to the start
+    arrivals = np.array([(t - first) / args.speed for t, _ in recording])
+
+    loop = asyncio.get_running_loop()
+    tasks = set()
+    try:
+        async with ingest_queue:
+            tracker.start = loop.time()
+            sampler = asyncio.create_task(
+                tracker.sample(lambda: ingest_queue.depth, args.sample_interval)
+            )
+            for arrival, (_, message) in zip(arrivals, recording):
+                arrived_at = tracker.start + arrival
+                delay = arrived_at - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                # lateness of the event loop counts as latency, as it would live
+                task = asyncio.create_task(dispatch(message, arrived_at))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            await asyncio.gather(*tasks)
+        # the queue drains everything on exit
+        seconds = loop.time() - tracker.start
+        sampler.cancel()
+    finally:
+        await message_repository.disconnect()
+        await close_message_indexes(indexes)
+
+    latency = summarize(tracker.latencies, seconds)
+    return {
+        "meta": {
+            **get_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "recording": args.recording,
+            "recorded_sec": round(recording[-1][0] - first, 3),
+            "params": {
+                name: value
+                for name, value in vars(args).items()
+                if name not in ("recording", "output")
+            },
+            "ingest_queue": {
+                "batch_size": ingest_queue.batch_size,
+                "max_delay_ms": ingest_queue.max_delay * 1000,
+            },
+        },
+        "messages": len(recording),
+        "written": len(tracker.latencies),
+        "skipped": tracker.skipped,
+        "failed": tracker.failed,
+        "seconds": latency["seconds"],
+        "written_per_sec": latency["items_per_sec"],
+        "latency_ms": latency["latency_ms"],
+        "max_pending": max((pending for _, pending, _ in tracker.samples), default=0),
+        "max_queue_depth": max((depth for _, _, depth in tracker.samples), default=0),
+        "backlog": find_backlog(
+            tracker.samples,
+            arrivals,
+            last_arrival=float(arrivals[-1]),
+            # a batch waiting to be filled isn't a backlog
+            threshold=ingest_queue.batch_size,
+            speed=args.speed,
+        ),
+        "requests": dict(client.requests),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "recording", help="file written by live parser (LIVE_RECORD_PATH)"
+    )
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="N times faster than recorded"
+    )
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument(
+        "--sample-interval",
+        type=float,
+        default=0.1,
+        help="seconds between samples of pending messages",
+    )
+    parser.add_argument("--output", help="file for JSON results (STDOUT by default)")
+    args = parser.parse_args()
+    if args.speed <= 0:
+        parser.error("--speed should be positive.")
+
+    recording = sorted(read_recording(args.recording), key=lambda record: record[0])
+    if not recording:
+        parser.error(f"No messages in {args.recording}.")
+
+    results = asyncio.run(replay(recording, args))
+
+    latency = results["latency_ms"]
+    print(
+        f"{results['written']} of {results['messages']} messages written "
+        f"in {results['seconds']:.1f} s at {args.speed}x, "
+        f"latency p50 {latency.get('p50', 0):.1f} ms, "
+        f"p99 {latency.get('p99', 0):.1f} ms",
+        file=sys.stderr,
+    )
+    backlog = results["backlog"]
+    if backlog is None:
+        print("Backlog didn't grow.", file=sys.stderr)
+    else:
+        print(
+            f"Backlog grows from {backlog['started_at_sec']} s of replay "
+            f"({backlog['recorded_at_sec']} s of the recording) "
+            f"at {backlog['arrival_rate_per_sec']} messages/s.",
+            file=sys.stderr,
+        )
+
+    serialized = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output is None:
+        print(serialized)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(serialized + "\n")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+
+    main()
@@ -0,0 +1,319 @@
+"""
+Benchmarks of the ingest hot path on synthetic messages from FakeTelegramClient.
+
+Every stage reports throughput (items per second) and latency percentiles
+of a single item (or a batch, for repositories), and all results are written
+as JSON along with the commit they were measured on, so runs on two commits
+can be compared with benchmarks/compare.py.
+
+    python benchmarks/run_benchmarks.py --messages 2000 --output before.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Awaitable, Callable, Iterable
+from datetime import datetime, timezone
+from typing import Any
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, os.getcwd())
+from benchmarks.fake_telegram import FakeTelegramClient
+from utils.channel_helpers import entity_cache, query_entity_info
+from utils.message_helpers import (
+    CompactMessage,
+    MessagePipeline,
+    custom_emoji_cache,
+    unwrap_reactions,
+)
+from utils.repo.interface import Repository, repository_factory
+
+logger = logging.getLogger(__name__)
+
+# same extractors as channel parser uses
+REGISTERED_METHODS = [
+    "extract_text",
+    "extract_dialog_info",
+    "extract_engagements",
+    "extract_forward_info",
+]
+PERCENTILES = [50, 90, 99]
+
+
+def summarize(latencies: list[float], seconds: float) -> dict[str, Any]:
+    """Throughput and latency percentiles (in ms) of timed items."""
+    latencies_ms = np.array(latencies) * 1000
+    percentiles = {}
+    if len(latencies_ms):
+        values = np.percentile(latencies_ms, PERCENTILES)
+        percentiles = {f"p{q}": round(float(v), 4) for q, v in zip(PERCENTILES, values)}
+        percentiles["max"] = round(float(latencies_ms.max()), 4)
+
+    return {
+        "items": len(latencies),
+        "seconds": round(seconds, 4),
+        "items_per_sec": round(len(latencies) / seconds, 1) if seconds else None,
+        "latency_ms": percentiles,
+    }
+
+
+async def time_each[T](
+    items: Iterable[T], func: Callable[[T], Awaitable[Any]]
+) -> dict[str, Any]:
+    latencies = []
+    start = time.perf_counter()
+    for item in items:
+        item_start = time.perf_counter()
+        await func(item)
+        latencies.append(time.perf_counter() - item_start)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def reset_caches() -> None:
+    entity_cache.clear()
+    custom_emoji_cache.clear()
+
+
+def build_pipeline(client: FakeTelegramClient) -> MessagePipeline:
+    return MessagePipeline(
+        registered_methods=REGISTERED_METHODS,
+        client=client,
+        chats=[{"id": chat_id, "name": f"chat{chat_id}"} for chat_id in client.chat_ids],
+    )
+
+
+async def bench_pipeline(client: FakeTelegramClient, messages: list) -> dict:
+    """Building CompactMessage with all extractors, caches start empty."""
+    reset_caches()
+    client.requests.clear()
+    pipeline = build_pipeline(client)
+    result = await time_each(messages, pipeline)
+    return result | {
+        "requests": dict(client.requests),
+        "caches": {
+            "entities": entity_cache.stats(),
+            "custom_emojis": custom_emoji_cache.stats(),
+        },
+    }
+
+
+async def bench_unwrap_reactions(client: FakeTelegramClient, messages: list) -> dict:
+    reset_caches()
+    client.requests.clear()
+    result = await time_each(
+        (message.reactions for message in messages),
+        lambda reactions: unwrap_reactions(reactions, client),
+    )
+    return result | {
+        "requests": dict(client.requests),
+        "cache": custom_emoji_cache.stats(),
+    }
+
+
+async def bench_query_entity_info(client: FakeTelegramClient, messages: list) -> dict:
+    """Info about sources of forwarded messages."""
+    reset_caches()
+    client.requests.clear()
+    result = await time_each(
+        (message.fwd_from.from_id for message in messages if message.fwd_from),
+        lambda peer: query_entity_info(client, peer),
+    )
+    return result | {"requests": dict(client.requests), "cache": entity_cache.stats()}
+
+
+def bench_repository(
+    repository: Repository, documents: list[CompactMessage], batch_size: int
+) -> dict:
+    """put_many in batches, latency is per batch, throughput is per message."""
+    repository.connect()
+    try:
+        latencies = []
+        start = time.perf_counter()
+        for i in range(0, len(documents), batch_size):
+            # repositories may modify documents (i.e. MongoDB adds _id)
+            batch = [dict(doc) for doc in documents[i : i + batch_size]]
+            batch_start = time.perf_counter()
+            repository.put_many(batch)
+            latencies.append(time.perf_counter() - batch_start)
+        seconds = time.perf_counter() - start
+    finally:
+        repository.disconnect()
+
+    result = summarize(latencies, seconds)
+    result["batches"] = result.pop("items")
+    result["items"] = len(documents)
+    result["items_per_sec"] = round(len(documents) / seconds, 1) if seconds else None
+    return result
+
+
+def bench_repositories(documents: list[CompactMessage], batch_size: int) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        # local repository writes next to the working directory
+        os.chdir(directory)
+        try:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                results["cli"] = bench_repository(
+                    repository_factory("cli", table_name=None), documents, batch_size
+                )
+            for file_format in ("json", "jsonl"):
+                results[f"local_{file_format}"] = bench_repository(
+                    repository_factory(
+                        "local", table_name="messages", file_format=file_format
+                    ),
+                    documents,
+                    batch_size,
+                )
+        finally:
+            os.chdir(cwd)
+
+    results["mongo"] = bench_mongo(documents, batch_size)
+    results["dynamo"] = bench_dynamo(documents, batch_size)
+    return results
+
+
+def bench_mongo(documents: list[CompactMessage], batch_size: int) -> dict:
+    """MongoRepository with an in-process stand-in for the server (mongomock)."""
+    try:
+        import mongomock
+    except ImportError:
+        return {"skipped": "mongomock isn't installed"}
+
+    from utils.repo import mongo
+
+    with mock.patch.object(mongo, "MongoClient", mongomock.MongoClient):
+        repository = mongo.MongoRepository(
+            table_name="benchmarks",
+            collection_name="messages",
+            user="benchmarks",
+            passwd="benchmarks",
+            ip="localhost",
+            port=27017,
+            key_fields=["chat_id", "msg_id"],
+        )
+        return bench_repository(repository, documents, batch_size)
+
+
+def bench_dynamo(documents: list[CompactMessage], batch_size: int) -> dict:
+    """
+    DynamoRepository with an in-process stand-in for DynamoDB (moto).
+    Requests aren't throttled and don't go over the network, so it measures
+    conversion and batching of documents, not DynamoDB itself.
+    """
+    try:
+        from moto import mock_aws
+
+        from utils.repo.dynamo import DynamoRepository
+    except ImportError:
+        return {"skipped": "boto3 or moto isn't installed"}
+
+    with mock_aws():
+        repository = DynamoRepository(table_name="benchmarks")
+        return bench_repository(repository, documents, batch_size)
+
+
+def get_commit() -> dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(
+            subprocess.run(
+                ["git", "status", "--porcelain", "--untracked-files=no"],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": dirty}
+
+
+async def run(args: argparse.Namespace) -> dict:
+    client = FakeTelegramClient(
+        seed=args.seed, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms
+    )
+    messages = client.messages(args.messages)
+
+    stages = {}
+    stages["pipeline"] = await bench_pipeline(client, messages)
+    stages["unwrap_reactions"] = await bench_unwrap_reactions(client, messages)
+    stages["query_entity_info"] = await bench_query_entity_info(client, messages)
+
+    # documents for repositories are built with warm caches and no latency
+    client.latency_ms = client.jitter_ms = 0
+    pipeline = build_pipeline(client)
+    documents = [await pipeline(message) for message in messages]
+    for name, result in bench_repositories(documents, args.batch_size).items():
+        stages[f"repository_{name}"] = result
+
+    return {
+        "meta": {
+            **get_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {
+                name: value for name, value in vars(args).items() if name != "output"
+            },
+        },
+        "stages": stages,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=50,
+        help="simulated Telegram request latency, 0 to measure CPU time only",
+    )
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--output", help="file for JSON results (STDOUT by default)")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    for stage, result in results["stages"].items():
+        if "skipped" in result:
+            print(f"{stage:<26} skipped: {result['skipped']}", file=sys.stderr)
+            continue
+        latency = result["latency_ms"]
+        if not result["items"] or result["items_per_sec"] is None or not latency:
+            # i.e. no forwarded messages among a few generated ones
+            print(f"{stage:<26} nothing to measure", file=sys.stderr)
+            continue
+        print(
+            f"{stage:<26} {result['items_per_sec']:>12,.1f} items/s   "
+            f"p50 {latency['p50']:>9.3f} ms   p99 {latency['p99']:>9.3f} ms",
+            file=sys.stderr,
+        )
+
+    serialized = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output is None:
+        print(serialized)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(serialized + "\n")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+
+    main()
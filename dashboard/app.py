@@ -1,11 +1,15 @@
+import logging
 import os
 import sys
+import time
 
 import dash_bootstrap_components as dbc
 from dash import Dash, Input, Output, callback, dcc, html, page_container, page_registry
 
 sys.path.insert(0, os.getcwd())
-from utils.fetch_data import data_fetcher
+from utils.fetch_data import get_fetcher, refresh
+
+logger = logging.getLogger(__name__)
 
 app = Dash(
     __name__,
@@ -56,6 +60,7 @@ app.layout = dbc.Container(
         ),
         html.Br(),
         dbc.Row([dbc.Col(page_container)]),
+        # time of the last refresh, pages query the database themselves
         dcc.Store(
             id="data-store", data=None, storage_type="memory", clear_data=True  # ?
         ),
@@ -69,15 +74,18 @@ app.layout = dbc.Container(
     Input("refresh-button", "n_clicks"),
 )
 def get_data(n_clicks):
-    print("Getting data from database")
+    logger.info("Refreshing data from database")
+    if n_clicks:
+        # not on page load, so every new viewer doesn't drop results for the rest
+        refresh()
 
-    return repo.get_data()
+    return time.time()
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
 
-    repo = data_fetcher(os.getenv("REPOSITORY_TYPE"))
-    repo.connect()
+    repo = get_fetcher()
 
     try:
         app.run(host="0.0.0.0", port="8050", debug=True)
@@ -1,4 +1,8 @@
-from dash import Input, Output, callback, dash_table, html, register_page
+import math
+
+from dash import Input, Output, callback, dash_table, dcc, html, register_page
+
+from utils.fetch_data import get_fetcher, parse_filter_query
 
 register_page(
     __name__,
@@ -23,10 +27,14 @@ datatable = dash_table.DataTable(
     editable=False,
     cell_selectable=True,  # enables cell copying
     row_deletable=False,
-    filter_action="native",
+    # filtering, sorting and paging are done by the database,
+    # so only the current page is sent to the browser
+    filter_action="custom",
+    filter_query="",
     filter_options={"case": "insensitive"},
-    sort_action="native",
+    sort_action="custom",
     sort_mode="multi",
+    sort_by=[],
     style_cell={
         "textAlign": "left",
         # "minWidth": "100px",
@@ -45,8 +53,10 @@ datatable = dash_table.DataTable(
         # {"if": {"column_id": "Message_ID"}, "width": "10%"},
     ],
     # vertical scrolling
+    page_action="custom",
     page_current=0,
     page_size=100,
+    page_count=None,
     # style_table={
     #     "maxHeight": "500px",
     #     "overflowY": "scroll"
@@ -70,19 +80,48 @@ datatable = dash_table.DataTable(
 )
 
 
+search_input = dcc.Input(
+    id="search-field",
+    type="text",
+    placeholder='search: war peace -russia OR "peace talks"',
+    debounce=True,  # press enter or click elsewhere to finish
+    persistence=True,
+    persistence_type="memory",
+    size="50",
+)
+
 layout = html.Div(
-    [html.Div(id="table-div", children=[datatable]), html.Div(id="placeholder")]
+    [
+        search_input,
+        html.Div(id="table-div", children=[datatable]),
+        html.Div(id="placeholder"),
+    ]
 )
 
 
 @callback(
     Output("table", "data"),
     Output("table", "tooltip_data"),
+    Output("table", "page_count"),
+    Input("table", "page_current"),
+    Input("table", "page_size"),
+    Input("table", "sort_by"),
+    Input("table", "filter_query"),
+    Input("search-field", "value"),
     Input("data-store", "data"),
     prevent_initial_call=False,
 )
-def get_data(data):
+def get_data(page_current, page_size, sort_by, filter_query, search, _):
+
+    data, total = get_fetcher().get_page(
+        page_current=page_current or 0,
+        page_size=page_size,
+        filters=parse_filter_query(filter_query),
+        sort_by=sort_by,
+        search=search,
+    )
 
+    # only for the rows on the page
     tooltip_data = [
         {
             column: {"value": str(value), "type": "markdown"}
@@ -92,4 +131,4 @@ def get_data(data):
         for row in data
     ]
 
-    return data, tooltip_data
+    return data, tooltip_data, max(1, math.ceil(total / page_size))
@@ -3,6 +3,8 @@ import pandas as pd
 import plotly.graph_objs as go
 from dash import Input, Output, callback, dcc, html, register_page
 
+from utils.fetch_data import count_buckets, get_fetcher, normalize_term
+
 register_page(
     __name__,
     path="/trend",
@@ -37,22 +39,25 @@ layout = html.Div(
     Input("data-store", "data"),
     prevent_initial_call=False,
 )
-def plot_trend(word, data):
+def plot_trend(word, _):
     if word:
-        df = pd.DataFrame(data, columns=["Message", "Date", "Chat_Name"])
+        fetcher = get_fetcher()
+        term = normalize_term(word)
+        # counted by parsers, just a lookup of a few hundred buckets
+        trend = fetcher.get_trend(term) if term else None
+        if trend is None:
+            # phrases and boolean queries are looked up in the search index
+            trend = fetcher.get_search_trend(word)
 
-        df["Date"] = pd.to_datetime(df["Date"])
-        dff = (
-            df["Message"]
-            .str.contains(str(word), case=False)
-            .groupby(df["Date"].dt.floor("30min"))
-            .agg(["sum"])
-            .reset_index()
-        )
+        if trend is not None:
+            dff = pd.DataFrame(trend, columns=["Date", "Count"])
+        else:
+            # no indexes, so every message text has to be checked
+            dff = count_matches(word)
 
         fig = go.Figure(
             data=go.Scatter(
-                x=dff["Date"], y=dff["sum"], marker_color="indianred", text="counts"
+                x=dff["Date"], y=dff["Count"], marker_color="indianred", text="counts"
             )
         )
         fig.update_layout(
@@ -68,3 +73,16 @@ def plot_trend(word, data):
 
     elif not word:
         raise dash.exceptions.PreventUpdate
+
+
+def count_matches(word: str) -> pd.DataFrame:
+    columns = get_fetcher().get_columns()
+
+    matches = (
+        pd.Series(columns["Message"], dtype=object)
+        .str.contains(str(word), case=False, regex=False)
+        .fillna(False)
+        .to_numpy(dtype=bool)
+    )
+    trend = count_buckets(columns["Date"], matches)
+    return pd.DataFrame(trend, columns=["Date", "Count"])
@@ -0,0 +1,262 @@
+"""
+Messages moved out of MongoDB by the retention job (src/archive_messages.py):
+Parquet files partitioned by day and chat, see utils/archive.py of parsers.
+
+Filters, sorting and limits are applied by Arrow while reading, and only
+the rows that are shown are converted to Python objects.
+"""
+
+import os
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from utils.fetch_data import Columns, Filter, date_range, parse_display_date
+
+# same as in utils/archive.py of parsers: <path>/day=2024-05-01/chat_id=123/
+PARTITIONING = ds.partitioning(
+    pa.schema([("day", pa.date32()), ("chat_id", pa.int64())]), flavor="hive"
+)
+SCHEMA = pa.schema(
+    [
+        ("chat_id", pa.int64()),
+        ("msg_id", pa.int64()),
+        ("date", pa.timestamp("ms", tz="UTC")),
+        ("msg", pa.string()),
+        ("chat_name", pa.string()),
+    ]
+)
+# table column -> archived field
+COLUMN_FIELDS = {"Message": "msg", "Date": "date", "Chat_Name": "chat_name"}
+# fields a row is found by again
+KEY_FIELDS = ["chat_id", "msg_id", "date"]
+
+_COMPARISONS = {
+    "=": pc.equal,
+    "!=": pc.not_equal,
+    "<": pc.less,
+    "<=": pc.less_equal,
+    ">": pc.greater,
+    ">=": pc.greater_equal,
+}
+
+
+def _timestamp(date: datetime) -> pa.Scalar:
+    # filters get naive UTC dates
+    return pa.scalar(date.replace(tzinfo=timezone.utc), type=pa.timestamp("ms", "UTC"))
+
+
+def _build_condition(field: str, operator: str, value: str | float) -> ds.Expression:
+    """Archived rows that match a filter, same as filter_mask does for columns."""
+    if field == "date":
+        # dates are filtered as they are shown, i.e. "2024/05" is the whole May
+        start, end = (_timestamp(date) for date in parse_display_date(value))
+        if operator in ("=", "contains", "icontains", "scontains", "datestartswith"):
+            return (ds.field(field) >= start) & (ds.field(field) < end)
+        if operator == "!=":
+            return (ds.field(field) < start) | (ds.field(field) >= end)
+        if operator in (">=", "<"):
+            return _COMPARISONS[operator](ds.field(field), start)
+        # after / not after the whole period
+        return (ds.field(field) >= end) if operator == ">" else (ds.field(field) < end)
+
+    value = str(value)
+    if operator == "datestartswith":
+        return pc.starts_with(ds.field(field), value)
+    if operator in ("contains", "icontains"):
+        return pc.match_substring(ds.field(field), value, ignore_case=True)
+    if operator == "scontains":
+        return pc.match_substring(ds.field(field), value)
+    return _COMPARISONS[operator](ds.field(field), value)
+
+
+def build_condition(filters: list[Filter]) -> ds.Expression | None:
+    """
+    Table filters as a condition on archived rows, None if they don't filter.
+    Partitions of days that Date filters don't allow aren't read.
+    """
+    conditions = []
+    start, end = date_range(filters)
+    if start is not None:
+        conditions.append(ds.field("day") >= start.date())
+    if end is not None:
+        conditions.append(ds.field("day") <= end.date())
+
+    for column, operator, value in filters:
+        field = COLUMN_FIELDS.get(column)
+        if field is None:
+            continue
+        try:
+            conditions.append(_build_condition(field, operator, value))
+        except ValueError:
+            continue  # i.e. half-typed date
+
+    condition = None
+    for part in conditions:
+        condition = part if condition is None else condition & part
+    return condition
+
+
+def keys_condition(chat_ids: np.ndarray, msg_ids: np.ndarray) -> ds.Expression:
+    """
+    Rows with any of the chats and any of the message ids: a superset of the keys,
+    but only partitions of these chats are read.
+    """
+    return ds.field("chat_id").isin(np.unique(chat_ids)) & ds.field("msg_id").isin(
+        np.unique(msg_ids)
+    )
+
+
+def search_ids(table: pa.Table) -> np.ndarray:
+    """Ids of archived rows in the search index (utils/search.py)."""
+    chat_ids = table["chat_id"].to_numpy()
+    msg_ids = table["msg_id"].to_numpy()
+    # chats with ids above 32 bits aren't indexed, 0 (no message) never matches
+    return np.where(
+        (chat_ids >= 0) & (chat_ids <= 0xFFFFFFFF),
+        chat_ids.astype(np.uint64) << np.uint64(32) | msg_ids.astype(np.uint64),
+        np.uint64(0),
+    )
+
+
+def _empty_columns() -> Columns:
+    return {
+        "Message": np.empty(0, dtype=object),
+        "Date": np.empty(0, dtype="datetime64[ms]"),
+        "Chat_Name": np.empty(0, dtype=object),
+    }
+
+
+def build_sort(sort_by: list[dict]) -> list[tuple[str, str]]:
+    """DataTable `sort_by` as (field, order) of archived rows for Table.sort_by."""
+    sort = [
+        (
+            COLUMN_FIELDS[column["column_id"]],
+            "ascending" if column["direction"] == "asc" else "descending",
+        )
+        for column in sort_by or []
+        if column["column_id"] in COLUMN_FIELDS
+    ]
+    # newest first by default, as sort_rows does
+    return sort or [("date", "descending")]
+
+
+class MessageArchive:
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def _get_dataset(self) -> ds.Dataset | None:
+        """
+        None if nothing is archived yet. Files are listed on every call,
+        so partitions written by the job since are picked up.
+        """
+        if not os.path.isdir(self.path):
+            return None
+        dataset = ds.dataset(self.path, format="parquet", partitioning=PARTITIONING)
+        return dataset if dataset.files else None
+
+    def read_table(
+        self, fields: list[str], condition: ds.Expression | None = None
+    ) -> pa.Table:
+        """Fields of archived rows that match a condition."""
+        dataset = self._get_dataset()
+        if dataset is None:
+            return SCHEMA.empty_table().select(fields)
+        return dataset.to_table(columns=fields, filter=condition)
+
+    def count(self, condition: ds.Expression | None = None) -> int:
+        """Number of archived rows that match a condition."""
+        dataset = self._get_dataset()
+        if dataset is None:
+            return 0
+        # without a condition, from Parquet metadata
+        return dataset.count_rows(filter=condition)
+
+    def read_columns(self) -> Columns:
+        """All archived messages, newest first."""
+        table = self.read_table(list(COLUMN_FIELDS.values()))
+        return self._to_columns(table.sort_by([("date", "descending")]))
+
+    def read_top(
+        self, condition: ds.Expression | None, sort_by: list[dict], limit: int
+    ) -> pa.Table:
+        """
+        Keys of the first `limit` rows that match a condition sorted by DataTable
+        `sort_by`, see read_rows. Only the fields rows are sorted by are read.
+
+        Sorted by date, partitions of days are read one by one,
+        newest (or oldest) first, until there are `limit` rows.
+        """
+        sort = build_sort(sort_by)
+        fields = list(dict.fromkeys([*KEY_FIELDS, *(field for field, _ in sort)]))
+        dataset = self._get_dataset()
+        if dataset is None:
+            return SCHEMA.empty_table().select(fields)
+
+        if [field for field, _ in sort] != ["date"]:
+            table = dataset.to_table(columns=fields, filter=condition)
+            return table.sort_by(sort).slice(0, limit)
+
+        days = defaultdict(list)
+        for fragment in dataset.get_fragments(filter=condition):
+            day = ds.get_partition_keys(fragment.partition_expression)["day"]
+            days[day].append(fragment)
+
+        tables = [dataset.schema.empty_table().select(fields)]
+        rows = 0
+        for day in sorted(days, reverse=sort[0][1] == "descending"):
+            for fragment in days[day]:
+                table = fragment.to_table(
+                    schema=dataset.schema, columns=fields, filter=condition
+                )
+                tables.append(table)
+                rows += table.num_rows
+            if rows >= limit:
+                break
+        return pa.concat_tables(tables).sort_by(sort).slice(0, limit)
+
+    def read_rows(self, keys: pa.Table) -> Columns:
+        """
+        Archived messages of rows found by read_top or read_table
+        (with KEY_FIELDS), in the same order.
+        Only partitions of their days and chats are read.
+        """
+        if keys.num_rows == 0:
+            return _empty_columns()
+
+        days = pc.unique(pc.cast(keys["date"], pa.date32()))
+        condition = ds.field("day").isin(days) & keys_condition(
+            keys["chat_id"].to_numpy(), keys["msg_id"].to_numpy()
+        )
+        table = self.read_table(
+            ["chat_id", "msg_id", *COLUMN_FIELDS.values()], condition
+        )
+
+        positions = {
+            key: position
+            for position, key in enumerate(
+                zip(table["chat_id"].to_pylist(), table["msg_id"].to_pylist())
+            )
+        }
+        # rows of files removed since are skipped
+        rows = [
+            positions[key]
+            for key in zip(keys["chat_id"].to_pylist(), keys["msg_id"].to_pylist())
+            if key in positions
+        ]
+        return self._to_columns(table.take(rows))
+
+    @staticmethod
+    def _to_columns(table: pa.Table) -> Columns:
+        return {
+            column: (
+                table[field].cast(pa.timestamp("ms")).to_numpy()
+                if field == "date"
+                else table[field].to_numpy(zero_copy_only=False).astype(object)
+            )
+            for column, field in COLUMN_FIELDS.items()
+        }
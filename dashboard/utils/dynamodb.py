@@ -1,39 +1,119 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import boto3
+import numpy as np
 import pandas as pd
-from dynamodb_json import json_util as json
+from boto3.dynamodb.types import TypeDeserializer
+
+from utils.fetch_data import Columns, Filter, filter_mask, sort_rows, to_records
+
+# attributes written by DynamoRepository
+COLUMNS = ["Message", "Date", "Chat_Name"]
 
 
 class DynamoFetcher:
-    def __init__(self, table_name: str, region: str = "eu-central-1") -> None:
+    def __init__(
+        self,
+        table_name: str,
+        region: str = "eu-central-1",
+        endpoint_url: str | None = None,
+        total_segments: int = 4,
+    ) -> None:
+        """
+        endpoint_url: i.e. http://localhost:8000 for DynamoDB Local
+        total_segments: number of parts of the table scanned in parallel
+        """
         self.region = region
         self.table_name = table_name
+        self.endpoint_url = endpoint_url
+        self.total_segments = total_segments
+
+        self._deserializer = TypeDeserializer()
 
     def connect(self) -> None:
-        self.dynamodb = boto3.client("dynamodb", region_name=self.region)
+        # clients are thread safe, so all segments share one
+        self.dynamodb = boto3.client(
+            "dynamodb", region_name=self.region, endpoint_url=self.endpoint_url
+        )
 
     @staticmethod
-    def _preprocess_data(df: pd.DataFrame) -> pd.DataFrame:
-        return (
-            df
-            # .rename({
-            #     "msg": "Message",
-            #     "date": "Date",
-            #     "chat_name": "Chat_Name"
-            # }, axis=1)
-            .drop("ID", axis=1)
-            .assign(
-                Date=pd.to_datetime(df["Date"])
-                # .dt.tz_localize(tz="UTC")
-                # .dt.tz_convert(tz="Europe/Kyiv")
-                .dt.strftime("%Y/%m/%d %H:%M:%S")
-            )
-            .sort_values(by="Date", ascending=False)[["Message", "Date", "Chat_Name"]]
+    def _to_columns(values: dict[str, list]) -> Columns:
+        """Scanned attributes as columns, newest first, with dates as datetime64."""
+        dates = (
+            pd.to_datetime(values["Date"], utc=True, format="ISO8601")
+            .tz_convert(None)
+            .to_numpy(dtype="datetime64[ms]")
+        )
+        order = np.argsort(dates, kind="stable")[::-1]
+        return {
+            column: (
+                dates if column == "Date" else np.array(values[column], dtype=object)
+            )[order]
+            for column in COLUMNS
+        }
+
+    def _scan_segment(self, segment: int) -> dict[str, list]:
+        """
+        Read one segment of the table page by page (a page is at most 1 MB),
+        converting every page straight into columns.
+        """
+        columns = {column: [] for column in COLUMNS}
+        kwargs = dict(
+            TableName=self.table_name,
+            Segment=segment,
+            TotalSegments=self.total_segments,
+            # only the attributes that are shown, "Date" is a reserved word
+            ProjectionExpression=", ".join(f"#{column}" for column in COLUMNS),
+            ExpressionAttributeNames={f"#{column}": column for column in COLUMNS},
         )
+        while True:
+            response = self.dynamodb.scan(**kwargs)
+            for item in response["Items"]:
+                for column, values in columns.items():
+                    value = item.get(column)
+                    values.append(
+                        None if value is None else self._deserializer.deserialize(value)
+                    )
+
+            if "LastEvaluatedKey" not in response:
+                return columns
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def _scan(self) -> dict[str, list]:
+        """Whole table, with segments scanned in parallel."""
+        with ThreadPoolExecutor(max_workers=self.total_segments) as executor:
+            segments = list(executor.map(self._scan_segment, range(self.total_segments)))
+
+        return {
+            column: [value for segment in segments for value in segment[column]]
+            for column in COLUMNS
+        }
+
+    def get_columns(self) -> Columns:
+        return self._to_columns(self._scan())
+
+    def get_page(
+        self,
+        page_current: int,
+        page_size: int,
+        filters: list[Filter],
+        sort_by: list[dict],
+        search: str | None = None,
+    ) -> tuple[list[dict], int]:
+        # scan can't filter or sort by arbitrary columns, so it's done here
+        columns = self.get_columns()
+        if search:
+            # no search index, the query is just looked up as a substring
+            filters = [*filters, Filter("Message", "icontains", search)]
+        rows = np.flatnonzero(filter_mask(columns, filters))
+        rows = sort_rows(columns, rows, sort_by)
 
-    def get_data(self) -> list[dict]:
-        data = self.dynamodb.scan(TableName="TgParserData")
-        df = pd.DataFrame(json.loads(data["Items"]))
+        start = page_current * page_size
+        # only the rows of the page are formatted
+        return to_records(columns, rows[start : start + page_size]), len(rows)
 
-        df = self._preprocess_data(df)
+    def get_trend(self, term: str) -> list[dict] | None:
+        return None  # no rollups in DynamoDB, trend is counted from messages
 
-        return df.to_dict("records")
+    def get_search_trend(self, query: str) -> list[dict] | None:
+        return None
@@ -1,6 +1,304 @@
+import hashlib
 import importlib
+import json
+import logging
 import os
-from typing import Protocol
+import re
+import sqlite3
+import time
+import uuid
+from collections.abc import Callable
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+from functools import cache
+from typing import Any, NamedTuple, Protocol
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# dates are stored in UTC, but shown in local time
+DISPLAY_TZ = ZoneInfo("Europe/Kyiv")
+DISPLAY_DATE_FORMAT = "%Y/%m/%d %H:%M:%S"
+
+# prefixes of DISPLAY_DATE_FORMAT that can be typed into a filter
+_DATE_PREFIXES = [
+    ("%Y/%m/%d %H:%M:%S", timedelta(seconds=1)),
+    ("%Y/%m/%d %H:%M", timedelta(minutes=1)),
+    ("%Y/%m/%d %H", timedelta(hours=1)),
+    ("%Y/%m/%d", timedelta(days=1)),
+    ("%Y/%m", "month"),
+    ("%Y", "year"),
+]
+
+# DataTable filter syntax: {column} operator value, joined with &&
+_FILTER_PART = re.compile(r"^\{(?P<column>[^}]+)\}\s+(?P<operator>\S+)\s+(?P<value>.+)$")
+_OPERATORS = {
+    "eq": "=",
+    "ne": "!=",
+    "lt": "<",
+    "le": "<=",
+    "gt": ">",
+    "ge": ">=",
+}
+SUPPORTED_OPERATORS = {
+    "=",
+    "!=",
+    "<",
+    "<=",
+    ">",
+    ">=",
+    "contains",
+    "icontains",
+    "scontains",
+    "datestartswith",
+}
+
+
+# same tokens as in utils/text.py of parsers, so terms match the rollups and index
+_TOKEN_PATTERN = re.compile(r"\w+(?:'\w+)*")
+APOSTROPHES = str.maketrans("ʼ’", "''")
+MIN_TOKEN_LENGTH = 2
+
+
+def tokenize(text: str) -> list[str]:
+    return [
+        token
+        for token in _TOKEN_PATTERN.findall(text.lower().translate(APOSTROPHES))
+        if len(token) >= MIN_TOKEN_LENGTH
+    ]
+
+
+def normalize_term(word: str) -> str | None:
+    """
+    Term as it's stored in rollups, or None if the input isn't a single term.
+    Trailing * means a prefix, i.e. "war*" matches "war" and "warsaw".
+    """
+    if len(_TOKEN_PATTERN.findall(word.translate(APOSTROPHES))) != 1:
+        return None
+    tokens = tokenize(word)
+    if not tokens:
+        return None
+    return tokens[0] + ("*" if word.strip().endswith("*") else "")
+
+
+class Filter(NamedTuple):
+    column: str
+    operator: str
+    value: str | float
+
+
+def parse_filter_query(filter_query: str | None) -> list[Filter]:
+    """
+    Split DataTable `filter_query` (i.e. '{Message} icontains "war" && {Date} > 2024')
+    into separate conditions. Conditions that can't be parsed are skipped.
+    """
+    filters = []
+    for part in (filter_query or "").split(" && "):
+        match = _FILTER_PART.match(part.strip())
+        if match is None:
+            continue
+        operator = _OPERATORS.get(match["operator"], match["operator"])
+        if operator not in SUPPORTED_OPERATORS:
+            continue
+
+        value = match["value"].strip()
+        if value[0] == value[-1] and value[0] in "\"'`" and len(value) > 1:
+            value = value[1:-1].replace(f"\\{value[0]}", value[0])
+        else:
+            try:
+                value = float(value)
+            except ValueError:
+                pass
+
+        filters.append(Filter(match["column"], operator, value))
+
+    return filters
+
+
+def parse_display_date(value: str | float) -> tuple[datetime, datetime]:
+    """
+    Range of UTC dates covered by a (possibly partial) local date
+    as it's shown in the table, i.e. "2024/05" is the whole May.
+    """
+    if isinstance(value, float):
+        value = str(int(value))  # a year parsed as a number
+
+    for date_format, step in _DATE_PREFIXES:
+        try:
+            start = datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+
+        if step == "year":
+            end = start.replace(year=start.year + 1)
+        elif step == "month":
+            end = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+        else:
+            end = start + step
+
+        return tuple(
+            date.replace(tzinfo=DISPLAY_TZ)
+            .astimezone(timezone.utc)
+            .replace(tzinfo=None)
+            for date in (start, end)
+        )
+
+    raise ValueError(f"Unknown date format: {value}")
+
+
+# column name -> array of values, i.e. {"Message": [...], "Date": [...]}
+# Dates are datetime64 in UTC, they are formatted only for rows that are shown.
+Columns = dict[str, np.ndarray]
+
+TREND_BUCKET_MINUTES = 30
+
+
+def format_dates(dates: np.ndarray) -> list[str | None]:
+    """UTC datetime64 dates as they are shown in the table (local time)."""
+    return [
+        None
+        if date is None
+        else date.replace(tzinfo=timezone.utc)
+        .astimezone(DISPLAY_TZ)
+        .strftime(DISPLAY_DATE_FORMAT)
+        for date in dates.astype("datetime64[us]").tolist()
+    ]
+
+
+def to_records(columns: Columns, rows: np.ndarray | slice = slice(None)) -> list[dict]:
+    """Table rows (selected by indices or a slice) with formatted dates."""
+    values = {
+        column: format_dates(array[rows]) if column == "Date" else array[rows].tolist()
+        for column, array in columns.items()
+    }
+    return [dict(zip(values, row)) for row in zip(*values.values())]
+
+
+def date_mask(dates: np.ndarray, operator: str, value: str | float) -> np.ndarray:
+    """
+    Which dates match a filter, with dates compared as they are shown,
+    i.e. "= 2024/05" is the whole May. Raises ValueError for unknown dates.
+    """
+    start, end = (np.datetime64(date) for date in parse_display_date(value))
+    if operator in ("=", "contains", "icontains", "scontains", "datestartswith"):
+        return (dates >= start) & (dates < end)
+    if operator == "!=":
+        return (dates < start) | (dates >= end)
+    if operator == ">=":
+        return dates >= start
+    if operator == "<":
+        return dates < start
+    # after / not after the whole period
+    return dates >= end if operator == ">" else dates < end
+
+
+def date_range(filters: list[Filter]) -> tuple[datetime | None, datetime | None]:
+    """
+    UTC dates all the rows that match Date filters are within, [start, end),
+    None if not limited. Used to skip parts of data that can't match.
+    """
+    start = end = None
+    for column, operator, value in filters:
+        if column != "Date" or operator == "!=":
+            continue
+        try:
+            period_start, period_end = parse_display_date(value)
+        except ValueError:
+            continue
+
+        # see date_mask
+        if operator == "<":
+            period_start, period_end = None, period_start
+        elif operator == "<=":
+            period_start = None
+        elif operator == ">":
+            period_start, period_end = period_end, None
+        elif operator == ">=":
+            period_end = None
+
+        if period_start is not None and (start is None or period_start > start):
+            start = period_start
+        if period_end is not None and (end is None or period_end < end):
+            end = period_end
+
+    return start, end
+
+
+def filter_mask(columns: Columns, filters: list[Filter]) -> np.ndarray:
+    """Which rows match all the filters."""
+    mask = np.ones(len(columns["Date"]), dtype=bool)
+    for column, operator, value in filters:
+        if column not in columns:
+            continue
+        if column == "Date":
+            try:
+                mask &= date_mask(columns["Date"], operator, value)
+            except ValueError:
+                pass  # i.e. half-typed date
+            continue
+
+        values = pd.Series(columns[column]).astype(str)
+        value = str(value)
+        if operator in ("contains", "icontains"):
+            matches = values.str.contains(value, case=False, regex=False)
+        elif operator == "scontains":
+            matches = values.str.contains(value, regex=False)
+        elif operator == "datestartswith":
+            matches = values.str.startswith(value)
+        else:
+            matches = {
+                "=": values.__eq__,
+                "!=": values.__ne__,
+                "<": values.__lt__,
+                "<=": values.__le__,
+                ">": values.__gt__,
+                ">=": values.__ge__,
+            }[operator](value)
+        mask &= matches.to_numpy(dtype=bool)
+    return mask
+
+
+def sort_rows(columns: Columns, rows: np.ndarray, sort_by: list[dict]) -> np.ndarray:
+    """
+    Rows sorted by DataTable `sort_by`, newest first by default.
+    Dates are sorted as datetime64, not as formatted strings.
+    """
+    sort_by = [column for column in sort_by or [] if column["column_id"] in columns]
+    sort_by = sort_by or [{"column_id": "Date", "direction": "desc"}]
+    by = [column["column_id"] for column in sort_by]
+    df = pd.DataFrame({column: columns[column][rows] for column in by})
+    order = df.sort_values(
+        by=by,
+        ascending=[column["direction"] == "asc" for column in sort_by],
+        kind="stable",
+    ).index.to_numpy()
+    return rows[order]
+
+
+def count_buckets(dates: np.ndarray, mask: np.ndarray) -> list[dict]:
+    """
+    Number of dates selected by mask per 30 minutes, [{"Date": ..., "Count": ...}]
+    sorted by date (buckets with none of them have zero counts).
+    """
+    dates = dates.astype("datetime64[m]")
+    known = ~np.isnat(dates)
+    minutes = dates[known].astype(np.int64)
+    buckets, inverse = np.unique(
+        minutes - minutes % TREND_BUCKET_MINUTES, return_inverse=True
+    )
+    counts = np.bincount(inverse, weights=mask[known], minlength=len(buckets))
+    return [
+        {
+            "Date": bucket.replace(tzinfo=timezone.utc).astimezone(DISPLAY_TZ),
+            "Count": int(count),
+        }
+        for bucket, count in zip(
+            buckets.astype("datetime64[m]").astype("datetime64[us]").tolist(), counts
+        )
+    ]
 
 
 class DataFetcher(Protocol):
@@ -8,7 +306,42 @@ class DataFetcher(Protocol):
     def connect(self) -> None:
         pass
 
-    def get_data(self) -> list[dict]:
+    def get_columns(self) -> Columns:
+        """
+        All messages as columns, newest first: Message and Chat_Name are
+        object arrays, Date is datetime64 in UTC.
+        Returned arrays are shared between callers, don't modify them.
+        """
+        pass
+
+    def get_page(
+        self,
+        page_current: int,
+        page_size: int,
+        filters: list[Filter],
+        sort_by: list[dict],
+        search: str | None = None,
+    ) -> tuple[list[dict], int]:
+        """
+        One page of table rows that match all the filters (and a search query),
+        sorted by DataTable `sort_by` ([{"column_id": ..., "direction": "asc"/"desc"}]),
+        and the total number of matching rows.
+        """
+        pass
+
+    def get_trend(self, term: str) -> list[dict] | None:
+        """
+        Number of messages with a term (see `normalize_term`) per 30 minutes,
+        [{"Date": ..., "Count": ...}] sorted by date.
+        None if there are no rollups to look it up in.
+        """
+        pass
+
+    def get_search_trend(self, query: str) -> list[dict] | None:
+        """
+        Same as `get_trend`, but for messages that match a search query
+        (see utils/search.py). None if there is no search index.
+        """
         pass
 
 
@@ -23,10 +356,247 @@ def data_fetcher(repo_type: str) -> DataFetcher:
             passwd=os.getenv("DB_PASSWD"),
             ip=os.getenv("DB_IP"),
             port=int(os.getenv("DB_PORT")),
+            rollup_collection_name=os.getenv(
+                "ROLLUP_COLLECTION", f"{os.getenv('COLLECTION_NAME')}_terms"
+            ),
+            index_collection_name=os.getenv(
+                "SEARCH_INDEX_COLLECTION", f"{os.getenv('COLLECTION_NAME')}_index"
+            ),
+            archive_path=os.getenv("ARCHIVE_PATH"),
         )
     elif repo_type == "dynamodb":
         return repo.DynamoFetcher(
-            table_name=os.getenv("TABLE_NAME"), region=os.getenv("AWS_REGION")
+            table_name=os.getenv("TABLE_NAME"),
+            region=os.getenv("AWS_REGION"),
+            endpoint_url=os.getenv("DYNAMO_ENDPOINT_URL"),
+            total_segments=int(os.getenv("DYNAMO_SCAN_SEGMENTS", 4)),
         )
     else:
         raise ValueError
+
+
+def _encode(value: Any) -> dict:
+    # dates of trends, the rest of the results is plain JSON
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    raise TypeError(f"Can't cache {type(value).__name__}")
+
+
+def _decode(obj: dict) -> Any:
+    if obj.keys() == {"$date"}:
+        return datetime.fromisoformat(obj["$date"]).astimezone(DISPLAY_TZ)
+    return obj
+
+
+class QueryCache:
+    """
+    Results of database queries with a TTL, shared by all dashboard processes
+    of a user through an sqlite file. Results are stored as JSON, so whoever
+    can write to the file can't make the dashboard run code.
+
+    Single-flight: if several callbacks (in any process) ask for the same key
+    at the same time, only one of them queries the database while the rest
+    wait for its result, so the number of queries doesn't grow with viewers.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float = 30,
+        lock_timeout: float = 60,
+        poll_interval: float = 0.05,
+    ) -> None:
+        """
+        ttl: seconds a result is served from the cache
+        lock_timeout: a query taking longer than that is considered dead
+        (i.e. its process was killed), and someone else runs it again
+        poll_interval: how often waiters check if the result is ready
+        """
+        self.path = path
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+
+        # cached pages are readable by the owner only (sqlite gives its -wal and
+        # -shm files the same permissions)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700, exist_ok=True)
+        os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+
+        with closing(self._connect()) as db, db:
+            db.execute("PRAGMA journal_mode=WAL")  # readers don't block the writer
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS entries "
+                "(key TEXT PRIMARY KEY, value TEXT, expires_at REAL)"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS locks "
+                "(key TEXT PRIMARY KEY, owner TEXT, expires_at REAL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # a connection per call, since callbacks run in different threads
+        return sqlite3.connect(self.path, timeout=self.lock_timeout)
+
+    @staticmethod
+    def make_key(method: str, *args: Any) -> str:
+        serialized = json.dumps([method, *args], sort_keys=True, default=str)
+        return hashlib.sha256(serialized.encode()).hexdigest()
+
+    def _get(self, db: sqlite3.Connection, key: str) -> tuple[bool, Any]:
+        row = db.execute(
+            "SELECT value FROM entries WHERE key = ? AND expires_at > ?",
+            (key, time.time()),
+        ).fetchone()
+        if row is None:
+            return False, None
+        try:
+            return True, json.loads(row[0], object_hook=_decode)
+        except ValueError:
+            return False, None  # i.e. written by an older version, it's replaced
+
+    def _acquire(self, db: sqlite3.Connection, key: str, owner: str) -> bool:
+        now = time.time()
+        with db:
+            # take the lock if it's free or its owner is dead
+            db.execute(
+                "INSERT INTO locks (key, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET "
+                "owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE locks.expires_at <= ?",
+                (key, owner, now + self.lock_timeout, now),
+            )
+        row = db.execute("SELECT owner FROM locks WHERE key = ?", (key,)).fetchone()
+        return row is not None and row[0] == owner
+
+    def _set(self, db: sqlite3.Connection, key: str, owner: str, value: Any) -> None:
+        now = time.time()
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO entries (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, default=_encode), now + self.ttl),
+            )
+            db.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+            db.execute("DELETE FROM locks WHERE key = ? AND owner = ?", (key, owner))
+
+    def _release(self, db: sqlite3.Connection, key: str, owner: str) -> None:
+        with db:
+            db.execute("DELETE FROM locks WHERE key = ? AND owner = ?", (key, owner))
+
+    def clear(self) -> None:
+        """
+        Drop all results, i.e. when the data is refreshed.
+        Results of queries running at the moment are still stored.
+        """
+        with closing(self._connect()) as db, db:
+            db.execute("DELETE FROM entries")
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any]) -> Any:
+        owner = uuid.uuid4().hex
+        # the connection's own context manager only commits, it doesn't close
+        with closing(self._connect()) as db:
+            deadline = time.monotonic() + self.lock_timeout
+            while True:
+                found, value = self._get(db, key)
+                if found:
+                    return value
+                if self._acquire(db, key, owner) or time.monotonic() > deadline:
+                    break
+                # someone else is already running the same query
+                time.sleep(self.poll_interval)
+
+            try:
+                # it could have been computed right before the lock was taken
+                found, value = self._get(db, key)
+                if not found:
+                    value = compute()
+                    self._set(db, key, owner, value)
+            finally:
+                self._release(db, key, owner)
+
+        return value
+
+
+class CachedFetcher:
+    """
+    Fetcher with results of queries cached in a QueryCache.
+    get_columns isn't cached, it's incremental and kept in memory by fetchers.
+    """
+
+    def __init__(self, fetcher: DataFetcher, cache: QueryCache) -> None:
+        self.fetcher = fetcher
+        self.cache = cache
+
+    def __getattr__(self, name: str) -> Any:
+        # everything else, i.e. the database client, is taken from the fetcher
+        return getattr(self.fetcher, name)
+
+    def _cached(self, method: str, *args: Any) -> Any:
+        return self.cache.get_or_compute(
+            self.cache.make_key(method, *args),
+            lambda: getattr(self.fetcher, method)(*args),
+        )
+
+    def connect(self) -> None:
+        self.fetcher.connect()
+
+    def get_columns(self) -> Columns:
+        return self.fetcher.get_columns()
+
+    def get_page(
+        self,
+        page_current: int,
+        page_size: int,
+        filters: list[Filter],
+        sort_by: list[dict],
+        search: str | None = None,
+    ) -> tuple[list[dict], int]:
+        return self._cached(
+            "get_page", page_current, page_size, filters, sort_by, search
+        )
+
+    def get_trend(self, term: str) -> list[dict] | None:
+        return self._cached("get_trend", term)
+
+    def get_search_trend(self, query: str) -> list[dict] | None:
+        return self._cached("get_search_trend", query)
+
+
+@cache
+def get_fetcher() -> DataFetcher:
+    """
+    Connected fetcher shared by all pages.
+    Query results are cached for DASHBOARD_CACHE_TTL seconds (0 to disable).
+    """
+    fetcher = data_fetcher(os.getenv("REPOSITORY_TYPE"))
+    fetcher.connect()
+
+    ttl = float(os.getenv("DASHBOARD_CACHE_TTL", 30))
+    if ttl <= 0:
+        return fetcher
+
+    # per user, not in the shared temp directory where anyone can create it first
+    path = os.getenv(
+        "DASHBOARD_CACHE_PATH",
+        os.path.join(
+            os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+            "dashboard",
+            "query_cache.sqlite",
+        ),
+    )
+    try:
+        return CachedFetcher(fetcher, QueryCache(path, ttl=ttl))
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(
+            f"Can't use query cache at {path}: {e}. Querying database directly."
+        )
+        return fetcher
+
+
+def refresh() -> None:
+    """
+    Drop cached query results, so that pages get new data on Refresh
+    instead of results cached before it (they would be served until the TTL).
+    """
+    fetcher = get_fetcher()
+    if isinstance(fetcher, CachedFetcher):
+        fetcher.cache.clear()
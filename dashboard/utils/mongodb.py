@@ -1,6 +1,68 @@
-import pandas as pd
-from pymongo import MongoClient
+import logging
+import re
+import threading
+from collections import Counter
+from collections.abc import Iterable
+from datetime import timedelta, timezone
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, MongoClient
 from pymongo.collection import Collection
+from pymongo.cursor import Cursor
+from pymongo.errors import OperationFailure
+
+from utils.archive import (
+    KEY_FIELDS,
+    MessageArchive,
+    build_condition,
+    build_sort,
+    keys_condition,
+    search_ids,
+)
+from utils.fetch_data import (
+    DISPLAY_TZ,
+    Columns,
+    Filter,
+    count_buckets,
+    parse_display_date,
+    sort_rows,
+    to_records,
+)
+from utils.search import SearchIndex, doc_keys, parse_query, phrase_pattern
+
+logger = logging.getLogger(__name__)
+
+# table column -> document field
+COLUMN_FIELDS = {"Message": "msg", "Date": "date", "Chat_Name": "chat_name"}
+
+_COMPARISONS = {
+    "=": "$eq",
+    "!=": "$ne",
+    "<": "$lt",
+    "<=": "$lte",
+    ">": "$gt",
+    ">=": "$gte",
+}
+
+# max number of messages (with the highest msg_id) a search clause is narrowed to
+SEARCH_LIMIT = 10_000
+TREND_SEARCH_LIMIT = 100_000
+# ObjectIds are made by clients (and by the server for upserts) at different times,
+# so a refresh reads again documents with _ids up to this much older than the latest
+REFRESH_OVERLAP = timedelta(minutes=10)
+
+
+def _format_buckets(buckets: Iterable[dict]) -> list[dict]:
+    return [
+        {
+            "Date": bucket["_id"].replace(tzinfo=timezone.utc).astimezone(DISPLAY_TZ),
+            "Count": bucket["count"],
+        }
+        for bucket in buckets
+    ]
 
 
 class MongoFetcher:
@@ -12,10 +74,33 @@ class MongoFetcher:
         passwd: str,
         ip: str,
         port: str,
+        batch_size: int = 5000,
+        rollup_collection_name: str | None = None,
+        index_collection_name: str | None = None,
+        archive_path: str | None = None,
     ) -> None:
+        """
+        rollup_collection_name: term counts written by parsers (see utils/rollups.py)
+        index_collection_name: full-text index written by parsers (see utils/search.py)
+        archive_path: old messages moved out of the collection (see utils/archive.py)
+        """
         self.db_uri = f"mongodb://{user}:{passwd}@{ip}:{port}"
         self.table_name = table_name
         self.collection_name = collection_name
+        self.batch_size = batch_size
+        self.rollup_collection_name = rollup_collection_name
+        self.index_collection_name = index_collection_name
+        self.archive = MessageArchive(archive_path) if archive_path else None
+
+        # messages, newest first, and the last _id that was read
+        self._columns: Columns = self._to_columns(
+            {field: [] for field in COLUMN_FIELDS.values()}
+        )
+        self._last_id: ObjectId | None = None
+        # _ids read within REFRESH_OVERLAP of the last one, they are read again
+        self._recent_ids: set[ObjectId] = set()
+        self._archive_read = False
+        self._lock = threading.Lock()  # callbacks run in parallel threads
 
     def _get_mongo_client(self) -> MongoClient:
         return MongoClient(self.db_uri)
@@ -28,32 +113,388 @@ class MongoFetcher:
         self.client = self._get_mongo_client()
 
         self.collection = self._get_collection(self.client)
+        self._create_index()
+        db = self.client.get_database(self.table_name)
+        if self.rollup_collection_name is not None:
+            self.rollups = db.get_collection(self.rollup_collection_name)
+        if self.index_collection_name is not None:
+            self.search_index = SearchIndex(db.get_collection(self.index_collection_name))
+
+    def _create_index(self) -> None:
+        """
+        Index for the default order of table pages (see _build_sort) and Date filters,
+        so pages are read from it instead of sorting the whole collection.
+        """
+        try:
+            # no-op if the index already exists
+            self.collection.create_index([("date", DESCENDING), ("_id", DESCENDING)])
+        except OperationFailure:
+            logger.exception(
+                "Failed to create index on date, pages will be sorted in memory. "
+                "Create it with a user that can, or give the dashboard's user "
+                "the createIndex permission."
+            )
 
     @staticmethod
-    def _preprocess_data(df: pd.DataFrame) -> pd.DataFrame:
-        return (
-            df.drop("_id", axis=1)
-            .assign(
-                date=df["date"]
-                .dt.tz_localize(tz="UTC")
-                .dt.tz_convert(tz="Europe/Kyiv")
-                .dt.strftime("%Y/%m/%d %H:%M:%S")
+    def _to_columns(fields: dict[str, list]) -> Columns:
+        """Lists of document fields as table columns, with dates as datetime64."""
+        return {
+            column: (
+                np.array(fields[field], dtype="datetime64[ms]")
+                if field == "date"
+                else np.array(fields[field], dtype=object)
+            )
+            for column, field in COLUMN_FIELDS.items()
+        }
+
+    def _read_columns(
+        self, fields: list[str], cursor: Cursor | None = None
+    ) -> dict[str, list]:
+        """
+        Read documents from a cursor straight into columns,
+        so a list with all the documents is never kept in memory.
+        """
+        columns = {field: [] for field in fields}
+        if cursor is None:
+            cursor = self.collection.find(
+                filter={},
+                projection={"_id": False} | {field: True for field in fields},
+                batch_size=self.batch_size,
+            )
+        for doc in cursor:
+            for field, column in columns.items():
+                column.append(doc.get(field))
+        return columns
+
+    def get_columns(self) -> Columns:
+        """
+        All messages, newest first.
+
+        Only documents inserted since the previous call (with a greater _id,
+        or up to REFRESH_OVERLAP older) are read, then the ones that weren't read
+        before are merged into the rest, so a refresh costs as much as
+        the number of new messages. Updates of already read documents
+        are not picked up.
+        """
+        with self._lock:
+            fields = ["_id", *COLUMN_FIELDS.values()]
+            query = {}
+            if self._last_id is not None:
+                since = self._last_id.generation_time - REFRESH_OVERLAP
+                query = {"_id": {"$gte": ObjectId.from_datetime(since)}}
+            cursor = self.collection.find(
+                filter=query, projection=fields, batch_size=self.batch_size
+            )
+            columns = self._read_columns(fields, cursor)
+            ids = columns.pop("_id")
+            new = [i for i, _id in enumerate(ids) if _id not in self._recent_ids]
+            new_columns = self._to_columns(
+                {field: [values[i] for i in new] for field, values in columns.items()}
+            )
+            if ids:
+                latest = max(ids)
+                if self._last_id is None or latest > self._last_id:
+                    self._last_id = latest
+                since = self._last_id.generation_time - REFRESH_OVERLAP
+                self._recent_ids = {
+                    _id
+                    for _id in self._recent_ids.union(ids)
+                    if _id.generation_time >= since
+                }
+            if self.archive is not None and not self._archive_read:
+                # read once and after the collection, so messages archived meanwhile
+                # aren't lost (messages archived later are kept from the collection)
+                archived = self.archive.read_columns()
+                new_columns = {
+                    column: np.concatenate((new_columns[column], archived[column]))
+                    for column in COLUMN_FIELDS
+                }
+                self._archive_read = True
+            if len(new_columns["Date"]) == 0:
+                return self._columns
+
+            # new messages can be older than cached ones, i.e. after a backfill
+            merged = {
+                column: np.concatenate((self._columns[column], new_columns[column]))
+                for column in COLUMN_FIELDS
+            }
+            order = np.argsort(merged["Date"], kind="stable")[::-1]
+            # a new dict, so callers that already have the old one aren't affected
+            self._columns = {column: merged[column][order] for column in COLUMN_FIELDS}
+            logger.info(
+                f"{len(new_columns['Date'])} new messages, {len(order)} in total."
             )
-            .rename(
-                {"msg": "Message", "date": "Date", "chat_name": "Chat_Name"}, axis=1
+
+            return self._columns
+
+    @staticmethod
+    def _build_condition(field: str, operator: str, value: str | float) -> dict:
+        if field == "date":
+            # dates are filtered as they are shown, i.e. "2024/05" is the whole May
+            start, end = parse_display_date(value)
+            if operator in ("=", "contains", "icontains", "scontains", "datestartswith"):
+                return {"$gte": start, "$lt": end}
+            if operator == "!=":
+                return {"$not": {"$gte": start, "$lt": end}}
+            if operator in (">=", "<"):
+                return {_COMPARISONS[operator]: start}
+            # after / not after the whole period
+            return {"$gte" if operator == ">" else "$lt": end}
+
+        if operator == "datestartswith":
+            return {"$regex": f"^{re.escape(str(value))}"}
+        if operator in ("contains", "icontains"):
+            return {"$regex": re.escape(str(value)), "$options": "i"}
+        if operator == "scontains":
+            return {"$regex": re.escape(str(value))}
+        return {_COMPARISONS[operator]: value}
+
+    @classmethod
+    def _build_query(cls, filters: list[Filter]) -> dict:
+        query = {}
+        for column, operator, value in filters:
+            field = COLUMN_FIELDS.get(column)
+            if field is None:
+                continue
+            try:
+                condition = cls._build_condition(field, operator, value)
+            except ValueError:
+                continue  # i.e. half-typed date
+            query.setdefault("$and", []).append({field: condition})
+        return query
+
+    @staticmethod
+    def _build_sort(sort_by: list[dict]) -> list[tuple[str, int]]:
+        sort = [
+            (
+                COLUMN_FIELDS[column["column_id"]],
+                ASCENDING if column["direction"] == "asc" else DESCENDING,
             )
-            .sort_values(by="Date", ascending=False)[["Message", "Date", "Chat_Name"]]
+            for column in sort_by or []
+            if column["column_id"] in COLUMN_FIELDS
+        ]
+        # newest first by default, _id keeps pages stable for equal values
+        return (sort or [("date", DESCENDING)]) + [("_id", DESCENDING)]
+
+    def get_page(
+        self,
+        page_current: int,
+        page_size: int,
+        filters: list[Filter],
+        sort_by: list[dict],
+        search: str | None = None,
+    ) -> tuple[list[dict], int]:
+        search_query = self._build_search_query(search) if search else None
+        if search and search_query is None:
+            # no search index, the query is just looked up as a substring
+            filters = [*filters, Filter("Message", "icontains", search)]
+            search = None
+        query = self._build_query(filters)
+        if search_query is not None:
+            query.setdefault("$and", []).append(search_query)
+        total = (
+            self.collection.count_documents(query)
+            if query
+            else self.collection.estimated_document_count()
         )
 
-    def get_data(self) -> list[dict]:
-        df = pd.DataFrame(
-            list(
-                self.collection.find(
-                    filter={}, projection={"msg": 1, "date": 1, "chat_name": 1}
-                )
+        start = page_current * page_size
+        stop = start + page_size
+        # with an archive, the first `stop` rows of both are sorted together
+        skip = start if self.archive is None else 0
+
+        fields = list(COLUMN_FIELDS.values())
+        cursor = (
+            self.collection.find(
+                filter=query,
+                projection={"_id": False} | {field: True for field in fields},
             )
+            .sort(self._build_sort(sort_by))
+            .skip(skip)
+            .limit(stop - skip)
+            # sorted by other columns, pages are sorted without an index
+            .allow_disk_use(True)
+        )
+        columns = self._to_columns(self._read_columns(fields, cursor))
+        if self.archive is None:
+            return to_records(columns), total
+
+        archived, archived_total = self._get_archived_rows(
+            filters, sort_by, search, limit=stop
+        )
+        columns = {
+            column: np.concatenate((columns[column], archived[column]))
+            for column in COLUMN_FIELDS
+        }
+        rows = sort_rows(columns, np.arange(len(columns["Date"])), sort_by)
+
+        return to_records(columns, rows[start:stop]), total + archived_total
+
+    def _get_archived_rows(
+        self,
+        filters: list[Filter],
+        sort_by: list[dict],
+        search: str | None,
+        limit: int,
+    ) -> tuple[Columns, int]:
+        """
+        The first `limit` archived rows that match filters and a search query,
+        and the number of all matching rows.
+        Messages are read only for these rows, see MessageArchive.read_top.
+        """
+        condition = build_condition(filters)
+        if not search:
+            top = self.archive.read_top(condition, sort_by, limit)
+            return self.archive.read_rows(top), self.archive.count(condition)
+
+        sort = build_sort(sort_by)
+        matches = self._search_archive(
+            search, [*KEY_FIELDS, *(field for field, _ in sort)], condition
         )
+        top = matches.sort_by(sort).slice(0, limit)
+        return self.archive.read_rows(top), matches.num_rows
+
+    def _search_archive(
+        self, search: str, fields: list[str], condition: ds.Expression | None = None
+    ) -> pa.Table:
+        """
+        Fields of archived rows that match a search query and a condition,
+        see _build_search_query (it's only used if there is a search index).
+        Only rows with all the words of a clause are read,
+        and their messages only if the clause has phrases.
+        """
+        fields = list(dict.fromkeys(fields))
+        clauses = parse_query(search)
+        candidates = [self.search_index.candidates(clause) for clause in clauses]
+        chat_ids, msg_ids = doc_keys(
+            np.concatenate(candidates) if candidates else np.empty(0, dtype=np.uint64)
+        )
+        keys = keys_condition(chat_ids, msg_ids)
+        has_phrases = any(clause.phrases for clause in clauses)
+        read_fields = [*fields, "chat_id", "msg_id"] + (["msg"] if has_phrases else [])
+        table = self.archive.read_table(
+            list(dict.fromkeys(read_fields)),
+            keys if condition is None else condition & keys,
+        )
+
+        doc_ids = search_ids(table)
+        messages = table["msg"].to_pylist() if has_phrases else None
+        mask = np.zeros(table.num_rows, dtype=bool)
+        for clause, clause_ids in zip(clauses, candidates):
+            matches = np.isin(doc_ids, clause_ids)
+            for phrase in clause.phrases:
+                pattern = re.compile(phrase_pattern(phrase), re.IGNORECASE)
+                rows = np.flatnonzero(matches)
+                matches[rows] = [
+                    pattern.search(messages[row] or "") is not None for row in rows
+                ]
+            mask |= matches
+        return table.filter(mask).select(fields)
 
-        df = self._preprocess_data(df)
+    def get_trend(self, term: str) -> list[dict] | None:
+        if self.rollup_collection_name is None:
+            return None
+        if self.rollups.estimated_document_count() == 0:
+            return None  # parsers don't write rollups
 
-        return df.to_dict("records")
+        if term.endswith("*"):
+            # anchored regex is a range scan over the index on term
+            match = {"term": {"$regex": f"^{re.escape(term[:-1])}"}}
+        else:
+            match = {"term": term}
+        buckets = self.rollups.aggregate(
+            [
+                {"$match": match},
+                # sum over chats (and increments, if they weren't merged)
+                {"$group": {"_id": "$bucket", "count": {"$sum": "$count"}}},
+                {"$sort": {"_id": ASCENDING}},
+            ]
+        )
+        return _format_buckets(buckets)
+
+    def _has_search_index(self) -> bool:
+        # the collection is there by default, but empty unless parsers write
+        # the index (SEARCH_INDEX_REPO) or it was built with src/build_indexes.py
+        return (
+            self.index_collection_name is not None
+            and self.search_index.collection.estimated_document_count() > 0
+        )
+
+    def _build_search_query(
+        self, search: str, limit: int = SEARCH_LIMIT
+    ) -> dict | None:
+        """
+        Messages that match a search query, by their keys found in the index.
+        Phrases are checked by MongoDB, but only for messages with all their words.
+        None if there is no index.
+        """
+        if not self._has_search_index():
+            return None
+
+        clauses = []
+        for clause in parse_query(search):
+            doc_ids = self.search_index.candidates(clause)
+            chat_ids, msg_ids = doc_keys(doc_ids)
+            if len(doc_ids) > limit:
+                # msg ids grow with time, so these are roughly the latest ones
+                latest = np.argpartition(msg_ids, -limit)[-limit:]
+                chat_ids, msg_ids = chat_ids[latest], msg_ids[latest]
+
+            # {chat_id, msg_id in [...]} for every chat uses the (chat_id, msg_id) index
+            keys = [
+                {
+                    "chat_id": int(chat_id),
+                    "msg_id": {"$in": msg_ids[chat_ids == chat_id].tolist()},
+                }
+                for chat_id in np.unique(chat_ids)
+            ]
+            if not keys:
+                continue
+            phrases = [
+                {"msg": {"$regex": phrase_pattern(phrase), "$options": "i"}}
+                for phrase in clause.phrases
+            ]
+            clauses.append({"$and": [{"$or": keys}, *phrases]})
+
+        # nothing can match
+        return {"$or": clauses} if clauses else {"_id": {"$exists": False}}
+
+    def get_search_trend(self, query: str) -> list[dict] | None:
+        search_query = self._build_search_query(query, limit=TREND_SEARCH_LIMIT)
+        if search_query is None:
+            return None
+
+        buckets = self.collection.aggregate(
+            [
+                {"$match": search_query},
+                {
+                    "$group": {
+                        "_id": {
+                            "$dateTrunc": {
+                                "date": "$date",
+                                "unit": "minute",
+                                "binSize": 30,
+                            }
+                        },
+                        "count": {"$sum": 1},
+                    }
+                },
+                {"$sort": {"_id": ASCENDING}},
+            ]
+        )
+        trend = _format_buckets(buckets)
+        if self.archive is None:
+            return trend
+
+        dates = self._search_archive(query, ["date"])["date"]
+        archived = count_buckets(
+            dates.cast(pa.timestamp("ms")).to_numpy(), np.ones(len(dates), dtype=bool)
+        )
+        counts = Counter()
+        for bucket in trend + archived:
+            counts[bucket["Date"]] += bucket["Count"]
+        return [
+            {"Date": date, "Count": count}
+            for date, count in sorted(counts.items())
+            if count
+        ]
@@ -0,0 +1,143 @@
+"""
+Search over the inverted index written by parsers (utils/search_index.py).
+
+Query syntax:
+- words separated by spaces must all be in a message: `war peace`
+- `"quoted words"` must go one after another (phrase)
+- `-word` must not be in a message
+- `word*` matches all words that start with it
+- `OR` between groups of words: `war peace OR "peace talks"`
+"""
+
+import re
+from typing import NamedTuple
+
+import numpy as np
+from pymongo.collection import Collection
+
+from utils.fetch_data import tokenize
+
+_QUERY_PART = re.compile(r'(?P<negated>-?)(?:"(?P<phrase>[^"]*)"|(?P<word>\S+))')
+
+
+class Clause(NamedTuple):
+    terms: list[str]  # may end with * for prefixes
+    phrases: list[list[str]]
+    excluded: list[str]
+
+
+def parse_query(query: str) -> list[Clause]:
+    """Split a query into clauses joined with OR. Clauses without terms are skipped."""
+    clauses = []
+    for part in re.split(r"\s+OR\s+", query.strip()):
+        clause = Clause([], [], [])
+        for match in _QUERY_PART.finditer(part):
+            if match["phrase"] is not None:
+                tokens = tokenize(match["phrase"])
+            else:
+                tokens = tokenize(match["word"])
+                if match["word"].endswith("*") and len(tokens) == 1:
+                    tokens = [tokens[0] + "*"]
+
+            if not tokens:
+                continue
+            if match["negated"]:
+                clause.excluded.extend(tokens)
+            elif len(tokens) == 1:
+                clause.terms.append(tokens[0])
+            else:
+                clause.phrases.append(tokens)
+
+        # a clause with only excluded words would match almost everything
+        if clause.terms or clause.phrases:
+            clauses.append(clause)
+
+    return clauses
+
+
+def phrase_pattern(phrase: list[str]) -> str:
+    """Regex for words of a phrase that go one after another."""
+    # texts aren't normalized, so any apostrophe matches
+    return r"\W+".join(re.escape(token).replace("'", "['ʼ’]") for token in phrase)
+
+
+def decode_chunks(chunks: list[bytes], counts: list[int]) -> np.ndarray:
+    """
+    Sorted unique message ids from chunks of delta-encoded varints.
+    All chunks are decoded at once with numpy, which is what makes
+    terms with millions of postings fast.
+    """
+    data = np.frombuffer(b"".join(chunks), dtype=np.uint8)
+    if len(data) == 0:
+        return np.empty(0, dtype=np.uint64)
+
+    # every varint ends with a byte without the continuation bit
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shifts = 7 * (np.arange(len(data)) - np.repeat(starts, ends - starts + 1))
+    deltas = np.add.reduceat(
+        (data & 0x7F).astype(np.uint64) << shifts.astype(np.uint64), starts
+    )
+
+    # running sum restarts at every chunk, since the first value of a chunk isn't a delta
+    # (uint64 overflows, but differences of running sums are still right)
+    counts = np.asarray(counts, dtype=np.int64)
+    totals = np.cumsum(deltas)
+    chunk_starts = np.cumsum(counts) - counts
+    offsets = np.concatenate(
+        (np.zeros(1, dtype=np.uint64), totals[chunk_starts[1:] - 1])
+    )
+    doc_ids = totals - np.repeat(offsets, counts)
+
+    # chunks can overlap if the same messages were indexed twice
+    # (sort + mask, since np.unique is much slower for large arrays)
+    doc_ids.sort()
+    return doc_ids[np.concatenate(([True], doc_ids[1:] != doc_ids[:-1]))]
+
+
+def doc_keys(doc_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """chat_ids and msg_ids of messages (both are 32-bit, see utils/search_index.py)."""
+    return (doc_ids >> np.uint64(32)).astype(np.int64), (
+        doc_ids & np.uint64(0xFFFFFFFF)
+    ).astype(np.int64)
+
+
+class SearchIndex:
+    def __init__(self, collection: Collection) -> None:
+        self.collection = collection
+
+    def postings(self, term: str) -> np.ndarray:
+        if term.endswith("*"):
+            # anchored regex is a range scan over the index on term
+            match = {"$regex": f"^{re.escape(term[:-1])}"}
+        else:
+            match = term
+
+        chunks, counts = [], []
+        for doc in self.collection.find(
+            {"term": match}, projection={"_id": False, "chunks": True, "counts": True}
+        ):
+            chunks += doc["chunks"]
+            counts += doc["counts"]
+        return decode_chunks(chunks, counts)
+
+    def candidates(self, clause: Clause) -> np.ndarray:
+        """
+        Messages with all the words of a clause, without excluded ones.
+        Words of phrases aren't checked to be next to each other.
+        """
+        required = clause.terms + [token for phrase in clause.phrases for token in phrase]
+        doc_ids = None
+        for term in dict.fromkeys(required):
+            postings = self.postings(term)
+            doc_ids = (
+                postings
+                if doc_ids is None
+                else np.intersect1d(doc_ids, postings, assume_unique=True)
+            )
+            if len(doc_ids) == 0:
+                return doc_ids
+
+        for term in clause.excluded:
+            doc_ids = np.setdiff1d(doc_ids, self.postings(term), assume_unique=True)
+        return doc_ids
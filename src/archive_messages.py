@@ -0,0 +1,105 @@
+"""
+Move messages older than ARCHIVE_AFTER_DAYS from MongoDB to Parquet files
+in ARCHIVE_PATH (see utils/archive.py), a day at a time, so the collection
+parsers write to (and the dashboard scans) stays bounded.
+Run it periodically, i.e. once a day. Only MongoDB is supported.
+"""
+
+import logging
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from collections.abc import Iterable, Iterator
+from itertools import groupby
+from operator import itemgetter
+
+from pymongo.collection import Collection
+
+sys.path.insert(0, os.getcwd())
+from configs.logging import init_logging
+from parser_helpers import get_message_repo
+from utils.archive import WRITE_BATCH_SIZE, write_partition
+
+logger = logging.getLogger(__name__)
+
+DELETE_BATCH_SIZE = 10_000
+# partitions are per chat, messages without a key stay in the collection
+ARCHIVABLE = {"chat_id": {"$ne": None}, "msg_id": {"$ne": None}}
+
+
+def remember_ids(documents: Iterable[dict], ids: list) -> Iterator[dict]:
+    """Documents as they are, with their _ids added to `ids`."""
+    for doc in documents:
+        ids.append(doc["_id"])
+        yield doc
+
+
+def archive_day(collection: Collection, path: str, day: datetime) -> int:
+    """
+    Write messages of a day to the archive chat by chat, and delete them
+    from the collection once their partition is written.
+    Messages are streamed, not loaded at once.
+    """
+    cursor = (
+        collection.find(
+            {"date": {"$gte": day, "$lt": day + timedelta(days=1)}} | ARCHIVABLE,
+            batch_size=WRITE_BATCH_SIZE,
+        )
+        .sort([("chat_id", 1), ("msg_id", 1)])
+        .allow_disk_use(True)
+    )
+    archived = 0
+    for chat_id, chat_documents in groupby(cursor, key=itemgetter("chat_id")):
+        ids = []
+        write_partition(path, day.date(), chat_id, remember_ids(chat_documents, ids))
+
+        # only after they are safely written
+        for i in range(0, len(ids), DELETE_BATCH_SIZE):
+            collection.delete_many({"_id": {"$in": ids[i : i + DELETE_BATCH_SIZE]}})
+        archived += len(ids)
+
+    return archived
+
+
+def main() -> None:
+    path = os.getenv("ARCHIVE_PATH", "./archive")
+    days = int(os.getenv("ARCHIVE_AFTER_DAYS", 90))
+    # whole days only, dates are stored as naive UTC
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).replace(
+        hour=0, minute=0, second=0, microsecond=0, tzinfo=None
+    )
+
+    message_repository = get_message_repo()
+    collection = message_repository.collection
+    # old messages are found (and the dashboard sorts) by date
+    collection.create_index("date")
+
+    archived = 0
+    try:
+        while True:
+            # skip days without messages
+            oldest = collection.find_one(
+                {"date": {"$lt": cutoff}} | ARCHIVABLE,
+                projection={"date": True},
+                sort=[("date", 1)],
+            )
+            if oldest is None:
+                break
+
+            day = oldest["date"].replace(hour=0, minute=0, second=0, microsecond=0)
+            count = archive_day(collection, path, day)
+            archived += count
+            logger.info(f"{day.date()}: {count} messages archived.")
+    finally:
+        message_repository.disconnect()
+
+    logger.info(f"Done. {archived} messages older than {cutoff.date()} archived.")
+
+
+if __name__ == "__main__":
+    init_logging()
+
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,85 @@
+"""
+Index messages that are already saved: term rollups and full-text search.
+Parsers only index messages they save, so run it after enabling indexes.
+Indexes are rebuilt from scratch (archived messages included), so it's safe
+to run again. Messages saved while it runs may be counted twice, so stop
+parsers first.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+from itertools import batched
+
+sys.path.insert(0, os.getcwd())
+from configs.logging import init_logging
+from parser_helpers import (
+    MessageIndex,
+    close_message_indexes,
+    get_async_message_repo,
+    get_message_indexes,
+)
+from utils.archive import iter_archived
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 10_000
+INDEXED_FIELDS = ["chat_id", "msg_id", "msg", "date"]
+
+
+async def commit(indexes: list[MessageIndex], batch: list[dict]) -> None:
+    for index in indexes:
+        await index.commit(batch)
+
+
+async def amain() -> None:
+    indexes = await get_message_indexes()
+    if not indexes:
+        logger.error("Neither ROLLUP_REPO nor SEARCH_INDEX_REPO is set.")
+        return
+
+    for index in indexes:
+        await index.repository.drop()
+    message_repository = await get_async_message_repo()
+
+    indexed = 0
+    batch = []
+    try:
+        async for document in message_repository.iter_all(
+            batch_size=BATCH_SIZE, projection=INDEXED_FIELDS
+        ):
+            batch.append(document)
+            if len(batch) < BATCH_SIZE:
+                continue
+
+            await commit(indexes, batch)
+            indexed += len(batch)
+            batch = []
+            logger.info(f"{indexed} messages indexed.")
+
+        await commit(indexes, batch)
+        indexed += len(batch)
+
+        # indexes keep covering messages moved out of the collection
+        archived = iter_archived(
+            os.getenv("ARCHIVE_PATH", "./archive"), BATCH_SIZE, INDEXED_FIELDS
+        )
+        for batch in batched(archived, BATCH_SIZE):
+            await commit(indexes, list(batch))
+            indexed += len(batch)
+            logger.info(f"{indexed} messages indexed.")
+
+        logger.info(f"Done. {indexed} messages indexed.")
+    finally:
+        await message_repository.disconnect()
+        await close_message_indexes(indexes)
+
+
+if __name__ == "__main__":
+    init_logging()
+
+    try:
+        asyncio.run(amain())
+    except KeyboardInterrupt:
+        pass
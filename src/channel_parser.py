@@ -2,24 +2,51 @@ import asyncio
 import logging
 import os
 import sys
+from collections.abc import AsyncIterator, Sequence
 
 from telethon import TelegramClient
 from telethon.hints import EntityLike
 
 sys.path.insert(0, os.getcwd())
 from configs.logging import init_logging
-from parser_helpers import get_chats_to_parse, get_message_repo, get_telegram_client
-from utils.message_helpers import MessageBuilder
-from utils.repo.interface import Repository
+from parser_helpers import (
+    MessageIndex,
+    close_message_indexes,
+    get_async_message_repo,
+    get_chats_to_parse,
+    get_checkpoint_store,
+    get_message_indexes,
+    get_telegram_client,
+    load_caches,
+    save_caches,
+)
+from utils.channel_helpers import TypeCompact
+from utils.checkpoints import CheckpointStore
+from utils.message_helpers import MessagePipeline, prefetch_custom_emojis
+from utils.repo.buffer import BufferedWriter
+from utils.repo.interface import AsyncRepository
 
 logger = logging.getLogger(__name__)
 
+# methods used to build a message from chat history
+REGISTERED_METHODS = [
+    "extract_text",
+    "extract_dialog_info",
+    "extract_engagements",
+    "extract_forward_info",
+]
+
+# same as the number of messages iter_messages gets with one request
+PAGE_SIZE = 100
+
 
 async def parse_channel(
     client: TelegramClient,
-    message_repository: Repository,
-    builder: MessageBuilder,
+    message_repository: AsyncRepository,
+    checkpoints: CheckpointStore,
+    pipeline: MessagePipeline,
     entity: EntityLike,
+    indexes: Sequence[MessageIndex] = (),
 ) -> None:
     if not client.is_connected():
         await client.connect()
@@ -29,49 +56,170 @@ async def parse_channel(
         logger.warning(f"Couldn't find chat {entity}. Skipping...")
         return
 
-    logger.info(f"Retreiving data from {entity}.")
+    min_id = checkpoints.get(entity)
+    logger.info(f"Retreiving data from {entity} starting after message {min_id}.")
 
-    docs = []
-    async for message in client.iter_messages(chat, limit=110, wait_time=2):
+    async def on_flush(documents: list[dict], inserted: list[dict]) -> None:
+        # indexes are updated only after messages are actually saved,
+        # re-parsed messages are already counted and indexed
+        for index in indexes:
+            await index.commit(inserted)
 
-        for method in builder.registered_methods:
-            await method(message)
+    writer = BufferedWriter(
+        message_repository,
+        max_size=int(os.getenv("WRITE_BATCH_SIZE", 100)),
+        max_delay_ms=int(os.getenv("WRITE_BATCH_DELAY_MS", 5000)),
+        on_flush=on_flush,
+    )
+    newest = None  # the document of the latest message
+    put = 0
+    async with writer:
+        # newest messages first; the limit is only for the first run of a chat,
+        # after that everything since the checkpoint is fetched, so nothing is skipped
+        messages = client.iter_messages(
+            chat,
+            limit=get_parsing_limit() if min_id == 0 else None,
+            min_id=min_id,
+            wait_time=2,
+        )
+        async for page in iter_pages(messages, PAGE_SIZE):
+            # one request for all new custom emojis on the page instead of one per emoji
+            await prefetch_custom_emojis(client, page)
+
+            docs = await asyncio.gather(*(pipeline(message) for message in page))
+            for doc in docs:
+                if newest is None or doc["msg_id"] > newest["msg_id"]:
+                    newest = doc
+                await writer.put(doc)
+                put += 1
+
+    logger.info(f"{writer.flushed} messages retreived.")
+
+    # messages come newest first, so checkpoint moves only when all of them are saved
+    # (failed batches are dumped to a file by the writer and fetched again next time)
+    if newest is not None and writer.flushed == put:
+        await checkpoints.commit([newest])
+
+
+async def iter_pages[T](
+    iterator: AsyncIterator[T], page_size: int
+) -> AsyncIterator[list[T]]:
+    page = []
+    async for item in iterator:
+        page.append(item)
+        if len(page) == page_size:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+def get_parsing_limit() -> int | None:
+    """Max number of messages parsed from each chat in one run ("all" for no limit)."""
+    limit = os.getenv("PARSING_LIMIT", "110")
+    return None if limit == "all" else int(limit)
+
+
+async def parsing_worker(
+    client: TelegramClient,
+    message_repository: AsyncRepository,
+    checkpoints: CheckpointStore,
+    pipeline: MessagePipeline,
+    queue: asyncio.Queue,
+    indexes: Sequence[MessageIndex] = (),
+) -> None:
+    """Take dialogs from a shared queue one by one until it's empty."""
+    while True:
+        try:
+            dialog = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+
+        try:
+            await parse_channel(
+                client,
+                message_repository,
+                checkpoints,
+                pipeline,
+                dialog["id"],
+                indexes=indexes,
+            )
+        except Exception:
+            # one broken chat shouldn't stop the whole backfill
+            logger.exception(f"Failed to parse chat {dialog['id']}.")
+        finally:
+            queue.task_done()
+
+
+async def parse_channels(
+    client: TelegramClient,
+    message_repository: AsyncRepository,
+    checkpoints: CheckpointStore,
+    dialogs: list[TypeCompact],
+    concurrency: int = 1,
+    indexes: Sequence[MessageIndex] = (),
+) -> None:
+    """
+    Parse history of all dialogs with at most `concurrency` of them at once.
+
+    Dialogs are handed out in order from a FIFO queue, so the next free worker
+    always takes the oldest waiting dialog and a single huge channel can't starve
+    the rest. Since workers only wait on network, their requests get interleaved
+    on the event loop and total time scales with `len(dialogs) / concurrency`.
+    """
+    # connect once, otherwise every worker tries to do it at the same time
+    if not client.is_connected():
+        await client.connect()
 
-        doc = builder.build()
+    # shared by all workers, it's stateless
+    pipeline = MessagePipeline(
+        registered_methods=REGISTERED_METHODS, client=client, chats=dialogs
+    )
+
+    queue = asyncio.Queue()
+    for dialog in dialogs:
+        queue.put_nowait(dialog)
 
-        docs.append(doc)
-        message_repository.put_one(doc)
+    num_workers = max(1, min(concurrency, len(dialogs)))
+    logger.info(f"Parsing {len(dialogs)} chats with {num_workers} workers...")
 
-    # message_repository.put_many(docs)
-    logger.info(f"{len(docs)} messages retreived.")
+    async with asyncio.TaskGroup() as tg:
+        for _ in range(num_workers):
+            tg.create_task(
+                parsing_worker(
+                    client, message_repository, checkpoints, pipeline, queue, indexes
+                )
+            )
 
 
 async def amain() -> None:
 
     dialogs = get_chats_to_parse()
 
-    message_repository = get_message_repo()
+    message_repository = await get_async_message_repo()
+    checkpoints = await get_checkpoint_store()
+    cache_repository = await load_caches()
+    indexes = await get_message_indexes()
 
     client = get_telegram_client(session_type="mongodb")
     client.loop.set_debug(True)
     logger.info("Telegram Client started.")
 
-    builder = MessageBuilder(
-        registered_methods=[
-            "extract_text",
-            "extract_dialog_info",
-            "extract_engagements",
-            "extract_forward_info",
-        ],
-        client=client,
-        chats=dialogs,
-    )
-
-    # not the most effective async :(
-    for dialog in dialogs:
-        await parse_channel(client, message_repository, builder, dialog["id"])
-
-    message_repository.disconnect()
+    try:
+        await parse_channels(
+            client,
+            message_repository,
+            checkpoints,
+            dialogs,
+            concurrency=int(os.getenv("PARSING_CONCURRENCY", 5)),
+            indexes=indexes,
+        )
+    finally:
+        await save_caches(cache_repository)
+        await close_message_indexes(indexes)
+
+    await message_repository.disconnect()
+    await checkpoints.repository.disconnect()
 
 
 if __name__ == "__main__":
@@ -1,70 +1,251 @@
-import json
+"""
+Crawl the network of channels by following forwarded messages breadth-first.
+
+Frontier (channels that are discovered, but not crawled yet) and the set of seen
+channels are persisted in a repository, so an interrupted crawl continues
+from where it stopped instead of starting over.
+"""
+
+import asyncio
+import itertools
+import logging
 import os
 import sys
+from collections import Counter
+from collections.abc import Mapping
 
-from dotenv import load_dotenv
 from telethon import TelegramClient
+from telethon.tl.types import PeerChannel
+from telethon.utils import get_peer_id, resolve_id
 
 sys.path.insert(0, os.getcwd())
-from utils.channel_helpers import (
-    CompactChannel,
-    CompactChat,
-    CompactUser,
-    TypeCompact,
-    entitity_info_request,
-    get_peer_id,
-)
-from utils.repo.interface import Repository, repository_factory
-
-
-async def amain(
-    client: TelegramClient,
-    repository: Repository,
-    id: int,
-    seen_channels: dict[int, TypeCompact],
-) -> None:
-    try:
-        chat = await client.get_input_entity(id)
-    except ValueError:
-        chat = await entitity_info_request(client, id)
-    # docs = []
-    async for message in client.iter_messages(chat, limit=100):
-        if message.fwd_from is not None:
-            peer = message.fwd_from.from_id
-            peer_id = get_peer_id(peer)
-            if peer_id not in seen_channels.keys():
-                res = await entitity_info_request(client, peer)
-                seen_channels[peer_id] = res
-            else:
-                res = seen_channels[peer_id]
-            if res is not None:
-                # docs.append(res)
-                repository.put_one(res)
-    seen_channels.pop(None)  # TODO: save them somewhere?
-    # repository.put_many(docs)
+from configs.logging import init_logging
+from parser_helpers import get_telegram_client, load_caches, save_caches
+from utils.channel_helpers import peer_info_request
+from utils.forward_graph import ForwardGraph
+from utils.repo.interface import AsyncRepository, async_repository_factory
 
+logger = logging.getLogger(__name__)
 
-if __name__ == "__main__":
-    with open("./tg-keys.json", "r") as f:
-        keys = json.load(f)
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+
+class Crawler:
+    def __init__(
+        self,
+        client: TelegramClient,
+        frontier_repository: AsyncRepository,
+        channel_repository: AsyncRepository,
+        graph: ForwardGraph,
+        max_depth: int = 2,
+        messages_per_channel: int = 100,
+        concurrency: int = 5,
+    ) -> None:
+        """
+        frontier_repository: crawl state, should upsert by "id"
+        channel_repository: info about discovered channels, should upsert by "id"
+        graph: forwards between crawled channels, used to crawl popular ones first
+        max_depth: how many forwards away from seed channels to go
+        messages_per_channel: number of latest messages checked for forwards
+        """
+        self.client = client
+        self.frontier_repository = frontier_repository
+        self.channel_repository = channel_repository
+        self.graph = graph
+        self.max_depth = max_depth
+        self.messages_per_channel = messages_per_channel
+        self.concurrency = concurrency
+
+        # (depth, -forwards, order, marked channel id), so channels are crawled
+        # level by level, and the most forwarded ones go first within a level
+        self._queue: asyncio.PriorityQueue[tuple[int, int, int, int]] = (
+            asyncio.PriorityQueue()
+        )
+        self._order = itertools.count()
+        self._seen: set[int] = set()
+
+        self.crawled = 0
+
+    async def load(self) -> None:
+        """Restore seen channels, frontier and forward graph from the previous run."""
+        state: dict[int, Mapping] = {}
+        async for doc in self.frontier_repository.iter_all(
+            projection=["id", "depth", "status", "fwd_ids", "fwd_counts"]
+        ):
+            state[doc["id"]] = doc  # the latest record wins
+
+        for peer_id, doc in state.items():
+            self._seen.add(peer_id)
+            if doc.get("fwd_ids"):
+                self.graph.add_edges(
+                    peer_id, dict(zip(doc["fwd_ids"], doc["fwd_counts"]))
+                )
+
+        # after the graph is restored, so priorities are right
+        for peer_id, doc in state.items():
+            if doc.get("status") == PENDING:
+                self._enqueue(peer_id, doc.get("depth", 0))
+
+        logger.info(
+            f"{len(self._seen)} channels seen before, "
+            f"{self._queue.qsize()} of them left to crawl."
+        )
+
+    def _enqueue(self, peer_id: int, depth: int) -> None:
+        priority = -self.graph.in_weight(peer_id)
+        self._queue.put_nowait((depth, priority, next(self._order), peer_id))
+
+    async def add_seeds(self, seeds: list[str | int]) -> None:
+        docs = []
+        for seed in seeds:
+            try:
+                peer_id = get_peer_id(await self.client.get_input_entity(seed))
+            except (ValueError, TypeError):
+                logger.warning(f"Seed {seed} not found. Skipping...")
+                continue
+            if peer_id not in self._seen:
+                self._seen.add(peer_id)
+                self._enqueue(peer_id, 0)
+                docs.append({"id": peer_id, "depth": 0, "status": PENDING})
+        if docs:
+            await self.frontier_repository.put_many(docs)
+
+    async def _find_forwarded_channels(self, peer_id: int) -> Counter[int]:
+        """Channels messages were forwarded from, with number of messages."""
+        forwarded_from = Counter()
+        async for message in self.client.iter_messages(
+            peer_id, limit=self.messages_per_channel
+        ):
+            if message.fwd_from is None:
+                continue
+            # only channels have public history that can be crawled further
+            if isinstance(message.fwd_from.from_id, PeerChannel):
+                forwarded_from[get_peer_id(message.fwd_from.from_id)] += 1
+        forwarded_from.pop(peer_id, None)
+        return forwarded_from
+
+    async def _crawl_channel(self, peer_id: int, depth: int) -> None:
+        channel_id, peer_type = resolve_id(peer_id)
+        channel_info = await peer_info_request(self.client, peer_type(channel_id))
+        if channel_info is None:
+            await self.frontier_repository.put_one(
+                {"id": peer_id, "depth": depth, "status": FAILED}
+            )
+            return
+        await self.channel_repository.put_one(channel_info)
+
+        forwarded_from = await self._find_forwarded_channels(peer_id)
+        self.graph.add_edges(peer_id, forwarded_from)
 
-    load_dotenv("./env/congig.env")
+        docs = []
+        if depth < self.max_depth:
+            for child_id in forwarded_from:
+                if child_id in self._seen:
+                    continue
+                self._seen.add(child_id)
+                self._enqueue(child_id, depth + 1)
+                docs.append({"id": child_id, "depth": depth + 1, "status": PENDING})
 
-    repository = repository_factory(
-        repo_type=os.getenv("REPOSITORY_TYPE"),
-        table_name="cached_channels",
-        collection_name=os.getenv("COLLECTION_NAME"),
+        # children are saved together with the parent being done,
+        # so after a crash either both are in the frontier or the parent is redone
+        docs.append(
+            {
+                "id": peer_id,
+                "depth": depth,
+                "status": DONE,
+                # edges of the graph, so it can be restored
+                "fwd_ids": list(forwarded_from.keys()),
+                "fwd_counts": list(forwarded_from.values()),
+            }
+        )
+        await self.frontier_repository.put_many(docs)
+
+        self.crawled += 1
+        logger.info(
+            f"Crawled {peer_id} (depth {depth}), found {len(docs) - 1} new channels. "
+            f"{self._queue.qsize()} channels in the frontier."
+        )
+
+    async def _worker(self) -> None:
+        while True:
+            depth, _, _, peer_id = await self._queue.get()
+            try:
+                await self._crawl_channel(peer_id, depth)
+            except Exception:
+                # stays pending, so it's retried on the next run
+                logger.exception(f"Failed to crawl {peer_id}.")
+            finally:
+                self._queue.task_done()
+
+    async def run(self) -> None:
+        logger.info(f"Crawling with {self.concurrency} workers...")
+        workers = [
+            asyncio.create_task(self._worker()) for _ in range(self.concurrency)
+        ]
+        try:
+            await self._queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+        logger.info(f"Crawling finished. {self.crawled} channels crawled.")
+
+
+async def get_crawler_repo(collection_name: str) -> AsyncRepository:
+
+    repository = async_repository_factory(
+        repo_type=os.getenv("CRAWLER_REPO", os.getenv("CHANNEL_REPO")),
+        table_name=os.getenv("CRAWLER_TABLE", "crawler"),
+        collection_name=collection_name,
         user=os.getenv("DB_USER"),
         passwd=os.getenv("DB_PASSWD"),
         ip=os.getenv("DB_IP"),
         port=os.getenv("DB_PORT"),
+        key_fields=["id"],
+    )
+    await repository.connect()
+
+    return repository
+
+
+async def amain() -> None:
+    seeds = [seed.strip() for seed in os.getenv("CRAWLER_SEEDS", "").split(",")]
+    # numeric seeds should be marked ids (i.e. -100... for channels)
+    seeds = [int(seed) if seed.lstrip("-").isdigit() else seed for seed in seeds if seed]
+
+    frontier_repository = await get_crawler_repo("frontier")
+    channel_repository = await get_crawler_repo("channels")
+    cache_repository = await load_caches()
+
+    client = get_telegram_client(session_type="mongodb")
+    await client.start()
+    logger.info("Telegram Client started.")
+
+    crawler = Crawler(
+        client,
+        frontier_repository,
+        channel_repository,
+        ForwardGraph(),
+        max_depth=int(os.getenv("CRAWLER_MAX_DEPTH", 2)),
+        messages_per_channel=int(os.getenv("CRAWLER_MESSAGES_PER_CHANNEL", 100)),
+        concurrency=int(os.getenv("CRAWLER_CONCURRENCY", 5)),
     )
-    repository.connect()
+    try:
+        await crawler.load()
+        await crawler.add_seeds(seeds)
+        await crawler.run()
+    finally:
+        crawler.graph.save(os.getenv("FORWARD_GRAPH_PATH", "./forward_graph.npz"))
+        await save_caches(cache_repository)
+        await frontier_repository.disconnect()
+        await channel_repository.disconnect()
 
-    client = TelegramClient("anon", keys["api_id"], keys["api_hash"])
 
-    with client:
-        client.loop.set_debug(True)
-        client.loop.run_until_complete(amain(client, repository, seen_channels={}))
+if __name__ == "__main__":
+    init_logging()
 
-    repository.disconnect()
+    try:
+        asyncio.run(amain())
+    except KeyboardInterrupt:
+        pass
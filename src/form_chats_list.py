@@ -9,7 +9,12 @@ from dotenv import load_dotenv
 
 sys.path.insert(0, os.getcwd())
 from configs.logging import init_logging
-from parser_helpers import get_channel_repo, get_telegram_client
+from parser_helpers import (
+    get_channel_repo,
+    get_telegram_client,
+    load_caches,
+    save_caches,
+)
 from utils.channel_helpers import get_non_subscription_entities, get_subscriptions_list
 
 logger = logging.getLogger(__name__)
@@ -28,6 +33,7 @@ async def amain() -> None:
     non_subscribed_channels = configure()
 
     repository = get_channel_repo()
+    cache_repository = await load_caches()
 
     client = get_telegram_client(session_type="mongodb")
 
@@ -48,6 +54,7 @@ async def amain() -> None:
     )
 
     repository.disconnect()
+    await save_caches(cache_repository)
 
 
 if __name__ == "__main__":
@@ -2,22 +2,93 @@ import asyncio
 import logging
 import os
 import sys
+from collections.abc import Awaitable, Callable, Mapping
+from typing import Optional
 
 from telethon import TelegramClient
 from telethon.events import NewMessage
 
 sys.path.insert(0, os.getcwd())
 from configs.logging import init_logging
-from parser_helpers import get_chats_to_parse, get_message_repo, get_telegram_client
-from utils.message_helpers import MessageBuilder
-from utils.repo.interface import Repository
+from parser_helpers import (
+    MessageIndex,
+    close_message_indexes,
+    get_async_message_repo,
+    get_chats_to_parse,
+    get_message_indexes,
+    get_telegram_client,
+    load_caches,
+    save_caches,
+)
+from utils.message_helpers import CompactMessage, MessagePipeline
+from utils.recording import EventRecorder
+from utils.repo.ingest import IngestQueue
+from utils.repo.interface import AsyncRepository
 
 logger = logging.getLogger(__name__)
 
+LIVE_METHODS = ["extract_text", "extract_dialog_info", "extract_forward_info"]
 
-async def live_parser(
-    tg_client: TelegramClient, chats: list[dict], message_repository: Repository
-) -> None:
+
+def get_live_pipeline(tg_client: TelegramClient, chats: list[dict]) -> MessagePipeline:
+    return MessagePipeline(
+        registered_methods=LIVE_METHODS, client=tg_client, chats=chats
+    )
+
+
+def get_ingest_queue(
+    message_repository: AsyncRepository,
+    indexes: list[MessageIndex],
+    on_flush: Optional[Callable[[list[Mapping]], Awaitable[None]]] = None,
+) -> IngestQueue:
+    """on_flush: called after indexes are updated with a written batch"""
+
+    async def update_indexes(documents: list[Mapping], inserted: list[Mapping]) -> None:
+        # messages that are already saved (i.e. on catch up) are already indexed
+        for index in indexes:
+            await index.commit(inserted)
+        if on_flush is not None:
+            await on_flush(documents)
+
+    return IngestQueue(
+        message_repository,
+        maxsize=int(os.getenv("INGEST_QUEUE_SIZE", 10_000)),
+        batch_size=int(os.getenv("WRITE_BATCH_SIZE", 100)),
+        max_delay_ms=int(os.getenv("INGEST_BATCH_DELAY_MS", 500)),
+        # only messages that were actually saved are indexed
+        on_flush=update_indexes,
+    )
+
+
+def make_handler(
+    pipeline: MessagePipeline, ingest_queue: IngestQueue
+) -> Callable[[NewMessage.Event], Awaitable[CompactMessage | None]]:
+    """
+    Handler of new messages. Replays call it directly, so they go through
+    the same path. Returns the queued document (None if message was skipped),
+    Telethon ignores it.
+    """
+
+    async def handler(event: NewMessage.Event) -> CompactMessage | None:
+        # parse only messages with text, though images may also be of interest
+        if event.message.message == "":  # tbh messages with len 1 are useless too
+            return None
+
+        document = await pipeline(event.message)
+
+        # the actual write happens in the ingest queue's writer task
+        await ingest_queue.put(document)
+        logger.debug(
+            f'Queued message {document["msg_id"]} '
+            f'from chat {document["chat_id"]}. '
+            f"Queue depth: {ingest_queue.depth}."
+        )
+        return document
+
+    return handler
+
+
+async def live_parser(tg_client: TelegramClient, chats: list[dict]) -> None:
 
     await tg_client.start()
     logger.info("Telegram Client started.")
@@ -26,47 +97,55 @@ async def live_parser(
 
     chat_ids = [chat["id"] for chat in chats]
 
-    @tg_client.on(
+    # async repository has to be connected inside the running event loop
+    message_repository = await get_async_message_repo()
+    cache_repository = await load_caches()
+    indexes = await get_message_indexes()
+
+    # built once, since creating a chats lookup table for every message is wasteful
+    pipeline = get_live_pipeline(tg_client, chats)
+    ingest_queue = get_ingest_queue(message_repository, indexes)
+
+    # raw traffic for replays, see benchmarks/replay_live.py
+    # handlers are called in the order they were added, so the recorder goes first:
+    # arrival times shouldn't include the time messages spend being parsed
+    recorder = None
+    if record_path := os.getenv("LIVE_RECORD_PATH"):
+        recorder = EventRecorder(record_path)
+        tg_client.add_event_handler(recorder, NewMessage(chats=chat_ids))
+
+    tg_client.add_event_handler(
+        make_handler(pipeline, ingest_queue),
         NewMessage(
             chats=chat_ids,
             # commented out so that both incoming and outgoing messages are parsed
             # useful for testing: just send some message to yourself
             # incoming=True
-        )
+        ),
     )
-    async def handler(event: NewMessage.Event) -> None:
-        # parse only messages with text, though images may also be of interest
-        builder = MessageBuilder(registered_methods=[], client=tg_client, chats=chats)
-        if event.message.message != "":  # tbh messages with len 1 are useless too
-            await builder.extract_text(event.message)
-            await builder.extract_dialog_info(event.message)
-            await builder.extract_forward_info(event.message)
-            document = builder.build()
 
-            response = message_repository.put_one(document)
-            logger.info(
-                f'Added message {document["msg_id"]} '
-                f'from chat {document["chat_id"]}. ' + response
-            )
-
-    await tg_client.run_until_disconnected()
+    try:
+        async with ingest_queue:
+            await tg_client.run_until_disconnected()
+    finally:
+        await message_repository.disconnect()
+        await close_message_indexes(indexes)
+        await save_caches(cache_repository)
+        if recorder is not None:
+            recorder.close()
 
 
 def main() -> None:
 
     chats = get_chats_to_parse()
 
-    message_repository = get_message_repo()
-
     tg_client = get_telegram_client(session_type="mongodb")
 
     # handle SIGINT without an error message from asyncio
     try:
-        asyncio.run(live_parser(tg_client, chats, message_repository))
+        asyncio.run(live_parser(tg_client, chats))
     except KeyboardInterrupt:
         pass  # TelegramClient connection autocloses on SIGINT
-    finally:
-        message_repository.disconnect()
 
 
 if __name__ == "__main__":
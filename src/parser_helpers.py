@@ -1,20 +1,60 @@
 import logging
 import os
 import sys
+from collections.abc import Mapping
 from pathlib import Path
+from typing import Protocol
 
 from dotenv import load_dotenv
 from telethon import TelegramClient
 
 sys.path.insert(0, os.getcwd())
-from utils.channel_helpers import TypeCompact
-from utils.repo.interface import Repository, repository_factory
+from utils.cache import Cache
+from utils.channel_helpers import TypeCompact, entity_cache
+from utils.checkpoints import CheckpointStore
+from utils.message_helpers import custom_emoji_cache
+from utils.rollups import TermRollup, rollup_key
+from utils.search_index import INDEX_KEY, SearchIndexWriter
+from utils.repo.interface import (
+    AsyncRepository,
+    Repository,
+    RepositoryType,
+    async_repository_factory,
+    repository_factory,
+)
 from utils.tg_helpers import get_telemongo_session
 
 logger = logging.getLogger(__name__)
 
 load_dotenv(dotenv_path=Path(os.getenv("CONFIG_PATH")))
 
+# natural keys, so re-parsing the same message/channel doesn't create a duplicate
+MESSAGE_KEY = ["chat_id", "msg_id"]
+CHANNEL_KEY = ["id"]
+CHECKPOINT_KEY = ["chat_id"]
+CACHE_KEY = ["cache", "key"]
+
+# caches of slow Telegram requests that survive restarts
+PERSISTENT_CACHES: list[Cache] = [entity_cache, custom_emoji_cache]
+
+# parsers only need to know how to find a chat and how to call it
+CHAT_FIELDS = ["id", "name", "username", "title"]
+
+
+def check_document_repo(variable: str) -> str | None:
+    """
+    Type of a repository for documents other than messages (caches, rollups,
+    search index) from an env variable, None if it isn't set.
+    DynamoRepository only stores messages, it has no increments, appends or drop.
+    """
+    repo_type = os.getenv(variable)
+    if repo_type and repo_type.lower() == RepositoryType.DYNAMODB:
+        raise ValueError(
+            f"{variable}={repo_type} isn't supported: DynamoDB repository "
+            "can only store messages. Use mongo or local."
+        )
+    return repo_type
+
 
 def get_message_repo() -> Repository:
 
@@ -26,12 +66,174 @@ def get_message_repo() -> Repository:
         passwd=os.getenv("DB_PASSWD"),
         ip=os.getenv("DB_IP"),
         port=os.getenv("DB_PORT"),
+        region=os.getenv("AWS_REGION", "eu-central-1"),
+        key_fields=MESSAGE_KEY,
+        file_format=os.getenv("LOCAL_FILE_FORMAT", "json"),
+        endpoint_url=os.getenv("DYNAMO_ENDPOINT_URL"),
+        max_workers=int(os.getenv("DYNAMO_WRITE_WORKERS", 4)),
     )
     message_repository.connect()
 
     return message_repository
 
 
+async def get_async_message_repo() -> AsyncRepository:
+
+    message_repository = async_repository_factory(
+        repo_type=os.getenv("MESSAGE_REPO"),
+        table_name=os.getenv("MESSAGE_TABLE"),
+        collection_name=os.getenv("MESSAGE_COLLECTION"),
+        user=os.getenv("DB_USER"),
+        passwd=os.getenv("DB_PASSWD"),
+        ip=os.getenv("DB_IP"),
+        port=os.getenv("DB_PORT"),
+        region=os.getenv("AWS_REGION", "eu-central-1"),
+        key_fields=MESSAGE_KEY,
+        file_format=os.getenv("LOCAL_FILE_FORMAT", "json"),
+        endpoint_url=os.getenv("DYNAMO_ENDPOINT_URL"),
+        max_workers=int(os.getenv("DYNAMO_WRITE_WORKERS", 4)),
+    )
+    await message_repository.connect()
+
+    return message_repository
+
+
+async def get_checkpoint_store() -> CheckpointStore:
+
+    # checkpoints are kept separately for every message collection
+    checkpoint_repository = async_repository_factory(
+        repo_type=os.getenv("CHECKPOINT_REPO", os.getenv("MESSAGE_REPO")),
+        table_name=os.getenv("CHECKPOINT_TABLE", "checkpoints"),
+        collection_name=os.getenv(
+            "CHECKPOINT_COLLECTION", os.getenv("MESSAGE_COLLECTION")
+        ),
+        user=os.getenv("DB_USER"),
+        passwd=os.getenv("DB_PASSWD"),
+        ip=os.getenv("DB_IP"),
+        port=os.getenv("DB_PORT"),
+        key_fields=CHECKPOINT_KEY,
+    )
+    await checkpoint_repository.connect()
+
+    checkpoints = CheckpointStore(checkpoint_repository)
+    await checkpoints.load()
+
+    return checkpoints
+
+
+async def get_term_rollup() -> TermRollup | None:
+    """Term counts for the dashboard trend, if ROLLUP_REPO is set."""
+    repo_type = check_document_repo("ROLLUP_REPO")
+    if not repo_type:
+        return None
+
+    per_chat = os.getenv("ROLLUP_PER_CHAT", "yes") == "yes"
+    rollup_repository = async_repository_factory(
+        repo_type=repo_type,
+        table_name=os.getenv("ROLLUP_TABLE", os.getenv("MESSAGE_TABLE")),
+        collection_name=os.getenv(
+            "ROLLUP_COLLECTION", f"{os.getenv('MESSAGE_COLLECTION')}_terms"
+        ),
+        user=os.getenv("DB_USER"),
+        passwd=os.getenv("DB_PASSWD"),
+        ip=os.getenv("DB_IP"),
+        port=os.getenv("DB_PORT"),
+        key_fields=rollup_key(per_chat),
+        file_format="jsonl",
+    )
+    await rollup_repository.connect()
+
+    return TermRollup(rollup_repository, per_chat=per_chat)
+
+
+async def get_search_index() -> SearchIndexWriter | None:
+    """Full-text index of messages for the dashboard, if SEARCH_INDEX_REPO is set."""
+    repo_type = check_document_repo("SEARCH_INDEX_REPO")
+    if not repo_type:
+        return None
+
+    index_repository = async_repository_factory(
+        repo_type=repo_type,
+        table_name=os.getenv("SEARCH_INDEX_TABLE", os.getenv("MESSAGE_TABLE")),
+        collection_name=os.getenv(
+            "SEARCH_INDEX_COLLECTION", f"{os.getenv('MESSAGE_COLLECTION')}_index"
+        ),
+        user=os.getenv("DB_USER"),
+        passwd=os.getenv("DB_PASSWD"),
+        ip=os.getenv("DB_IP"),
+        port=os.getenv("DB_PORT"),
+        key_fields=INDEX_KEY,
+    )
+    await index_repository.connect()
+
+    return SearchIndexWriter(index_repository)
+
+
+class MessageIndex(Protocol):
+    """Something that is updated with every batch of newly saved messages."""
+
+    repository: AsyncRepository
+
+    async def commit(self, documents: list[Mapping]) -> None:
+        pass
+
+
+async def get_message_indexes() -> list[MessageIndex]:
+    """All configured indexes: term rollups and full-text search."""
+    indexes = [await get_term_rollup(), await get_search_index()]
+    return [index for index in indexes if index is not None]
+
+
+async def close_message_indexes(indexes: list[MessageIndex]) -> None:
+    for index in indexes:
+        await index.repository.disconnect()
+
+
+async def load_caches() -> AsyncRepository | None:
+    """
+    Warm up request caches from a snapshot, if CACHE_REPO is set.
+    Returned repository should be passed to `save_caches` on shutdown.
+    """
+    repo_type = check_document_repo("CACHE_REPO")
+    if not repo_type:
+        return None
+
+    cache_repository = async_repository_factory(
+        repo_type=repo_type,
+        table_name=os.getenv("CACHE_TABLE", "cache"),
+        collection_name=os.getenv("CACHE_COLLECTION", "telegram_requests"),
+        user=os.getenv("DB_USER"),
+        passwd=os.getenv("DB_PASSWD"),
+        ip=os.getenv("DB_IP"),
+        port=os.getenv("DB_PORT"),
+        key_fields=CACHE_KEY,
+    )
+    await cache_repository.connect()
+
+    for cache in PERSISTENT_CACHES:
+        try:
+            await cache.load(cache_repository)
+        except Exception:
+            logger.exception(f"Failed to load {cache.name} cache. Starting cold...")
+
+    return cache_repository
+
+
+async def save_caches(cache_repository: AsyncRepository | None) -> None:
+    for cache in PERSISTENT_CACHES:
+        logger.info(f"{cache.name} cache: {cache.stats()}")
+
+    if cache_repository is None:
+        return
+
+    for cache in PERSISTENT_CACHES:
+        try:
+            await cache.snapshot(cache_repository)
+        except Exception:
+            logger.exception(f"Failed to save {cache.name} cache.")
+    await cache_repository.disconnect()
+
+
 def get_channel_repo() -> Repository:
 
     channel_repository = repository_factory(
@@ -42,6 +244,7 @@ def get_channel_repo() -> Repository:
         passwd=os.getenv("DB_PASSWD"),
         ip=os.getenv("DB_IP"),
         port=os.getenv("DB_PORT"),
+        key_fields=CHANNEL_KEY,
     )
     channel_repository.connect()
 
@@ -52,7 +255,7 @@ def get_chats_to_parse() -> list[TypeCompact]:
 
     logger.info("Fetching channels list...")
     chats_repository = get_channel_repo()
-    chats = chats_repository.get_all()
+    chats = list(chats_repository.iter_all(projection=CHAT_FIELDS))
     chats_repository.disconnect()
     logger.info("Channels list loaded.")
 
@@ -0,0 +1,82 @@
+"""
+Rank channels found by the crawler and print the most important ones
+that aren't in the parsing list yet.
+"""
+
+import json
+import logging
+import os
+import sys
+
+from telethon.utils import resolve_id
+
+sys.path.insert(0, os.getcwd())
+from configs.logging import init_logging
+from parser_helpers import get_chats_to_parse
+from utils.forward_graph import ForwardGraph
+from utils.repo.interface import repository_factory
+
+logger = logging.getLogger(__name__)
+
+
+def get_crawled_channels() -> dict[int, dict]:
+    """Info about channels the crawler has seen, by (unmarked) channel id."""
+    repository = repository_factory(
+        repo_type=os.getenv("CRAWLER_REPO", os.getenv("CHANNEL_REPO")),
+        table_name=os.getenv("CRAWLER_TABLE", "crawler"),
+        collection_name="channels",
+        user=os.getenv("DB_USER"),
+        passwd=os.getenv("DB_PASSWD"),
+        ip=os.getenv("DB_IP"),
+        port=os.getenv("DB_PORT"),
+        key_fields=["id"],
+    )
+    repository.connect()
+    channels = {
+        doc["id"]: doc
+        for doc in repository.iter_all(
+            projection=["id", "name", "title", "participants_count"]
+        )
+    }
+    repository.disconnect()
+
+    return channels
+
+
+def rank_channels(
+    graph: ForwardGraph, parsed_ids: set[int], channels: dict[int, dict], n: int
+) -> list[dict]:
+    ranked = []
+    for peer_id, score in graph.top(len(graph)):
+        channel_id, _ = resolve_id(peer_id)
+        if channel_id in parsed_ids:
+            continue
+        channel = channels.get(channel_id, {"id": channel_id})
+        ranked.append(
+            {
+                **channel,
+                "pagerank": score,
+                "forwarded_messages": graph.in_weight(peer_id),
+            }
+        )
+        if len(ranked) == n:
+            break
+
+    return ranked
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+
+    graph = ForwardGraph.load(os.getenv("FORWARD_GRAPH_PATH", "./forward_graph.npz"))
+    logger.info(f"Ranking {len(graph)} channels by {graph.num_edges} edges...")
+
+    parsed_ids = {chat["id"] for chat in get_chats_to_parse()}
+    ranked = rank_channels(graph, parsed_ids, get_crawled_channels(), n)
+
+    print(json.dumps(ranked, indent=4, ensure_ascii=False, default=str))
+
+
+if __name__ == "__main__":
+    init_logging()
+    main()
@@ -0,0 +1,32 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.getcwd())
+from utils.cache import Cache
+
+
+def test_keys_missing_from_batch_response_are_fetched_by_waiters():
+    cache = Cache("custom_emojis")
+    requested = []
+
+    async def fetch_many(keys):
+        await asyncio.sleep(0.01)
+        return {"1": "👍"}  # Telegram didn't return document 2
+
+    async def fetch_one():
+        requested.append("2")
+        return "🔥"
+
+    async def main():
+        batch = asyncio.create_task(cache.get_or_fetch_many(["1", "2"], fetch_many))
+        await asyncio.sleep(0)
+        # waits for the batch, then has to request the missing key itself
+        value = await cache.get_or_fetch("2", fetch_one)
+        await batch
+        return value
+
+    assert asyncio.run(main()) == "🔥"
+    assert requested == ["2"]
+    assert cache.get("1") == "👍"
+    assert cache.get("2") == "🔥"
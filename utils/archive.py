@@ -0,0 +1,117 @@
+"""
+Cold storage of old messages: zstd-compressed Parquet files partitioned
+by day and chat, `<path>/day=2024-05-01/chat_id=123/part-0.parquet`.
+
+Columns the dashboard shows and filters on are stored as is, and the whole
+document is kept as extended JSON, so nothing is lost by moving it here.
+The dashboard reads partitions back in dashboard/utils/archive.py.
+"""
+
+import os
+from collections.abc import Iterable, Iterator, Mapping
+from datetime import date, timezone
+from itertools import batched
+from pathlib import Path
+from typing import Optional
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from bson import json_util
+
+SCHEMA = pa.schema(
+    [
+        ("msg_id", pa.int64()),
+        ("date", pa.timestamp("ms", tz="UTC")),
+        ("msg", pa.string()),
+        ("chat_name", pa.string()),
+        ("document", pa.string()),
+    ]
+)
+COMPRESSION = "zstd"
+PARTITIONING = ds.partitioning(
+    pa.schema([("day", pa.date32()), ("chat_id", pa.int64())]), flavor="hive"
+)
+# every partition is a single file, so writing it again replaces the old one
+PART_NAME = "part-0.parquet"
+WRITE_BATCH_SIZE = 10_000
+
+
+def partition_path(path: str | Path, day: date, chat_id: int) -> Path:
+    return Path(path) / f"day={day.isoformat()}" / f"chat_id={chat_id}"
+
+
+def _to_table(documents: Iterable[Mapping]) -> pa.Table:
+    return pa.Table.from_pydict(
+        {
+            "msg_id": [doc["msg_id"] for doc in documents],
+            # MongoDB returns naive datetimes in UTC
+            "date": [doc["date"].replace(tzinfo=timezone.utc) for doc in documents],
+            "msg": [doc.get("msg") for doc in documents],
+            "chat_name": [doc.get("chat_name") for doc in documents],
+            "document": [json_util.dumps(doc) for doc in documents],
+        },
+        schema=SCHEMA,
+    )
+
+
+def write_partition(
+    path: str | Path,
+    day: date,
+    chat_id: int,
+    documents: Iterable[Mapping],
+    batch_size: int = WRITE_BATCH_SIZE,
+) -> int:
+    """
+    Write messages of a chat for a day to its partition, merged with messages
+    archived there before, and return the number of written documents.
+
+    Messages are unique by msg_id (the ones written now win), so writing the same
+    messages again (i.e. after the job was interrupted, or after they were parsed
+    again) doesn't duplicate them. Documents are written in batches,
+    so a busy chat's day is never kept in memory at once.
+    """
+    directory = partition_path(path, day, chat_id)
+    directory.mkdir(parents=True, exist_ok=True)
+    # there can be several files written before partitions were single files
+    old_files = sorted(directory.glob("part-*.parquet"))
+
+    # readers never see a half-written file (files starting with . are skipped)
+    temp_path = directory / f".{PART_NAME}.tmp"
+    written = 0
+    msg_ids = set()
+    with pq.ParquetWriter(temp_path, SCHEMA, compression=COMPRESSION) as writer:
+        for batch in batched(documents, batch_size):
+            writer.write_table(_to_table(batch))
+            msg_ids.update(doc["msg_id"] for doc in batch)
+            written += len(batch)
+
+        if old_files:
+            old = ds.dataset(
+                [str(file) for file in old_files], format="parquet", schema=SCHEMA
+            )
+            for record_batch in old.to_batches(batch_size=batch_size):
+                keep = []
+                for msg_id in record_batch["msg_id"].to_pylist():
+                    keep.append(msg_id not in msg_ids)
+                    msg_ids.add(msg_id)
+                writer.write_batch(record_batch.filter(pa.array(keep)))
+
+    os.replace(temp_path, directory / PART_NAME)
+    for file in old_files:
+        if file.name != PART_NAME:
+            file.unlink()
+
+    return written
+
+
+def iter_archived(
+    path: str | Path, batch_size: int = 10_000, columns: Optional[list[str]] = None
+) -> Iterator[dict]:
+    """Archived messages one by one, chat_id (and day) are taken from partitions."""
+    if not os.path.isdir(path):
+        return
+
+    dataset = ds.dataset(path, format="parquet", partitioning=PARTITIONING)
+    for batch in dataset.to_batches(columns=columns, batch_size=batch_size):
+        yield from batch.to_pylist()
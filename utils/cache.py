@@ -0,0 +1,245 @@
+"""
+In-memory caches for slow Telegram requests.
+
+LRU cache with optional TTL and hit/miss counters, which can be saved to
+a repository on shutdown and loaded back on startup, so restarts don't
+repeat the same requests again.
+Concurrent misses for the same key are coalesced into a single request.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable, Iterable
+from typing import Any, Optional
+
+from telethon.hints import EntitiesLike
+from telethon.utils import get_peer_id, parse_username
+
+from utils.repo.interface import AsyncRepository
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+# what waiters get if a request they waited for didn't get the value
+# (it was cancelled, or a batch response didn't have the key): they try themselves
+_NOT_FETCHED = object()
+
+
+def canonical_peer_key(name: EntitiesLike) -> str:
+    """
+    Same entity can be referred to in different ways: PeerChannel(123), -100123,
+    an entity object, "@username" or "t.me/username".
+    All of them should end up in the same cache entry.
+    """
+    if isinstance(name, str):
+        if name.lstrip("-").isdigit():
+            return f"id:{int(name)}"
+        username, is_invite = parse_username(name)
+        if username is not None and not is_invite:
+            return f"@{username.lower()}"
+        return name
+    try:
+        return f"id:{get_peer_id(name)}"  # marked id, so users and channels don't collide
+    except TypeError:
+        return str(name)
+
+
+class Cache:
+    def __init__(
+        self, name: str, maxsize: int = 10_000, ttl: Optional[float] = None
+    ) -> None:
+        """
+        name: used to tell caches apart in a snapshot repository
+        maxsize: least recently used entries are evicted above that
+        ttl: seconds after which an entry expires (never if None)
+        """
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        # key -> (value, expiration timestamp)
+        self._data: OrderedDict[str, tuple[Any, float | None]] = OrderedDict()
+        self._dirty: set[str] = set()  # keys that weren't saved to a snapshot yet
+        self._in_flight: dict[str, asyncio.Future] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0  # misses that waited for someone else's request
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _is_expired(self, expires_at: float | None) -> bool:
+        return expires_at is not None and expires_at <= time.time()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None or self._is_expired(entry[1]):
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key: Hashable, value: Any, expires_at: float | None = None) -> None:
+        if expires_at is None and self.ttl is not None:
+            expires_at = time.time() + self.ttl
+
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        self._dirty.add(key)
+
+        while len(self._data) > self.maxsize:
+            evicted, _ = self._data.popitem(last=False)
+            self._dirty.discard(evicted)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop all entries and reset counters, i.e. to start a benchmark cold."""
+        self._data.clear()
+        self._dirty.clear()
+        self.hits = self.misses = self.evictions = self.coalesced = 0
+
+    def stats(self) -> dict[str, int | float]:
+        requests = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.0,
+            "evictions": self.evictions,
+            "coalesced": self.coalesced,
+        }
+
+    async def get_or_fetch(
+        self, key: Hashable, fetch: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """
+        Return cached value or call `fetch` to get it.
+
+        While a request for a key is in progress, other callers asking for
+        the same key don't send their own requests, but wait for the first one
+        (i.e. a burst of messages forwarded from the same channel).
+        """
+        while True:
+            value = self.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                break
+            self.coalesced += 1
+            # shield, so a cancelled waiter doesn't cancel the request for everyone
+            value = await asyncio.shield(in_flight)
+            if value is not _NOT_FETCHED:
+                return value
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            value = await fetch()
+        except asyncio.CancelledError:
+            # only the task that sent the request was cancelled, not the waiters
+            future.set_result(_NOT_FETCHED)
+            raise
+        except Exception as e:
+            # errors aren't cached, everyone who was waiting gets the same one
+            future.set_exception(e)
+            future.exception()  # mark as retrieved, in case nobody was waiting
+            raise
+        else:
+            self.set(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            del self._in_flight[key]
+
+    async def get_or_fetch_many(
+        self,
+        keys: Iterable[Hashable],
+        fetch_many: Callable[[list[Hashable]], Awaitable[dict[Hashable, Any]]],
+    ) -> None:
+        """
+        Fill the cache for all keys that are neither cached nor requested already
+        with a single `fetch_many` call.
+        Concurrent `get_or_fetch` calls for these keys wait for it too.
+        Keys missing from the response are not cached, and `get_or_fetch` calls
+        waiting for them send their own requests.
+        """
+        missing = [
+            key
+            for key in dict.fromkeys(keys)  # unique, but keeps the order
+            if key not in self._in_flight and self.get(key, _MISSING) is _MISSING
+        ]
+        if not missing:
+            return
+
+        loop = asyncio.get_running_loop()
+        futures = {key: loop.create_future() for key in missing}
+        self._in_flight.update(futures)
+        try:
+            values = await fetch_many(missing)
+        except asyncio.CancelledError:
+            for future in futures.values():
+                future.set_result(_NOT_FETCHED)
+            raise
+        except Exception as e:
+            for future in futures.values():
+                future.set_exception(e)
+                future.exception()
+            raise
+        else:
+            for key, future in futures.items():
+                value = values.get(key, _NOT_FETCHED)
+                if value is not _NOT_FETCHED:
+                    self.set(key, value)
+                future.set_result(value)
+        finally:
+            for key in missing:
+                del self._in_flight[key]
+
+    async def load(self, repository: AsyncRepository) -> None:
+        """Warm up the cache from a snapshot, skipping expired entries."""
+        loaded = 0
+        async for doc in repository.iter_all(
+            projection=["cache", "key", "value", "expires_at"]
+        ):
+            if doc.get("cache") != self.name or "value" not in doc:
+                continue
+            expires_at = doc.get("expires_at")
+            if self._is_expired(expires_at):
+                continue
+            self.set(doc["key"], doc["value"], expires_at=expires_at)
+            loaded += 1
+
+        self._dirty.clear()
+        logger.info(f"{loaded} entries loaded into {self.name} cache.")
+
+    async def snapshot(self, repository: AsyncRepository) -> None:
+        """
+        Save entries added since the last snapshot.
+        Repository should upsert by ("cache", "key").
+        """
+        docs = [
+            {
+                "cache": self.name,
+                "key": key,
+                "value": self._data[key][0],
+                "expires_at": self._data[key][1],
+            }
+            for key in self._dirty
+            if key in self._data
+        ]
+        if docs:
+            await repository.put_many(docs)
+        self._dirty.clear()
+        logger.info(
+            f"{len(docs)} new entries of {self.name} cache saved. {self.stats()}"
+        )
@@ -26,6 +26,8 @@ from telethon.tl.types.messages import ChatFull
 from telethon.tl.types.users import UserFull
 from telethon.utils import get_peer_id
 
+from utils.cache import Cache, canonical_peer_key
+
 logger = logging.getLogger(__name__)
 
 
@@ -177,8 +179,7 @@ async def get_peer_by_id(
 
 
 # functions to get channels/chats/users by (user)name
-def cache_enitity_requests():
-    cache = {}
+def cache_enitity_requests(cache: Cache):
 
     async def query_entity_info(
         client: TelegramClient, name: EntitiesLike
@@ -186,9 +187,7 @@ def cache_enitity_requests():
         if not client.is_connected():
             await client.connect()
 
-        compact_entity = cache.get(str(name))
-
-        if compact_entity is None:
+        async def request_entity() -> TypeCompact | dict:
             logger.debug(f"Request for name {str(name)}.")
             try:
                 entity = await client.get_entity(name)
@@ -199,15 +198,16 @@ def cache_enitity_requests():
                 logger.warning(f"Either {name} is private or you have been banned.")
                 entity = {"id": name, "title": "PRIVATE"}
 
-            compact_entity = get_compact_entity(entity)
-            cache[str(name)] = compact_entity
+            return get_compact_entity(entity)
 
-        return compact_entity
+        return await cache.get_or_fetch(canonical_peer_key(name), request_entity)
 
     return query_entity_info
 
 
-query_entity_info = cache_enitity_requests()
+# titles and usernames can change, so entries expire after a day
+entity_cache = Cache("entities", maxsize=50_000, ttl=24 * 60 * 60)
+query_entity_info = cache_enitity_requests(entity_cache)
 
 
 async def get_non_subscription_entities(
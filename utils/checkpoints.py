@@ -0,0 +1,68 @@
+"""
+Per-chat checkpoints for channel parser.
+Stores the highest msg_id that was written to the message repository for every chat,
+so the next run only fetches messages newer than that.
+"""
+
+import logging
+from collections.abc import Mapping
+
+from utils.repo.interface import AsyncRepository
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointStore:
+    def __init__(self, repository: AsyncRepository) -> None:
+        """
+        Repository should upsert by "chat_id", but it's not required:
+        if there are several checkpoints for the same chat, the highest one wins.
+        """
+        self.repository = repository
+        self._checkpoints: dict[int, int] = {}
+
+    async def load(self) -> None:
+        try:
+            async for doc in self.repository.iter_all(projection=["chat_id", "msg_id"]):
+                self._update(doc["chat_id"], doc["msg_id"])
+        except Exception:
+            logger.exception("Failed to load checkpoints. Parsing from scratch...")
+            return
+
+        logger.info(f"Checkpoints for {len(self._checkpoints)} chats loaded.")
+
+    def get(self, chat_id: int) -> int:
+        """Highest saved msg_id for a chat (0 if chat was never parsed)."""
+        return self._checkpoints.get(chat_id, 0)
+
+    def _update(self, chat_id: int, msg_id: int) -> bool:
+        if msg_id > self.get(chat_id):
+            self._checkpoints[chat_id] = msg_id
+            return True
+        return False
+
+    async def commit(self, documents: list[Mapping]) -> None:
+        """
+        Move checkpoints forward after documents were successfully written.
+        All messages of a chat older than these have to be written too,
+        otherwise the next run would skip the ones that weren't.
+        """
+        latest: dict[int, int] = {}
+        for doc in documents:
+            chat_id, msg_id = doc.get("chat_id"), doc.get("msg_id")
+            if chat_id is not None and msg_id is not None:
+                latest[chat_id] = max(msg_id, latest.get(chat_id, 0))
+
+        updated = [
+            {"chat_id": chat_id, "msg_id": msg_id}
+            for chat_id, msg_id in latest.items()
+            if self._update(chat_id, msg_id)
+        ]
+        if not updated:
+            return
+
+        try:
+            await self.repository.put_many(updated)
+        except Exception:
+            # not critical: messages are upserted, so they will be just fetched again
+            logger.exception(f"Failed to save checkpoints {updated}.")
@@ -1,9 +1,12 @@
+import asyncio
 import logging
 import os
 import sys
+from collections.abc import Awaitable, Callable, Iterable, Mapping
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Callable, Self, TypedDict
+from types import MappingProxyType
+from typing import Any, TypedDict
 
 from dotenv import load_dotenv
 from telethon import TelegramClient, functions
@@ -18,6 +21,7 @@ from telethon.tl.types import (
 from telethon.utils import resolve_id
 
 sys.path.insert(0, os.getcwd())
+from utils.cache import Cache
 from utils.channel_helpers import get_compact_name, query_entity_info
 
 load_dotenv(dotenv_path=Path("./env/config.env"))
@@ -41,6 +45,24 @@ async def query_document_info(client: TelegramClient, document_id: int) -> Docum
     return document[0]
 
 
+# max number of ids Telegram accepts in one GetCustomEmojiDocumentsRequest
+CUSTOM_EMOJI_REQUEST_LIMIT = 200
+
+
+async def query_documents_info(
+    client: TelegramClient, document_ids: list[int]
+) -> list[Document]:
+    """Same as query_document_info, but for many custom emojis in one request."""
+    documents = []
+    for i in range(0, len(document_ids), CUSTOM_EMOJI_REQUEST_LIMIT):
+        documents += await client(
+            functions.messages.GetCustomEmojiDocumentsRequest(
+                document_id=document_ids[i : i + CUSTOM_EMOJI_REQUEST_LIMIT]
+            )
+        )
+    return documents
+
+
 def extract_custom_emoji_alt(document: Document) -> str:
     """
     Extract alternative representation of a custom emoji in UTF-8/16.
@@ -52,30 +74,60 @@ def extract_custom_emoji_alt(document: Document) -> str:
             return attribute.alt
 
 
-def cache_custom_emoji_requests() -> Callable[[TelegramClient, int], str]:
+def cache_custom_emoji_requests(cache: Cache) -> Callable[[TelegramClient, int], str]:
     """
     Since requests are slow and channels usually use only a couple of custom emojis,
     which are repeated in every message, caching drastically reduces the number of
     DocumentRequests we're making.
 
-    functools.lru_cache is not suitable, since we don't want to cache a client too,
-    and cachetools is not in standard library -> easier to just use a dictionary.
+    functools.lru_cache is not suitable, since we don't want to cache a client too.
     """
-    cache: dict[int, str] = {}
 
     async def get_custom_emoji_alt(client: TelegramClient, document_id: int) -> str:
-        alt = cache.get(document_id)
-        if alt is None:
+        async def request_alt() -> str:
             logger.debug(f"Sending request for custom emoji {document_id}...")
             doc = await query_document_info(client, document_id)
-            alt = extract_custom_emoji_alt(doc)
-            cache[document_id] = alt
-        return alt
+            return extract_custom_emoji_alt(doc)
+
+        return await cache.get_or_fetch(str(document_id), request_alt)
 
     return get_custom_emoji_alt
 
 
-get_custom_emoji_alt = cache_custom_emoji_requests()
+# custom emojis never change, so there is no need for expiration
+custom_emoji_cache = Cache("custom_emojis", maxsize=10_000)
+get_custom_emoji_alt = cache_custom_emoji_requests(custom_emoji_cache)
+
+
+def get_custom_reaction_ids(messages: Iterable[Message]) -> list[int]:
+    """Document ids of all custom emoji reactions to the messages."""
+    return [
+        reaction_obj.reaction.document_id
+        for message in messages
+        if message.reactions is not None
+        for reaction_obj in message.reactions.results
+        if hasattr(reaction_obj.reaction, "document_id")
+    ]
+
+
+async def prefetch_custom_emojis(
+    client: TelegramClient, messages: Iterable[Message]
+) -> None:
+    """
+    Resolve all unknown custom emoji reactions of a batch of messages
+    (i.e. one page of chat history) with a single request,
+    instead of a separate request for every new emoji.
+    """
+
+    async def request_alts(keys: list[str]) -> dict[str, str]:
+        logger.debug(f"Sending request for {len(keys)} custom emojis...")
+        documents = await query_documents_info(client, [int(key) for key in keys])
+        return {str(doc.id): extract_custom_emoji_alt(doc) for doc in documents}
+
+    await custom_emoji_cache.get_or_fetch_many(
+        (str(document_id) for document_id in get_custom_reaction_ids(messages)),
+        request_alts,
+    )
 
 
 async def get_reaction_type(client: TelegramClient, reaction_obj: ReactionCount) -> str:
@@ -150,61 +202,101 @@ class CompactMessage(TypedDict, total=False):
     # note that chat_id + msg_id should provide unique primary key
 
 
-class MessageBuilder:
+type ChatsLookup = Mapping[int, Mapping[str, Any]]
+type Extractor = Callable[
+    [Message, TelegramClient | None, ChatsLookup], Awaitable[CompactMessage]
+]
+
+
+# Extractors are pure functions: they only read the message and return
+# a part of CompactMessage, so any number of them can run at the same time.
+async def extract_text(
+    new_msg: Message, client: TelegramClient | None, chats: ChatsLookup
+) -> CompactMessage:
+    return CompactMessage(msg=new_msg.message, date=new_msg.date)
+
+
+async def extract_dialog_info(
+    new_msg: Message, client: TelegramClient | None, chats: ChatsLookup
+) -> CompactMessage:
+    dialog_id = get_dialog_id(new_msg)
+    chat = chats.get(dialog_id, {})
+    return CompactMessage(
+        msg_id=new_msg.id,
+        chat_id=dialog_id,
+        chat_name=get_compact_name(chat),
+        chat_title=chat.get("title"),
+    )
+
+
+async def extract_engagements(
+    new_msg: Message, client: TelegramClient | None, chats: ChatsLookup
+) -> CompactMessage:
+    return CompactMessage(
+        views=new_msg.views,
+        forwards=new_msg.forwards,
+        replies=get_reply_count(new_msg.replies),
+        reactions=await unwrap_reactions(msg_reactions=new_msg.reactions, client=client),
+    )
+
+
+async def extract_forward_info(
+    new_msg: Message, client: TelegramClient | None, chats: ChatsLookup
+) -> CompactMessage:
+    forwarded_from_peer = new_msg.fwd_from
+    if forwarded_from_peer is None:
+        return CompactMessage()
+    fwd_peer_info = await get_fwd_from_info(client, forwarded_from_peer)
+    return CompactMessage(
+        fwd_from={
+            str(key): val for key, val in fwd_peer_info.items() if val is not None
+        }
+    )
+
+
+EXTRACTORS: dict[str, Extractor] = {
+    "extract_text": extract_text,
+    "extract_dialog_info": extract_dialog_info,
+    "extract_engagements": extract_engagements,
+    "extract_forward_info": extract_forward_info,
+}
+
+
+class MessagePipeline:
+    """
+    Builds CompactMessage from a telethon Message with a fixed set of extractors.
+
+    Everything is resolved once on creation (extractors by name, chats lookup table),
+    and the pipeline itself has no mutable state, so a single instance can be shared
+    by any number of concurrent handlers/workers.
+    """
+
     def __init__(
         self,
         registered_methods: list[str],
         client: TelegramClient | None = None,
         chats: list[dict] | None = None,
     ) -> None:
-        self._msg = CompactMessage()
-        self.registered_methods = [
-            getattr(self, method) for method in registered_methods
-        ]
-        self.client = client
-        if chats:
-            self.chats = {chat["id"]: chat for chat in chats}
-
-    def reset(self) -> None:
-        self._msg = CompactMessage()
-
-    async def extract_text(self, new_msg: Message) -> Self:
-        self._msg["msg"] = new_msg.message
-        self._msg["date"] = new_msg.date
-        return self
-
-    async def extract_dialog_info(self, new_msg: Message) -> Self:
-        self._msg["msg_id"] = new_msg.id
-
-        dialog_id = get_dialog_id(new_msg)
-        self._msg["chat_id"] = dialog_id
+        unknown_methods = set(registered_methods) - EXTRACTORS.keys()
+        if unknown_methods:
+            raise ValueError(f"Unknown extractors: {unknown_methods}.")
 
-        chat_name = get_compact_name(self.chats.get(dialog_id))
-        self._msg["chat_name"] = chat_name
-
-        chat_title = self.chats.get(dialog_id).get("title")
-        self._msg["chat_title"] = chat_title
-        return self
+        self.extractors: tuple[Extractor, ...] = tuple(
+            EXTRACTORS[method] for method in registered_methods
+        )
+        self.client = client
+        # read-only, so nobody can accidentally change it for everyone else
+        self.chats: ChatsLookup = MappingProxyType(
+            {chat["id"]: MappingProxyType(dict(chat)) for chat in chats or []}
+        )
 
-    async def extract_engagements(self, new_msg: Message) -> Self:
-        self._msg["views"] = new_msg.views
-        self._msg["forwards"] = new_msg.forwards
-        self._msg["replies"] = get_reply_count(new_msg.replies)
-        self._msg["reactions"] = await unwrap_reactions(
-            msg_reactions=new_msg.reactions, client=self.client
+    async def __call__(self, new_msg: Message) -> CompactMessage:
+        # extractors are independent, so their requests to Telegram can overlap
+        parts = await asyncio.gather(
+            *(extractor(new_msg, self.client, self.chats) for extractor in self.extractors)
         )
-        return self
-
-    async def extract_forward_info(self, new_msg: Message) -> Self:
-        forwarded_from_peer = new_msg.fwd_from
-        if forwarded_from_peer is not None:
-            fwd_peer_info = await get_fwd_from_info(self.client, forwarded_from_peer)
-            self._msg["fwd_from"] = {
-                str(key): val for key, val in fwd_peer_info.items() if val is not None
-            }
-        return self
-
-    def build(self) -> CompactMessage:
-        final_msg = self._msg
-        self.reset()
-        return final_msg
+
+        message = CompactMessage()
+        for part in parts:
+            message.update(part)
+        return message
@@ -0,0 +1,62 @@
+"""
+Recordings of live traffic for replays (benchmarks/replay_live.py).
+Every incoming message is a JSON line with the time it was received and the
+message itself serialized by Telethon, so a replay gets exactly the same objects.
+"""
+
+import base64
+import json
+import logging
+import time
+from collections.abc import Iterator
+from typing import TextIO
+
+from telethon.events import NewMessage
+from telethon.extensions import BinaryReader
+from telethon.tl.custom.message import Message
+
+logger = logging.getLogger(__name__)
+
+
+class EventRecorder:
+    def __init__(self, path: str) -> None:
+        """path: recording file, new messages are appended to it"""
+        self.path = path
+        self.recorded = 0
+        self._file: TextIO | None = None
+
+    async def __call__(self, event: NewMessage.Event) -> None:
+        if self._file is None:
+            # line buffered, so a crash loses at most the last message
+            self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+            logger.info(f"Recording incoming messages to {self.path}.")
+
+        line = {
+            "received_at": time.time(),
+            "message": base64.b64encode(event.message._bytes()).decode("ascii"),
+        }
+        self._file.write(json.dumps(line) + "\n")
+        self.recorded += 1
+
+    def close(self) -> None:
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        logger.info(f"{self.recorded} messages recorded to {self.path}.")
+
+
+def read_recording(path: str) -> Iterator[tuple[float, Message]]:
+    """(UNIX time it was received, message) for every recorded message."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_num, line in enumerate(f, 1):
+            try:
+                record = json.loads(line)
+                data = base64.b64decode(record["message"])
+            except (json.JSONDecodeError, KeyError, ValueError):
+                # i.e. the last line if the parser was killed mid-write
+                logger.warning(f"Skipping broken line {line_num} in {path}.")
+                continue
+
+            with BinaryReader(data) as reader:
+                yield record["received_at"], reader.tgread_object()
@@ -0,0 +1,135 @@
+"""
+Write buffer in front of a repository.
+Documents are collected in memory and written with a single `put_many`
+once there are enough of them or they have been waiting for too long.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections.abc import Awaitable, Callable, Mapping
+from datetime import datetime
+from typing import Optional, Self
+
+from utils.repo.interface import AsyncRepository, inserted_documents
+
+logger = logging.getLogger(__name__)
+
+
+class BufferedWriter:
+    def __init__(
+        self,
+        repository: AsyncRepository,
+        max_size: int = 100,
+        max_delay_ms: int = 5000,
+        on_flush: Optional[
+            Callable[[list[Mapping], list[Mapping]], Awaitable[None]]
+        ] = None,
+        fallback_path: str = "./unsaved_documents",
+    ) -> None:
+        """
+        max_size: flush when this many documents are buffered
+        max_delay_ms: flush when the oldest buffered document waits this long
+        on_flush: called with every batch that was successfully written
+        and its documents that weren't stored before
+        fallback_path: where to dump documents that couldn't be written at all
+        """
+        self.repository = repository
+        self.max_size = max_size
+        self.max_delay = max_delay_ms / 1000
+        self.on_flush = on_flush
+        self.fallback_path = fallback_path
+
+        self._buffer: list[Mapping] = []
+        self._oldest: float | None = None  # time when the oldest doc was added
+        self._lock = asyncio.Lock()
+        self._timer: asyncio.Task | None = None
+
+        self.flushed = 0  # number of documents written
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    async def __aenter__(self) -> Self:
+        self._timer = asyncio.create_task(self._flush_periodically())
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def put(self, document: Mapping) -> None:
+        if not self._buffer:
+            self._oldest = time.monotonic()
+        self._buffer.append(document)
+
+        if len(self._buffer) >= self.max_size or self._is_expired():
+            await self.flush()
+
+    def _is_expired(self) -> bool:
+        return (
+            self._oldest is not None
+            and time.monotonic() - self._oldest >= self.max_delay
+        )
+
+    async def _flush_periodically(self) -> None:
+        # put() only checks the age of a batch when new documents come,
+        # so something has to flush when the source stalls (i.e. FloodWait)
+        while True:
+            await asyncio.sleep(self.max_delay)
+            if self._is_expired():
+                try:
+                    await self.flush()
+                except Exception:
+                    pass  # already logged, documents are kept for the next try
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self._buffer:
+                return
+
+            batch, self._buffer = self._buffer, []
+            oldest, self._oldest = self._oldest, None
+
+            try:
+                response = await self.repository.put_many(batch)
+            except Exception:
+                # put documents back so they are written with the next batch
+                self._buffer = batch + self._buffer
+                self._oldest = oldest
+                logger.exception(
+                    f"Failed to write {len(batch)} documents. Will retry later."
+                )
+                raise
+
+            self.flushed += len(batch)
+            logger.debug(f"Flushed {len(batch)} documents. {response}")
+
+            if self.on_flush is not None:
+                await self.on_flush(batch, inserted_documents(batch, response))
+
+    async def close(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        try:
+            await self.flush()
+        except Exception:
+            self._dump_unsaved()
+
+    def _dump_unsaved(self) -> None:
+        dump_unsaved(self._buffer, self.fallback_path)
+        self._buffer = []
+        self._oldest = None
+
+
+def dump_unsaved(documents: list[Mapping], fallback_path: str) -> None:
+    """Last resort, so that documents are never lost silently."""
+    path = f"{fallback_path}_{datetime.now():%Y%m%dT%H%M%S}.json"
+    with open(path, "a") as f:
+        json.dump(documents, f, default=str, ensure_ascii=False)
+    logger.critical(
+        f"{len(documents)} documents couldn't be written to the repository "
+        f"and were dumped to {path}."
+    )
@@ -2,7 +2,7 @@
 
 import json
 import logging
-from collections.abc import Mapping
+from collections.abc import Iterator, Mapping
 
 logger = logging.getLogger(__name__)
 
@@ -31,9 +31,21 @@ class CliRepository:
         print(json.dumps(docs, default=str, ensure_ascii=False))
         return "-" * 40
 
+    def increment_many(self, objects: list[Mapping], fields: list[str]) -> str:
+        return self.put_many(objects)
+
+    def append_many(self, objects: list[Mapping], fields: list[str]) -> str:
+        return self.put_many(objects)
+
+    def drop(self) -> None:
+        pass
+
     # def get(self, id: str) -> T:
     #     pass
 
     def get_all(self) -> list[Mapping]:
         # ? read from STDIN?
         raise Exception("How is it supposed to work?")
+
+    def iter_all(self, **kwargs) -> Iterator[Mapping]:
+        raise Exception("How is it supposed to work?")
@@ -1,23 +1,69 @@
-"""NOTE: it wasn't updated in a long time and is currently broken"""
+"""Interface for saving messages to DynamoDB"""
 
 import logging
-from collections.abc import Mapping
+import random
+import time
+from collections.abc import Iterator, Mapping
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
 import boto3
+from boto3.dynamodb.types import TypeDeserializer
 
 logger = logging.getLogger(__name__)
 
+# max number of items in one batch_write_item request
+BATCH_SIZE = 25
+
 
 class DynamoRepository:
-    def __init__(self, table_name: str, region: str = "eu-central-1", **kwargs) -> None:
+    def __init__(
+        self,
+        table_name: str,
+        region: str = "eu-central-1",
+        endpoint_url: Optional[str] = None,
+        max_workers: int = 4,
+        max_retries: int = 8,
+        **kwargs,
+    ) -> None:
+        """
+        endpoint_url: i.e. http://localhost:8000 for DynamoDB Local
+        max_workers: number of batch requests sent in parallel
+        max_retries: attempts to write items DynamoDB didn't process (i.e. throttled)
+        """
         self.region = region
         self.table_name = table_name
+        self.endpoint_url = endpoint_url
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+
+        self._deserializer = TypeDeserializer()
 
     def connect(self) -> None:
         logger.info("Connecting to database...")
-        self.client = boto3.client("dynamodb", region_name=self.region)
+        # clients are thread safe, so all workers share one
+        self.client = boto3.client(
+            "dynamodb", region_name=self.region, endpoint_url=self.endpoint_url
+        )
+        self._create_table()
         logger.info("Connection established.")
 
+    def _create_table(self) -> None:
+        try:
+            self.client.describe_table(TableName=self.table_name)
+            return
+        except self.client.exceptions.ResourceNotFoundException:
+            pass
+
+        logger.info(f"Creating table {self.table_name}...")
+        self.client.create_table(
+            TableName=self.table_name,
+            KeySchema=[{"AttributeName": "ID", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "ID", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        self.client.get_waiter("table_exists").wait(TableName=self.table_name)
+
     def _is_connected(self) -> bool:
         pass
 
@@ -26,14 +72,93 @@ class DynamoRepository:
 
     def _convert_message_to_document(self, message: Mapping) -> dict:
         # TODO: make names uniform for all DBs if possible
-        return {
-            "ID": {"S": f"{message.chat_id}_{message.msg_id}"},
-            "Message": {"S": message.msg},
-            "Date": {"S": message.date.isoformat()},
-            "Chat_Name": {"S": message.chat_name},
-        }
+        document = {"ID": {"S": f"{message['chat_id']}_{message['msg_id']}"}}
+        # empty strings can't be saved, so missing attributes are just skipped
+        if message.get("msg"):
+            document["Message"] = {"S": message["msg"]}
+        if message.get("date"):
+            date = message["date"]
+            if not isinstance(date, str):
+                date = date.isoformat()
+            document["Date"] = {"S": date}
+        if message.get("chat_name"):
+            document["Chat_Name"] = {"S": message["chat_name"]}
+        return document
+
+    def _convert_document_to_message(self, document: Mapping) -> dict:
+        item = {key: self._deserializer.deserialize(v) for key, v in document.items()}
+        chat_id, _, msg_id = item.pop("ID").rpartition("_")
+        message = {"chat_id": int(chat_id), "msg_id": int(msg_id)}
+        for attribute, field in (
+            ("Message", "msg"),
+            ("Date", "date"),
+            ("Chat_Name", "chat_name"),
+        ):
+            if attribute in item:
+                message[field] = item[attribute]
+        return message
 
     def put_one(self, message: Mapping) -> str:
         document = self._convert_message_to_document(message)
         response = self.client.put_item(TableName=self.table_name, Item=document)
         return f'Response status: {response["ResponseMetadata"]["HTTPStatusCode"]}.'  # noqa: E501
+
+    def _write_batch(self, documents: list[dict]) -> None:
+        """
+        Write up to 25 documents with one request.
+        Items DynamoDB didn't process (throttling, size limits) are retried
+        with exponential backoff and jitter.
+        """
+        request = {
+            self.table_name: [{"PutRequest": {"Item": doc}} for doc in documents]
+        }
+        for attempt in range(self.max_retries + 1):
+            response = self.client.batch_write_item(RequestItems=request)
+            request = response.get("UnprocessedItems")
+            if not request:
+                return
+            if attempt < self.max_retries:
+                time.sleep(random.uniform(0, min(0.05 * 2**attempt, 5)))
+
+        unprocessed = len(request[self.table_name])
+        raise RuntimeError(
+            f"{unprocessed} items weren't written after {self.max_retries} retries."
+        )
+
+    def put_many(self, objects: list[Mapping]) -> str:
+        # a request can't have the same key twice, the last one wins
+        documents = {}
+        for message in objects:
+            document = self._convert_message_to_document(message)
+            documents[document["ID"]["S"]] = document
+        documents = list(documents.values())
+        if not documents:
+            return "Nothing to insert"
+
+        batches = [
+            documents[i : i + BATCH_SIZE] for i in range(0, len(documents), BATCH_SIZE)
+        ]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # list() to raise an error if any of the batches has failed
+            list(executor.map(self._write_batch, batches))
+
+        return f"Inserted {len(documents)} objects in {len(batches)} batches."
+
+    def get_all(self) -> list[Mapping]:
+        return list(self.iter_all())
+
+    def iter_all(
+        self, batch_size: int = 1000, projection: Optional[list[str]] = None
+    ) -> Iterator[Mapping]:
+        kwargs = dict(TableName=self.table_name, Limit=batch_size)
+        while True:
+            response = self.client.scan(**kwargs)
+            for document in response["Items"]:
+                message = self._convert_document_to_message(document)
+                if projection is not None:
+                    message = {k: v for k, v in message.items() if k in projection}
+                yield message
+
+            if "LastEvaluatedKey" not in response:
+                return
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
@@ -0,0 +1,171 @@
+"""
+Bounded queue between Telegram event handlers and a repository.
+Handlers only put documents into the queue, while a separate writer task
+drains it in micro-batches, so database calls never hold up update processing.
+"""
+
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Callable, Mapping
+from typing import Optional, Self
+
+from utils.repo.buffer import dump_unsaved
+from utils.repo.interface import AsyncRepository, inserted_documents
+
+logger = logging.getLogger(__name__)
+
+
+class IngestQueue:
+    def __init__(
+        self,
+        repository: AsyncRepository,
+        maxsize: int = 10_000,
+        batch_size: int = 100,
+        max_delay_ms: int = 500,
+        max_retries: int = 5,
+        on_flush: Optional[
+            Callable[[list[Mapping], list[Mapping]], Awaitable[None]]
+        ] = None,
+        fallback_path: str = "./unsaved_documents",
+    ) -> None:
+        """
+        maxsize: handlers wait when the queue is full (backpressure)
+        batch_size: max number of documents written at once
+        max_delay_ms: how long the writer waits to fill a batch
+        max_retries: attempts to write a batch before dumping it to a file
+        on_flush: called with every batch that was successfully written
+        and its documents that weren't stored before
+        """
+        self.repository = repository
+        self.batch_size = batch_size
+        self.max_delay = max_delay_ms / 1000
+        self.max_retries = max_retries
+        self.on_flush = on_flush
+        self.fallback_path = fallback_path
+
+        self._queue: asyncio.Queue[Mapping] = asyncio.Queue(maxsize=maxsize)
+        self._writer: asyncio.Task | None = None
+
+        # metrics
+        self.flushed = 0
+        self.last_flush_latency = 0.0  # seconds
+        self.max_flush_latency = 0.0
+        self._total_flush_latency = 0.0
+        self._num_flushes = 0
+
+    @property
+    def depth(self) -> int:
+        """Number of documents waiting to be written."""
+        return self._queue.qsize()
+
+    @property
+    def avg_flush_latency(self) -> float:
+        if self._num_flushes == 0:
+            return 0.0
+        return self._total_flush_latency / self._num_flushes
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "depth": self.depth,
+            "flushed": self.flushed,
+            "last_flush_latency": self.last_flush_latency,
+            "avg_flush_latency": self.avg_flush_latency,
+            "max_flush_latency": self.max_flush_latency,
+        }
+
+    async def __aenter__(self) -> Self:
+        self._writer = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def put(self, document: Mapping) -> None:
+        if self._queue.full():
+            logger.warning(
+                f"Ingest queue is full ({self.depth} documents). "
+                "Database can't keep up with incoming messages."
+            )
+        await self._queue.put(document)
+
+    async def _next_batch(self) -> list[Mapping]:
+        batch = [await self._queue.get()]
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.batch_size:
+            # take everything that is already waiting without sleeping
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except TimeoutError:
+                break
+
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _write(self, batch: list[Mapping]) -> None:
+        for attempt in range(1, self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                response = await self.repository.put_many(batch)
+            except Exception:
+                logger.exception(
+                    f"Failed to write {len(batch)} documents "
+                    f"(attempt {attempt}/{self.max_retries})."
+                )
+                await asyncio.sleep(min(2**attempt, 30))
+                continue
+
+            self._record_latency(time.perf_counter() - start)
+            self.flushed += len(batch)
+            logger.info(
+                f"Flushed {len(batch)} documents in "
+                f"{self.last_flush_latency * 1000:.1f} ms, "
+                f"queue depth {self.depth}. {response}"
+            )
+            if self.on_flush is not None:
+                try:
+                    await self.on_flush(batch, inserted_documents(batch, response))
+                except Exception:
+                    logger.exception("on_flush callback failed.")
+            return
+
+        dump_unsaved(batch, self.fallback_path)
+
+    def _record_latency(self, latency: float) -> None:
+        self.last_flush_latency = latency
+        self.max_flush_latency = max(self.max_flush_latency, latency)
+        self._total_flush_latency += latency
+        self._num_flushes += 1
+
+    async def close(self) -> None:
+        """Write everything that is left in the queue and stop the writer."""
+        if self._writer is None:
+            return
+
+        # don't wait forever if the writer itself has crashed
+        drained = asyncio.create_task(self._queue.join())
+        await asyncio.wait([drained, self._writer], return_when=asyncio.FIRST_COMPLETED)
+        drained.cancel()
+        self._writer.cancel()
+        self._writer = None
+
+        logger.info(f"Ingest queue closed. {self.stats()}")
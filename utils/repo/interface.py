@@ -1,8 +1,33 @@
 import importlib
+from collections.abc import AsyncIterator, Iterator, Mapping
+from dataclasses import dataclass
 from enum import StrEnum
 from typing import Optional, Protocol
 
 
+@dataclass
+class WriteResult:
+    """
+    Response of `put_many`: a message for logs and, if a repository can tell,
+    documents that weren't stored before (inserted, not updated).
+    """
+
+    message: str
+    inserted: Optional[list[Mapping]] = None
+
+    def __str__(self) -> str:
+        return self.message
+
+
+def inserted_documents(
+    batch: list[Mapping], response: "WriteResult | str"
+) -> list[Mapping]:
+    """New documents of a written batch (the whole batch if a repository can't tell)."""
+    if isinstance(response, WriteResult) and response.inserted is not None:
+        return response.inserted
+    return batch
+
+
 class Repository[T](Protocol):
     """Repository of objects of generic type T
     1. Connect
@@ -25,7 +50,25 @@ class Repository[T](Protocol):
     def put_one(self, object: T) -> str:
         pass
 
-    def put_many(self, objects: list[T]) -> str:
+    def put_many(self, objects: list[T]) -> WriteResult | str:
+        pass
+
+    def increment_many(self, objects: list[T], fields: list[str]) -> str:
+        """
+        Add values of `fields` to the ones stored under the same key
+        (objects that don't exist yet are created).
+        """
+        pass
+
+    def append_many(self, objects: list[T], fields: list[str]) -> str:
+        """
+        Append values of `fields` to arrays stored under the same key
+        (objects that don't exist yet are created).
+        """
+        pass
+
+    def drop(self) -> None:
+        """Delete all objects, i.e. to rebuild an index from scratch."""
         pass
 
     # def get(self, id: str) -> T:
@@ -34,6 +77,52 @@ class Repository[T](Protocol):
     def get_all(self) -> list[T]:
         pass
 
+    def iter_all(
+        self, batch_size: int = 1000, projection: Optional[list[str]] = None
+    ) -> Iterator[T]:
+        """
+        Stream objects instead of loading all of them at once.
+        batch_size: number of objects fetched from a database per request
+        projection: fields to return (all if None)
+        """
+        pass
+
+
+class AsyncRepository[T](Protocol):
+    """Same as Repository, but doesn't block the event loop"""
+
+    async def connect(self) -> None:
+        pass
+
+    async def _is_connected(self) -> bool:
+        pass
+
+    async def disconnect(self) -> None:
+        pass
+
+    async def put_one(self, object: T) -> str:
+        pass
+
+    async def put_many(self, objects: list[T]) -> WriteResult | str:
+        pass
+
+    async def increment_many(self, objects: list[T], fields: list[str]) -> str:
+        pass
+
+    async def append_many(self, objects: list[T], fields: list[str]) -> str:
+        pass
+
+    async def drop(self) -> None:
+        pass
+
+    async def get_all(self) -> list[T]:
+        pass
+
+    def iter_all(
+        self, batch_size: int = 1000, projection: Optional[list[str]] = None
+    ) -> AsyncIterator[T]:
+        pass
+
 
 class RepositoryType(StrEnum):
     MONGODB = "mongo"
@@ -51,6 +140,8 @@ def repository_factory(
     ip: Optional[str] = None,
     port: Optional[str | int] = None,
     region: Optional[str] = "eu-central-1",
+    key_fields: Optional[list[str]] = None,
+    **options,
 ) -> Repository:
     # allows to avoid installing unnecessary dependencies
     # ! repo_type should be one of the options from the Enum above
@@ -67,4 +158,41 @@ def repository_factory(
         ip=ip,
         port=port,
         region=region,
+        key_fields=key_fields,
+        **options,
     )
+
+
+def async_repository_factory(
+    repo_type: str,
+    table_name: Optional[str],
+    collection_name: Optional[str] = None,
+    user: Optional[str] = None,
+    passwd: Optional[str] = None,
+    ip: Optional[str] = None,
+    port: Optional[str | int] = None,
+    region: Optional[str] = "eu-central-1",
+    key_fields: Optional[list[str]] = None,
+    **options,
+) -> AsyncRepository:
+    repo_module = importlib.import_module(f"utils.repo.{repo_type.lower()}")
+    kwargs = dict(
+        table_name=table_name,
+        collection_name=collection_name,
+        user=user,
+        passwd=passwd,
+        ip=ip,
+        port=port,
+        region=region,
+        key_fields=key_fields,
+        **options,
+    )
+    # use native async implementation if there is one...
+    async_repo = getattr(repo_module, f"Async{repo_type.capitalize()}Repository", None)
+    if async_repo is not None:
+        return async_repo(**kwargs)
+
+    # ...otherwise run a synchronous one in a separate thread
+    from utils.repo.threaded import ThreadedRepository
+
+    return ThreadedRepository(repository_factory(repo_type, **kwargs))
@@ -1,24 +1,57 @@
 """
 Use to save messages to json locally and then pipe them into jq.
 Useful for investigating parsing results and looking for edge cases.
+
+Two file formats are supported:
+- "json": a single json array, convenient for small dumps
+- "jsonl": one json document per line (JSON Lines), which is cheap to append to
+  and can be streamed line by line (`jq -c` works with it as is)
 """
 
 import json
 import logging
 import os
-from collections.abc import Mapping
-from typing import Optional
+import threading
+import time
+from collections.abc import Iterator, Mapping
+from typing import Optional, TextIO
 
 logger = logging.getLogger(__name__)
 
 
 class LocalRepository:
-    def __init__(self, table_name: Optional[str] = None, **kwargs) -> None:
-        self.path = f"./{table_name}.json"
+    def __init__(
+        self,
+        table_name: Optional[str] = None,
+        file_format: str = "json",
+        fsync_interval: float = 1.0,
+        **kwargs,
+    ) -> None:
+        """
+        file_format: "json" or "jsonl"
+        fsync_interval: (jsonl only) how long (in seconds) appended data can stay
+        unflushed to disk, i.e. how much can be lost if the machine goes down
+        """
+        if file_format not in ("json", "jsonl"):
+            raise ValueError(f"Unknown file format {file_format}.")
+        self.file_format = file_format
+        self.path = f"./{table_name}.{file_format}"
+        self.fsync_interval = fsync_interval
+
+        self._file: TextIO | None = None
+        self._last_fsync = 0.0
+        # appends come from worker threads (see ThreadedRepository) and the timer
+        self._lock = threading.Lock()
+        self._fsync_timer: threading.Timer | None = None
 
     def connect(self) -> None:
         logger.info("Connecting to database...")
-        if not os.path.exists(self.path):
+        if self.file_format == "jsonl":
+            self._truncate_torn_line()
+            # kept open for the whole session, so writes are just buffered appends
+            self._file = open(self.path, mode="a", encoding="utf-8")
+            self._last_fsync = time.monotonic()
+        elif not os.path.exists(self.path):
             os.mknod(self.path)
         logger.info("Connection established.")
 
@@ -26,25 +59,106 @@ class LocalRepository:
         pass
 
     def disconnect(self) -> None:
+        with self._lock:
+            if self._fsync_timer is not None:
+                self._fsync_timer.cancel()
+                self._fsync_timer = None
+            if self._file is not None:
+                self._fsync()
+                self._file.close()
+                self._file = None
         logger.info("Database connection closed.")
 
-    def put_one(self, object: Mapping) -> str:
-        doc = {k: v for k, v in object.items() if v}
-        if not doc:
-            logger.warning("Document was empty. Skipping...")
+    def _truncate_torn_line(self) -> None:
+        """
+        Cut off the last line if it was only partially written before a crash
+        (or end it with a newline if it's whole),
+        so that appended documents don't end up glued to it.
+        """
+        if not os.path.exists(self.path):
             return
+        with open(self.path, mode="rb+") as file:
+            end = file.seek(0, os.SEEK_END)
+            if end == 0:
+                return
+            file.seek(end - 1)
+            if file.read(1) == b"\n":
+                return
+
+            # the last complete line ends with the last newline, if there is one
+            position = end
+            while position > 0:
+                chunk_start = max(position - 4096, 0)
+                file.seek(chunk_start)
+                newline = file.read(position - chunk_start).rfind(b"\n")
+                if newline != -1:
+                    position = chunk_start + newline + 1
+                    break
+                position = chunk_start
+            file.seek(position)
+            try:
+                json.loads(file.read())
+            except ValueError:
+                logger.warning(
+                    f"Cutting off a broken last line of {end - position} bytes "
+                    f"in {self.path}."
+                )
+                file.truncate(position)
+            else:
+                file.write(b"\n")  # a whole document, just without a newline
+
+    def _fsync(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._last_fsync = time.monotonic()
+
+    def _fsync_later(self) -> None:
+        with self._lock:
+            self._fsync_timer = None
+            if self._file is not None:
+                self._fsync()
+
+    def _append_lines(self, docs: list[dict]) -> None:
+        with self._lock:
+            self._file.writelines(
+                json.dumps(doc, default=str, ensure_ascii=False) + "\n" for doc in docs
+            )
+            if time.monotonic() - self._last_fsync >= self.fsync_interval:
+                self._fsync()
+            elif self._fsync_timer is None:
+                # synced even if nothing else is appended for a while
+                self._fsync_timer = threading.Timer(
+                    self.fsync_interval, self._fsync_later
+                )
+                self._fsync_timer.daemon = True
+                self._fsync_timer.start()
+
+    def _append_to_array(self, docs: list[dict]) -> None:
+        """Append documents to a json array without rewriting the whole file."""
+        serialized = ",".join(
+            json.dumps(doc, default=str, ensure_ascii=False) for doc in docs
+        )
         with open(self.path, mode="r+") as file:
             try:
                 file.seek(0, 2)
                 position = file.tell() - 1
                 file.seek(position)
-                file.write(
-                    ",{}]".format(json.dumps(doc, default=str, ensure_ascii=False))
-                )
+                file.write(",{}]".format(serialized))
             except ValueError:
-                file.write(
-                    "[{}]".format(json.dumps(doc, default=str, ensure_ascii=False))
-                )
+                file.write("[{}]".format(serialized))
+
+    def _append(self, docs: list[dict]) -> None:
+        if self.file_format == "jsonl":
+            self._append_lines(docs)
+        else:
+            self._append_to_array(docs)
+
+    def put_one(self, object: Mapping) -> str:
+        doc = {k: v for k, v in object.items() if v}
+        if not doc:
+            logger.warning("Document was empty. Skipping...")
+            return
+        self._append([doc])
         return "-" * 40
 
     def put_many(self, objects: list[Mapping]) -> str:
@@ -53,15 +167,68 @@ class LocalRepository:
         if docs != non_empty_docs:
             num_of_empty_docs = len(docs) - len(non_empty_docs)
             logger.warning(f"Skipping {num_of_empty_docs} empty documents...")
-        with open(self.path, "w") as f:
-            json.dump(non_empty_docs, f, default=str, ensure_ascii=False)
+        if non_empty_docs:
+            # append, since it's called for every batch of messages
+            self._append(non_empty_docs)
         return f"Inserted {len(non_empty_docs)} documents."
 
+    def increment_many(self, objects: list[Mapping], fields: list[str]) -> str:
+        """
+        Files can't be updated in place, so increments are just appended.
+        Values of documents with the same key have to be summed when reading.
+        """
+        return self.put_many(objects)
+
+    def append_many(self, objects: list[Mapping], fields: list[str]) -> str:
+        """Same as increment_many: values of the same key have to be joined when reading."""
+        return self.put_many(objects)
+
+    def drop(self) -> None:
+        if self._file is not None:
+            with self._lock:
+                self._file.flush()
+                self._file.truncate(0)
+        else:
+            open(self.path, "w").close()
+
     # def get(self, id: str) -> T:
     #     pass
 
-    def get_all(self) -> list[Mapping]:
-        with open(self.path, "r") as f:
-            objects_list = json.load(f)
+    def iter_all(
+        self, batch_size: int = 1000, projection: Optional[list[str]] = None
+    ) -> Iterator[Mapping]:
+        """
+        Stream documents one by one.
+        Only jsonl files are actually streamed, json arrays are loaded at once.
+        batch_size is ignored, file is read with the usual buffering.
+        """
+        for document in self._iter_documents():
+            if projection is None:
+                yield document
+            else:
+                yield {k: v for k, v in document.items() if k in projection}
 
-        return objects_list
+    def _iter_documents(self) -> Iterator[Mapping]:
+        if self._file is not None:
+            with self._lock:
+                self._file.flush()  # make buffered documents visible to the reader
+
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return
+
+        with open(self.path, "r", encoding="utf-8") as f:
+            if self.file_format == "json":
+                yield from json.load(f)
+                return
+
+            for line_num, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # i.e. the last line was only partially written before a crash
+                    logger.warning(f"Skipping broken line {line_num} in {self.path}.")
+
+    def get_all(self) -> list[Mapping]:
+        return list(self._iter_documents())
@@ -1,14 +1,128 @@
 """Interface for saving channels or messages to MondoDB"""
 
 import logging
-from collections.abc import Mapping
+from collections.abc import AsyncIterator, Iterator, Mapping
+from typing import Optional
 
-from pymongo import MongoClient
-from pymongo.errors import ServerSelectionTimeoutError
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, InsertOne, MongoClient, UpdateOne
+from pymongo.errors import OperationFailure, ServerSelectionTimeoutError
+from pymongo.results import BulkWriteResult
+
+from utils.repo.interface import WriteResult
 
 logger = logging.getLogger(__name__)
 
 
+def _convert_message_to_document(message: Mapping) -> dict:
+    return {str(key): val for key, val in message.items() if val}
+
+
+def _build_write_operations(
+    docs: list[dict], key_fields: Optional[list[str]]
+) -> tuple[list[InsertOne | UpdateOne], list[dict]]:
+    """
+    Documents with a natural key are upserted, so writing the same document twice
+    (i.e. after re-parsing a channel) doesn't create duplicates.
+    Documents without one are just inserted.
+    Returns operations and documents they write, in the same order.
+    """
+    if not key_fields:
+        return [InsertOne(doc) for doc in docs], docs
+
+    keyed: dict[tuple, dict] = {}
+    keyless = []
+    for doc in docs:
+        if all(field in doc for field in key_fields):
+            # the same key twice in one unordered batch would race, keep the last one
+            keyed[tuple(doc[field] for field in key_fields)] = doc
+        else:
+            logger.warning(f"Document has no {key_fields} key. Inserting as is...")
+            keyless.append(doc)
+
+    # the response refers to upserted documents by their index in operations
+    operations = [
+        UpdateOne(
+            filter={field: doc[field] for field in key_fields},
+            # _id can't be changed, it's set by MongoDB on the first insert
+            update={"$set": {k: v for k, v in doc.items() if k != "_id"}},
+            upsert=True,
+        )
+        for doc in keyed.values()
+    ]
+    operations += [InsertOne(doc) for doc in keyless]
+    return operations, list(keyed.values()) + keyless
+
+
+def _build_increment_operations(
+    docs: list[Mapping], key_fields: list[str], fields: list[str]
+) -> list[UpdateOne]:
+    """Add values of `fields` to the stored ones, creating documents if needed."""
+    increments: dict[tuple, dict] = {}
+    for doc in docs:
+        key = tuple(doc[field] for field in key_fields)
+        # the same key twice in one unordered batch would race, so they are summed
+        total = increments.setdefault(key, dict.fromkeys(fields, 0))
+        for field in fields:
+            total[field] += doc.get(field, 0)
+
+    return [
+        UpdateOne(
+            filter=dict(zip(key_fields, key)),
+            update={"$inc": total},
+            upsert=True,
+        )
+        for key, total in increments.items()
+    ]
+
+
+def _build_append_operations(
+    docs: list[Mapping], key_fields: list[str], fields: list[str]
+) -> list[UpdateOne]:
+    """Append values of `fields` to arrays stored under the same key."""
+    appends: dict[tuple, dict[str, list]] = {}
+    for doc in docs:
+        key = tuple(doc[field] for field in key_fields)
+        values = appends.setdefault(key, {field: [] for field in fields})
+        for field in fields:
+            values[field].append(doc[field])
+
+    return [
+        UpdateOne(
+            filter=dict(zip(key_fields, key)),
+            update={"$push": {field: {"$each": v} for field, v in values.items()}},
+            upsert=True,
+        )
+        for key, values in appends.items()
+    ]
+
+
+def _build_projection(fields: Optional[list[str]]) -> dict[str, bool] | None:
+    if fields is None:
+        return None
+    # _id is returned by default, even if it's not asked for
+    return {"_id": "_id" in fields} | {field: True for field in fields}
+
+
+def _format_bulk_response(response) -> str:
+    return (
+        f"Inserted {response.inserted_count + response.upserted_count}, "
+        f"updated {response.modified_count} objects."
+    )
+
+
+def _build_write_result(
+    response: BulkWriteResult, operations: list[InsertOne | UpdateOne], docs: list[dict]
+) -> WriteResult:
+    """Upserts that matched an existing document only updated it, the rest are new."""
+    inserted = [
+        doc
+        for i, (operation, doc) in enumerate(zip(operations, docs))
+        if isinstance(operation, InsertOne) or i in response.upserted_ids
+    ]
+    return WriteResult(_format_bulk_response(response), inserted)
+
+
 class MongoRepository:
     def __init__(
         self,
@@ -18,11 +132,14 @@ class MongoRepository:
         passwd: str,
         ip: str,
         port: int = 27017,
+        key_fields: Optional[list[str]] = None,
         **kwargs,
     ) -> None:
+        """key_fields: natural key of a document, i.e. ["chat_id", "msg_id"]"""
         self._db_uri = f"mongodb://{user}:{passwd}@{ip}:{port}"
         self.table_name = table_name
         self.collection_name = collection_name
+        self.key_fields = key_fields
 
     def connect(self) -> None:
         logger.info("Connecting to MongoDB...")
@@ -34,6 +151,7 @@ class MongoRepository:
         self._is_connected()
         db = self.client.get_database(self.table_name)
         self.collection = db.get_collection(self.collection_name)
+        self._create_index()
         logger.info("Connection to MongoDB established.")
 
     def _is_connected(self) -> bool:
@@ -42,38 +160,200 @@ class MongoRepository:
         except ServerSelectionTimeoutError:
             logger.critical("Failed to connect to the server.")
 
+    def _create_index(self) -> None:
+        if not self.key_fields:
+            return
+        try:
+            # no-op if the index already exists
+            self.collection.create_index(
+                [(field, ASCENDING) for field in self.key_fields], unique=True
+            )
+        except OperationFailure:
+            logger.exception(
+                f"Failed to create unique index on {self.key_fields}. "
+                "Collection probably already has duplicates, remove them first."
+            )
+
     def disconnect(self) -> None:
         self.client.close()
         logger.info("MongoDB connection closed.")
 
-    def _convert_message_to_document(self, message: Mapping) -> dict:
-        return {str(key): val for key, val in message.items() if val}
-
     def put_one(self, object: Mapping) -> str:
-        document = self._convert_message_to_document(object)
+        document = _convert_message_to_document(object)
         if document:  # no need to put empty docs
-            response = self.collection.insert_one(document)
-            return f"Record ID: {response.inserted_id}."
+            operations, _ = _build_write_operations([document], self.key_fields)
+            response = self.collection.bulk_write(operations)
+            return _format_bulk_response(response)
         else:
             logger.warning("Document was empty. Skipping inserting to MongoDB...")
             return "Skipped empty"
 
-    def put_many(self, objects: list[Mapping]) -> str:
-        docs = [self._convert_message_to_document(msg) for msg in objects]
+    def put_many(self, objects: list[Mapping]) -> WriteResult | str:
+        docs = [_convert_message_to_document(msg) for msg in objects]
         non_empty_docs = [doc for doc in docs if doc]  # filter out empty docs
         if docs != non_empty_docs:
             num_of_empty_docs = len(docs) - len(non_empty_docs)
             logger.warning(f"Skipping {num_of_empty_docs} empty documents...")
         if non_empty_docs:  # can't put an empty list to MongoDB
-            response = self.collection.insert_many(non_empty_docs)
-            return f"Inserted {len(non_empty_docs)} objects. {response}"
+            operations, written = _build_write_operations(non_empty_docs, self.key_fields)
+            # unordered, so one bad document doesn't stop the rest of the batch
+            response = self.collection.bulk_write(operations, ordered=False)
+            return _build_write_result(response, operations, written)
         else:
             logger.error(
                 "Can't put an empty list to a database. Skipping inserting to MongoDB..."
             )
             return "Failed to insert any document"
 
+    def increment_many(self, objects: list[Mapping], fields: list[str]) -> str:
+        if not objects:
+            return "Nothing to increment"
+        response = self.collection.bulk_write(
+            _build_increment_operations(objects, self.key_fields, fields),
+            ordered=False,
+        )
+        return _format_bulk_response(response)
+
+    def append_many(self, objects: list[Mapping], fields: list[str]) -> str:
+        if not objects:
+            return "Nothing to append"
+        response = self.collection.bulk_write(
+            _build_append_operations(objects, self.key_fields, fields),
+            ordered=False,
+        )
+        return _format_bulk_response(response)
+
+    def drop(self) -> None:
+        self.collection.drop()
+        # upserts rely on the unique index
+        self._create_index()
+
     def get_all(self) -> list[Mapping]:
         objects_list = list(self.collection.find())
 
         return objects_list
+
+    def iter_all(
+        self, batch_size: int = 1000, projection: Optional[list[str]] = None
+    ) -> Iterator[Mapping]:
+        yield from self.collection.find(
+            projection=_build_projection(projection), batch_size=batch_size
+        )
+
+
+class AsyncMongoRepository:
+    """Same as MongoRepository, but uses motor to not block the event loop"""
+
+    def __init__(
+        self,
+        table_name: str,
+        collection_name: str,
+        user: str,
+        passwd: str,
+        ip: str,
+        port: int = 27017,
+        key_fields: Optional[list[str]] = None,
+        **kwargs,
+    ) -> None:
+        self._db_uri = f"mongodb://{user}:{passwd}@{ip}:{port}"
+        self.table_name = table_name
+        self.collection_name = collection_name
+        self.key_fields = key_fields
+
+    async def connect(self) -> None:
+        logger.info("Connecting to MongoDB...")
+        # motor client has to be created inside the running event loop
+        self.client = AsyncIOMotorClient(
+            self._db_uri,
+            serverSelectionTimeoutMS=10000,  # 10 seconds
+        )
+        await self._is_connected()
+        db = self.client.get_database(self.table_name)
+        self.collection = db.get_collection(self.collection_name)
+        await self._create_index()
+        logger.info("Connection to MongoDB established.")
+
+    async def _is_connected(self) -> bool:
+        try:
+            await self.client.server_info()
+        except ServerSelectionTimeoutError:
+            logger.critical("Failed to connect to the server.")
+
+    async def _create_index(self) -> None:
+        if not self.key_fields:
+            return
+        try:
+            await self.collection.create_index(
+                [(field, ASCENDING) for field in self.key_fields], unique=True
+            )
+        except OperationFailure:
+            logger.exception(
+                f"Failed to create unique index on {self.key_fields}. "
+                "Collection probably already has duplicates, remove them first."
+            )
+
+    async def disconnect(self) -> None:
+        self.client.close()
+        logger.info("MongoDB connection closed.")
+
+    async def put_one(self, object: Mapping) -> str:
+        document = _convert_message_to_document(object)
+        if document:  # no need to put empty docs
+            operations, _ = _build_write_operations([document], self.key_fields)
+            response = await self.collection.bulk_write(operations)
+            return _format_bulk_response(response)
+        else:
+            logger.warning("Document was empty. Skipping inserting to MongoDB...")
+            return "Skipped empty"
+
+    async def put_many(self, objects: list[Mapping]) -> WriteResult | str:
+        docs = [_convert_message_to_document(msg) for msg in objects]
+        non_empty_docs = [doc for doc in docs if doc]  # filter out empty docs
+        if docs != non_empty_docs:
+            num_of_empty_docs = len(docs) - len(non_empty_docs)
+            logger.warning(f"Skipping {num_of_empty_docs} empty documents...")
+        if non_empty_docs:  # can't put an empty list to MongoDB
+            operations, written = _build_write_operations(non_empty_docs, self.key_fields)
+            response = await self.collection.bulk_write(operations, ordered=False)
+            return _build_write_result(response, operations, written)
+        else:
+            logger.error(
+                "Can't put an empty list to a database. Skipping inserting to MongoDB..."
+            )
+            return "Failed to insert any document"
+
+    async def increment_many(self, objects: list[Mapping], fields: list[str]) -> str:
+        if not objects:
+            return "Nothing to increment"
+        response = await self.collection.bulk_write(
+            _build_increment_operations(objects, self.key_fields, fields),
+            ordered=False,
+        )
+        return _format_bulk_response(response)
+
+    async def append_many(self, objects: list[Mapping], fields: list[str]) -> str:
+        if not objects:
+            return "Nothing to append"
+        response = await self.collection.bulk_write(
+            _build_append_operations(objects, self.key_fields, fields),
+            ordered=False,
+        )
+        return _format_bulk_response(response)
+
+    async def drop(self) -> None:
+        await self.collection.drop()
+        await self._create_index()
+
+    async def get_all(self) -> list[Mapping]:
+        objects_list = await self.collection.find().to_list(length=None)
+
+        return objects_list
+
+    async def iter_all(
+        self, batch_size: int = 1000, projection: Optional[list[str]] = None
+    ) -> AsyncIterator[Mapping]:
+        cursor = self.collection.find(
+            projection=_build_projection(projection), batch_size=batch_size
+        )
+        async for document in cursor:
+            yield document
@@ -0,0 +1,68 @@
+"""Adapter that makes any synchronous repository awaitable"""
+
+import asyncio
+import functools
+import itertools
+import logging
+from collections.abc import AsyncIterator, Callable, Mapping
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+from utils.repo.interface import Repository, WriteResult
+
+logger = logging.getLogger(__name__)
+
+
+class ThreadedRepository:
+    def __init__(self, repository: Repository, max_workers: int = 1) -> None:
+        """
+        Calls are executed in a thread pool, so they don't block the event loop.
+        With a single worker calls are executed one by one in the order they were made,
+        which is what file-based repositories need.
+        """
+        self.repository = repository
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix=type(repository).__name__,
+        )
+
+    async def _run[T](self, func: Callable[..., T], *args: Any) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args))
+
+    async def connect(self) -> None:
+        await self._run(self.repository.connect)
+
+    async def _is_connected(self) -> bool:
+        return await self._run(self.repository._is_connected)
+
+    async def disconnect(self) -> None:
+        await self._run(self.repository.disconnect)
+        self._executor.shutdown(wait=True)
+
+    async def put_one(self, object: Mapping) -> str:
+        return await self._run(self.repository.put_one, object)
+
+    async def put_many(self, objects: list[Mapping]) -> WriteResult | str:
+        return await self._run(self.repository.put_many, objects)
+
+    async def increment_many(self, objects: list[Mapping], fields: list[str]) -> str:
+        return await self._run(self.repository.increment_many, objects, fields)
+
+    async def append_many(self, objects: list[Mapping], fields: list[str]) -> str:
+        return await self._run(self.repository.append_many, objects, fields)
+
+    async def drop(self) -> None:
+        await self._run(self.repository.drop)
+
+    async def get_all(self) -> list[Mapping]:
+        return await self._run(self.repository.get_all)
+
+    async def iter_all(
+        self, batch_size: int = 1000, projection: Optional[list[str]] = None
+    ) -> AsyncIterator[Mapping]:
+        iterator = iter(self.repository.iter_all(batch_size, projection))
+        # pull a batch at a time, so the event loop isn't blocked by reading
+        while batch := await self._run(list, itertools.islice(iterator, batch_size)):
+            for document in batch:
+                yield document
@@ -0,0 +1,78 @@
+"""
+Term frequency rollups, counted while messages are ingested.
+
+For every term and 30-minute bucket (and chat) the rollup keeps the number of
+messages that contain the term, so a trend of a word is a lookup over a few
+hundred small documents instead of a scan over all message texts.
+"""
+
+import logging
+from collections import Counter
+from collections.abc import Mapping
+from datetime import datetime, timedelta, timezone
+
+from utils.repo.interface import AsyncRepository
+from utils.text import terms
+
+logger = logging.getLogger(__name__)
+
+BUCKET_SIZE = timedelta(minutes=30)
+
+
+def floor_bucket(date: datetime) -> datetime:
+    """Start of the bucket the date falls into (UTC)."""
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    timestamp = date.timestamp()
+    return datetime.fromtimestamp(
+        timestamp - timestamp % BUCKET_SIZE.total_seconds(), tz=timezone.utc
+    )
+
+
+def rollup_key(per_chat: bool = True) -> list[str]:
+    return ["term", "bucket", "chat_id"] if per_chat else ["term", "bucket"]
+
+
+class TermRollup:
+    def __init__(self, repository: AsyncRepository, per_chat: bool = True) -> None:
+        """
+        Repository should upsert by `rollup_key(per_chat)` and support `increment_many`.
+        per_chat: keep separate counts for every chat
+        """
+        self.repository = repository
+        self.per_chat = per_chat
+
+    def count(self, documents: list[Mapping]) -> Counter[tuple]:
+        """Number of messages with a term for every (term, bucket[, chat_id])."""
+        counts = Counter()
+        for doc in documents:
+            if not doc.get("msg") or doc.get("date") is None:
+                continue
+            bucket = floor_bucket(doc["date"])
+            chat = (doc.get("chat_id"),) if self.per_chat else ()
+            # a message counts once, no matter how many times a term is repeated
+            for term in terms(doc["msg"]):
+                counts[(term, bucket, *chat)] += 1
+        return counts
+
+    async def commit(self, documents: list[Mapping]) -> None:
+        """
+        Add terms of documents to the rollup. Writers pass only messages
+        that weren't stored before, so ingesting a message again
+        (i.e. by both parsers) doesn't count it twice.
+        """
+        key_fields = rollup_key(self.per_chat)
+        increments = [
+            dict(zip(key_fields, key)) | {"count": count}
+            for key, count in self.count(documents).items()
+        ]
+        if not increments:
+            return
+
+        try:
+            response = await self.repository.increment_many(increments, ["count"])
+        except Exception:
+            # not critical for messages themselves, trend just misses them
+            logger.exception(f"Failed to update rollups for {len(documents)} messages.")
+            return
+        logger.debug(f"Rollups of {len(documents)} messages updated. {response}")
@@ -0,0 +1,127 @@
+"""
+Inverted full-text index of messages.
+
+For every term and day the index keeps a list of chunks of postings:
+sorted ids of messages with the term, delta-encoded as varints (message ids
+of the same chat are close, so most deltas take 1-2 bytes instead of 8).
+Every batch of saved messages appends one chunk per term, so the index is
+updated incrementally, and the dashboard (dashboard/utils/search.py) merges
+chunks and intersects/unites postings to answer boolean and phrase queries.
+"""
+
+import logging
+from collections import defaultdict
+from collections.abc import Iterable, Mapping
+from datetime import datetime, timezone
+
+from utils.repo.interface import AsyncRepository
+from utils.text import terms
+
+logger = logging.getLogger(__name__)
+
+INDEX_KEY = ["term", "day"]
+
+
+def doc_id(chat_id: int, msg_id: int) -> int:
+    """
+    Single integer for a message: unmarked chat id in high 32 bits, msg id in low 32,
+    so the dashboard can decode it with numpy.
+    Channel and group ids fit, but user ids (private dialogs) already go above
+    2^32, so ValueError is raised for them instead of silently overflowing.
+    """
+    if not (0 <= chat_id <= 0xFFFFFFFF and 0 <= msg_id <= 0xFFFFFFFF):
+        raise ValueError(f"Message {msg_id} of chat {chat_id} doesn't fit into an id.")
+    return chat_id << 32 | msg_id
+
+
+def doc_key(doc_id: int) -> tuple[int, int]:
+    """(chat_id, msg_id) of a message."""
+    return doc_id >> 32, doc_id & 0xFFFFFFFF
+
+
+def encode_postings(doc_ids: Iterable[int]) -> bytes:
+    """Sorted unique ids as varints: the first one as is, then differences."""
+    encoded = bytearray()
+    previous = 0
+    for value in doc_ids:
+        delta = value - previous
+        previous = value
+        while delta >= 0x80:
+            encoded.append(delta & 0x7F | 0x80)
+            delta >>= 7
+        encoded.append(delta)
+    return bytes(encoded)
+
+
+def decode_postings(data: bytes) -> list[int]:
+    doc_ids = []
+    value = shift = previous = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        previous += value
+        doc_ids.append(previous)
+        value = shift = 0
+    return doc_ids
+
+
+def floor_day(date: datetime) -> datetime:
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.astimezone(timezone.utc).replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+
+
+class SearchIndexWriter:
+    def __init__(self, repository: AsyncRepository) -> None:
+        """Repository should upsert by INDEX_KEY and support `append_many`."""
+        self.repository = repository
+
+    @staticmethod
+    def build_chunks(documents: list[Mapping]) -> list[dict]:
+        postings: dict[tuple[str, datetime], set[int]] = defaultdict(set)
+        skipped = 0
+        for doc in documents:
+            if not doc.get("msg") or doc.get("chat_id") is None:
+                continue
+            if doc.get("msg_id") is None or doc.get("date") is None:
+                continue
+            try:
+                message_id = doc_id(doc["chat_id"], doc["msg_id"])
+            except ValueError:
+                skipped += 1
+                continue
+            day = floor_day(doc["date"])
+            for term in terms(doc["msg"]):
+                postings[(term, day)].add(message_id)
+
+        if skipped:
+            logger.warning(f"{skipped} messages of chats with ids above 2^32 skipped.")
+
+        return [
+            {
+                "term": term,
+                "day": day,
+                "chunks": encode_postings(sorted(doc_ids)),
+                # number of ids in a chunk, so chunks can be decoded all at once
+                "counts": len(doc_ids),
+            }
+            for (term, day), doc_ids in postings.items()
+        ]
+
+    async def commit(self, documents: list[Mapping]) -> None:
+        """Add newly saved documents to the index."""
+        chunks = self.build_chunks(documents)
+        if not chunks:
+            return
+
+        try:
+            response = await self.repository.append_many(chunks, ["chunks", "counts"])
+        except Exception:
+            # messages are saved anyway, they just can't be found by search
+            logger.exception(f"Failed to index {len(documents)} messages.")
+            return
+        logger.debug(f"{len(documents)} messages indexed. {response}")
@@ -0,0 +1,29 @@
+"""
+Splitting message texts into terms for counting and search.
+"""
+
+import re
+
+# letters, digits and underscores in any language, so "Київ" is a single token,
+# and apostrophes inside a word, so "пам'ять" is too
+TOKEN_PATTERN = re.compile(r"\w+(?:'\w+)*")
+# the same word is written with different apostrophes
+APOSTROPHES = str.maketrans("ʼ’", "''")
+# single letters and digits are too common to be useful
+MIN_TOKEN_LENGTH = 2
+
+
+def tokenize(text: str | None) -> list[str]:
+    """Lowercase tokens in the order they appear in the text (with repeats)."""
+    if not text:
+        return []
+    return [
+        token
+        for token in TOKEN_PATTERN.findall(text.lower().translate(APOSTROPHES))
+        if len(token) >= MIN_TOKEN_LENGTH
+    ]
+
+
+def terms(text: str | None) -> set[str]:
+    """Unique tokens of a text."""
+    return set(tokenize(text))